@@ -0,0 +1,354 @@
+"""asyncombiserver.py: asyncio client for the ombi api, same calls and results as OmbiServer."""
+
+import aiohttp
+import asyncio
+import json
+import time
+import functools
+import logging
+from ombiserver import httpErrors, HTTP_MethodError, parse_movies, parse_movie_info, parse_movie_requests, parse_request, OMBI_LATENCY, OMBI_STATUS
+from ombiserver import parse_shows, parse_show_info, season_key, tv_request
+from models import MovieList
+from responsecache import make_key, MOVIE_ENDPOINTS
+from singleflight import AsyncSingleFlight
+from streamjson import parse_movies_astream
+from ratelimit import retry_after
+from circuitbreaker import CircuitOpenError
+import deadline
+log = logging.getLogger(__name__)
+
+def lookup(endpoint):
+    """ Serve a lookup from the cache, and let concurrent identical lookups share one call to ombi.
+        Each caller waits for it as long as its own budget allows and falls back to an expired entry
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, term, languageCode='en'):
+            key = make_key(endpoint, term, languageCode)
+            output = self._cached(key)
+            if output is not None:
+                return self._fresh(key, output)
+
+            async def fetch():
+                output = await func(self, term, languageCode)
+                self._store(key, output)
+                return output
+
+            try:
+                return self._fresh(key, await self.flight.do(key, fetch))
+            except (HTTP_MethodError, CircuitOpenError, asyncio.TimeoutError) as e:
+                output = self._cached(key, stale=True)
+                if output is None:
+                    raise
+                log.info("Returning expired %s for %s: %s", endpoint,term,e)
+                return self._fresh(key, output)
+        return wrapper
+    return decorator
+
+class AsyncOmbiServer(object):
+    def __init__(self, server, apikey, port=5000, baseUrl='/ombi', userName='guest',
+                 poolSize=10, maxConnections=10, keepAlive=60, connectTimeout=5, readTimeout=30, cache=None,
+                 streaming=True, chunkSize=65536, maxResults=None, index=None, availability=None,
+                 maxRetries=3, maxBackoff=30, breaker=None):
+        self.api_key        = apikey
+        self.userName       = userName
+        self.endpoint       = server + ':' + str(port) + baseUrl + '/api/v1'
+        self.poolSize       = poolSize
+        self.maxConnections = maxConnections
+        self.keepAlive      = keepAlive
+        self.timeout        = aiohttp.ClientTimeout(sock_connect=connectTimeout, sock_read=readTimeout)
+        # optional ResponseCache, may be shared with the sync client
+        self.cache          = cache
+        self.flight         = AsyncSingleFlight()
+        self.streaming      = streaming
+        self.chunkSize      = chunkSize
+        self.maxResults     = maxResults
+        self.index          = index
+        self.availability   = availability
+        self.maxRetries     = maxRetries
+        self.maxBackoff     = maxBackoff
+        self.pausedUntil    = 0
+        self.throttled      = 0
+        self.breaker        = breaker
+
+        self.headers = {
+            'http.useragent' : 'ombi-server',
+            'ApiKey'         : self.api_key,
+            'Content-Type'   : 'application/json',
+            'Accept-Encoding': 'gzip',
+            'User-Agent'     : 'Ombi/server'
+        }
+
+        # the session has to be created inside the event loop, see _get_session
+        self.session = None
+
+        log.info("Async endpoint is %s", self.endpoint)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.poolSize * self.maxConnections,
+                                             limit_per_host=self.maxConnections,
+                                             keepalive_timeout=self.keepAlive)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _request(self, method, url, payload=None, headers=None):
+        """ Send a request, waiting and retrying when ombi answers 429. The caller releases the response.
+            What is left of the budget of the update bounds the whole call, reading the body included,
+            asyncio.TimeoutError is raised when it runs out
+        """
+        data = json.dumps(payload) if payload is not None else None
+        for attempt in range(self.maxRetries + 1):
+            left = deadline.remaining()
+            if left is not None and left <= 0:
+                raise asyncio.TimeoutError()
+            pause = self.pausedUntil - time.monotonic()
+            if pause > 0:
+                if left is not None and left < pause:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(pause)
+            if self.breaker:
+                self.breaker.allow()
+            timeout = self.timeout
+            if left is not None:
+                timeout = aiohttp.ClientTimeout(total=left - max(0, pause), sock_connect=self.timeout.sock_connect,
+                                                sock_read=self.timeout.sock_read)
+            start = time.monotonic()
+            try:
+                r = await self._get_session().request(method, url, headers=headers, data=data, timeout=timeout)
+            except BaseException:
+                # failed, timed out or cancelled by the deadline of the update
+                if self.breaker:
+                    self.breaker.failure()
+                OMBI_STATUS.inc('error', 'Connection error')
+                raise
+            OMBI_STATUS.inc(str(r.status), httpErrors.get(r.status, 'Unknown'))
+            if self.breaker:
+                if r.status >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success(time.monotonic() - start)
+            if r.status != 429 or attempt == self.maxRetries:
+                return r
+
+            delay = min(self.maxBackoff, retry_after(r.headers.get('Retry-After'), 2 ** attempt))
+            log.warning("Ombi answered 429 Too Many Requests, waiting %.1f s", delay)
+            r.release()
+            self.throttled += 1
+            self.pausedUntil = max(self.pausedUntil, time.monotonic() + delay)
+
+    async def _send(self, method, url, payload=None, headers=None):
+        """ Send a request and return the status code and the decoded json body
+        """
+        try:
+            async with await self._request(method, url, payload, headers) as r:
+                log.debug("HTTP %s: %s", r.status,httpErrors.get(r.status))
+                if r.status != 200:
+                    log.error("Unable to handle request to %s: %s, %s", url,r.status,await r.text())
+                    return r.status, None
+                return r.status, await r.json(content_type=None)
+        except (CircuitOpenError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+
+    async def _search(self, method, url, payload=None):
+        """ Send a search and parse the list of results, from the body as it arrives when streaming
+        """
+        if not self.streaming:
+            status, parsedata = await self._send(method, url, payload)
+            return parse_movies(parsedata, self.maxResults) if parsedata else MovieList()
+
+        try:
+            async with await self._request(method, url, payload) as r:
+                log.debug("HTTP %s: %s", r.status,httpErrors.get(r.status))
+                if r.status != 200:
+                    log.error("Unable to handle request to %s: %s, %s", url,r.status,await r.text())
+                    return MovieList()
+                return await parse_movies_astream(r.content.iter_chunked(self.chunkSize), self.maxResults)
+        except ValueError as e:
+            log.error("Unable to process search: %s", e)
+            return MovieList()
+        except (CircuitOpenError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+
+    def _cached(self, key, stale=False):
+        return self.cache.get(key, stale) if self.cache else None
+
+    def _fresh(self, key, output):
+        if self.availability is not None and output and key[0] in MOVIE_ENDPOINTS:
+            if key[0] == 'info':
+                return self.availability.apply([output])[0]
+            flagged = MovieList()
+            for movie in self.availability.apply(output.values()):
+                flagged.add(movie)
+            return flagged
+        return output
+
+    def _store(self, key, output):
+        if self.cache and output:
+            self.cache.set(key, output)
+        if self.index is not None and output and key[0] in MOVIE_ENDPOINTS and key[0] != 'info':
+            self.index.add(output.values())
+
+    @OMBI_LATENCY.time('search_movies')
+    @lookup('search')
+    async def search_movies(self, title,languageCode='en'):
+        """ Search movies by title
+        """
+        log.info("Searching for movies with title = %s", title)
+        output = await self._search('GET', self.endpoint + '/Search/movie/' + str(title))
+        log.info("Returning %s records", len(output))
+        return output
+
+    @OMBI_LATENCY.time('search_movies_actor')
+    @lookup('actor')
+    async def search_movies_actor(self, actor,languageCode='en'):
+        """ Search movies by actor
+        """
+        log.info("Searching for movies with actor = %s", actor)
+        payload = {
+            "searchTerm": actor,
+            "languageCode": "en"
+        }
+        output = await self._search('POST', self.endpoint + '/Search/movie/actor', payload)
+        log.info("Returning %s records", len(output))
+        return output
+
+    @OMBI_LATENCY.time('request_movie')
+    async def request_movie(self, movieID,user,languageCode='en'):
+        """ Request a movie for an ombi user
+        """
+        log.info("Request movie with id =  %s", movieID)
+        payload = {
+            'theMovieDbId': int(movieID),
+            'languageCode': 'en'
+        }
+        status, response = await self._send('POST', self.endpoint + '/Request/movie', payload, headers={'UserName' : user})
+        if status == 200:
+            if response.get('result'):
+                if self.cache:
+                    self.cache.update_movie(movieID, requested=True)
+                if self.availability is not None:
+                    self.availability.mark(movieID, requested=True)
+            return parse_request(response)
+        return False
+
+    @OMBI_LATENCY.time('get_movie_requests')
+    async def get_movie_requests(self):
+        """ Get all movie requests, with their availability
+        """
+        status, parsedata = await self._send('GET', self.endpoint + '/Request/movie')
+        output = parse_movie_requests(parsedata) if parsedata else MovieList()
+        log.info("Returning %s requests", len(output))
+        return output
+
+    @OMBI_LATENCY.time('find_similar')
+    @lookup('similar')
+    async def find_similar(self, movieID,languageCode='en'):
+        """ Get similar movies from server
+        """
+        payload = {
+            'theMovieDbId': int(movieID),
+            'languageCode': 'en'
+        }
+        output = await self._search('POST', self.endpoint + '/Search/movie/similar', payload)
+        log.info("Returning %s records", len(output))
+        return output
+
+    @OMBI_LATENCY.time('get_movie_info')
+    @lookup('info')
+    async def get_movie_info(self, movieID,languageCode='en'):
+        """ Get extra movie information from server
+        """
+        log.debug("Got id: %s", movieID)
+        payload = {
+            'theMovieDbId': int(movieID),
+            'languageCode': 'en'
+        }
+        status, parsedata = await self._send('POST', self.endpoint + '/Search/movie/info', payload)
+        output = parse_movie_info(parsedata)
+        log.info("Returning %s", output)
+        return output
+
+    @OMBI_LATENCY.time('search_series')
+    @lookup('tv')
+    async def search_series(self, title,languageCode='en'):
+        """ Search tv shows by title, without their seasons
+        """
+        log.info("Searching for series with title = %s", title)
+        status, parsedata = await self._send('GET', self.endpoint + '/Search/tv/' + str(title))
+        output = parse_shows(parsedata, self.maxResults) if parsedata else MovieList()
+        log.info("Returning %s shows", len(output))
+        return output
+
+    async def _load_show(self, showID, languageCode='en'):
+        """ Get a show with all its seasons, the seasons are cached on their own
+        """
+        status, parsedata = await self._send('GET', self.endpoint + '/Search/tv/info/' + str(int(showID)))
+        info, seasons = parse_show_info(parsedata)
+        for season in seasons:
+            self._store(season_key(showID, season.number, languageCode), season)
+        log.info("Show %s has %s seasons", showID,len(seasons))
+        return info, seasons
+
+    @OMBI_LATENCY.time('get_series_info')
+    @lookup('tvinfo')
+    async def get_series_info(self, showID,languageCode='en'):
+        """ Get a show and a summary of its seasons, the episodes are loaded by get_season
+        """
+        info, seasons = await self._load_show(showID, languageCode)
+        return info
+
+    @OMBI_LATENCY.time('get_season')
+    async def get_season(self, showID, seasonNumber, languageCode='en'):
+        """ Get the episodes of one season, loading the show again when the season is not cached
+        """
+        key = season_key(showID, seasonNumber, languageCode)
+        season = self._cached(key)
+        if season is not None:
+            return season
+
+        async def fetch():
+            info, seasons = await self._load_show(showID, languageCode)
+            self._store(make_key('tvinfo', showID, languageCode), info)
+            return next((season for season in seasons if season.number == int(seasonNumber)), None)
+
+        try:
+            return await self.flight.do(key, fetch)
+        except (HTTP_MethodError, CircuitOpenError, asyncio.TimeoutError):
+            season = self._cached(key, stale=True)
+            if season is None:
+                raise
+            return season
+
+    @OMBI_LATENCY.time('request_series')
+    async def request_series(self, showID, user, seasons=None):
+        """ Request a show for an ombi user in one call, seasons maps season numbers to episodes
+        """
+        log.info("Request series with id = %s, seasons = %s", showID,sorted(seasons) if seasons else 'all')
+        status, response = await self._send('POST', self.endpoint + '/Request/tv', tv_request(showID, seasons),
+                                            headers={'UserName' : user})
+        if status != 200:
+            return False
+        if response.get('result') and self.cache:
+            show = str(int(showID))
+            self.cache.discard(lambda key: key[0] in ('tvinfo', 'season') and key[1].split()[0] == show)
+        return parse_request(response)
+
+    async def request_season(self, showID, seasonNumber, user):
+        """ Request the episodes of a season that are neither available nor requested, in one call
+        """
+        season = await self.get_season(showID, seasonNumber)
+        if season is None:
+            return False
+        episodes = season.missing()
+        if not episodes:
+            return 'Every episode of season {} is already available or requested'.format(seasonNumber)
+        return await self.request_series(showID, user, {season.number: episodes})
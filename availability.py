@@ -0,0 +1,68 @@
+"""availability.py: ids of available and requested movies, synced from ombi in bulk."""
+
+import time
+import threading
+import logging
+log = logging.getLogger(__name__)
+
+class AvailabilityIndex(object):
+    """ Sets of the movie ids ombi reports as available or requested. A sync replaces both sets
+        at once; requests made through the bot are kept apart until the next sync. Flags are only
+        ever added to results, a movie missing here may still be in the library without a request.
+    """
+    def __init__(self):
+        self.available       = frozenset()
+        self.requested       = frozenset()
+        # changes made through the bot since the last sync, a few ids that replace() clears
+        self.markedAvailable = set()
+        self.markedRequested = set()
+        self.synced          = None
+        self.lock            = threading.Lock()
+
+    def replace(self, movies):
+        """ Take the flags of a full list of movies, e.g. all movie requests
+        """
+        available = frozenset(movie.id for movie in movies if movie.available)
+        requested = frozenset(movie.id for movie in movies if movie.requested)
+        with self.lock:
+            self.available = available
+            self.requested = requested
+            self.markedAvailable.clear()
+            self.markedRequested.clear()
+            self.synced    = time.time()
+        log.info("Availability: %s available, %s requested", len(available),len(requested))
+
+    def mark(self, movieID, available=False, requested=False):
+        """ Record a change made through the bot until the next sync confirms it
+        """
+        movieID = int(movieID)
+        with self.lock:
+            if available:
+                self.markedAvailable.add(movieID)
+            if requested:
+                self.markedRequested.add(movieID)
+
+    def status(self, movieID):
+        """ (available, requested) of a movie as far as known
+        """
+        movieID = int(movieID)
+        return (movieID in self.available or movieID in self.markedAvailable,
+                movieID in self.requested or movieID in self.markedRequested)
+
+    def apply(self, movies):
+        """ The result records with the flags of known movies set. Records may be shared through
+            the cache and are not changed, one that lacks a flag is replaced by a copy with it
+        """
+        available, requested = self.available, self.requested
+        output = []
+        for movie in movies:
+            isAvailable = movie.id in available or movie.id in self.markedAvailable
+            isRequested = movie.id in requested or movie.id in self.markedRequested
+            if (isAvailable and not movie.available) or (isRequested and not movie.requested):
+                movie = movie.replace(available=movie.available or isAvailable, requested=movie.requested or isRequested)
+            output.append(movie)
+        return output
+
+    def __len__(self):
+        with self.lock:
+            return len(self.available | self.requested | self.markedAvailable | self.markedRequested)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+
+"""bench_bot.py: load test of the bot's conversation against a fake ombi and a fake telegram.
+
+    python3 benchmarks/bench_bot.py --users 50 --rounds 5 --latency 0.05
+    python3 benchmarks/bench_bot.py --users 50 --rounds 5 --latency 0.05 --async
+
+Everything runs in this process. Ombi is benchmarks/fake_ombi.py on a local port, bot api calls
+are answered by FakeBotApi without a network. bot.py is imported with a generated config.json in
+a temporary directory and synthetic Updates go through a Dispatcher holding the real
+ConversationHandler from bot.build_conversation(). Every simulated user walks through
+
+    /start -> Movie -> search -> movie info -> Back -> movie info -> Request -> End
+
+Reported: update to reply latency (p50, p99), updates per second, time per handler from the
+bot's own metrics and memory per open conversation.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import queue
+import random
+import argparse
+import tempfile
+import functools
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ombi import FakeOmbi
+from fake_telegram import FakeBotApi, percentile, message_update, callback_update
+from callbacks import encode, MOVIE, BACK, INFO, REQUEST, END
+
+BOT_TOKEN = '123456:bench'
+
+class LocalRequest(object):
+    """ Stands in for telegram.utils.request.Request, answering from a FakeBotApi
+    """
+    def __init__(self, api):
+        self.api = api
+
+    def post(self, url, data, timeout=None):
+        return self.api.answer(url.rsplit('/', 1)[-1], data)
+
+    def get(self, url, timeout=None):
+        return self.api.answer(url.rsplit('/', 1)[-1], {})
+
+    def stop(self):
+        pass
+
+def write_config(directory, ombiPort, args):
+    config = {
+        'apiKey': 'bench', 'botToken': BOT_TOKEN, 'server': 'http://127.0.0.1', 'port': ombiPort, 'baseUrl': '',
+        'users': {}, 'asyncClient': args.asyncClient, 'memoryReportInterval': 0,
+        'connection': {'poolSize': 10, 'maxConnections': max(10, args.workers)},
+        'rateLimit': {'enabled': False}, 'metrics': {'enabled': False}, 'logging': {'level': 'WARNING'},
+        'prefetch': {'enabled': args.prefetch}, 'scheduler': {'enabled': not args.noScheduler, 'ioWorkers': args.ioWorkers},
+    }
+    with open(os.path.join(directory, 'config.json'), 'w') as config_file:
+        json.dump(config, config_file)
+
+class ConversationDriver(object):
+    """ Puts updates on the dispatcher's queue and measures the time until the expected replies were sent
+    """
+    def __init__(self, api, dispatcher, fake, terms, timeout=30):
+        self.api        = api
+        self.dispatcher = dispatcher
+        self.fake       = fake
+        self.terms      = terms
+        self.timeout    = timeout
+        self.updateId   = random.randint(1, 1000000)
+        self.latencies  = []
+        self.timeouts   = 0
+        self.lock       = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            self.updateId += 1
+            return self.updateId
+
+    def send(self, update, chatId, replies=1):
+        from telegram import Update
+        event = self.api.expect_reply(chatId, replies)
+        start = time.perf_counter()
+        self.dispatcher.update_queue.put(Update.de_json(update, self.dispatcher.bot))
+        replied = event.wait(self.timeout)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            if replied:
+                self.latencies.append(elapsed)
+            else:
+                self.timeouts += 1
+
+    def open(self, chatId, term):
+        # /start -> Movie -> search, the conversation is left waiting for a movie to be picked
+        self.send(message_update(self.next_id(), chatId, '/start'), chatId)
+        self.send(callback_update(self.next_id(), chatId, encode(MOVIE)), chatId)
+        # "Found n results" and the keyboard
+        self.send(message_update(self.next_id(), chatId, term), chatId, replies=2)
+
+    def conversation(self, chatId, rounds):
+        for i in range(rounds):
+            term = random.choice(self.terms)
+            first, second = random.sample([movie['id'] for movie in self.fake.search(term)[:10]], 2)
+            self.open(chatId, term)
+            self.send(callback_update(self.next_id(), chatId, encode(INFO, first)), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(BACK)), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(INFO, second)), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(REQUEST, second)), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(END)), chatId)
+
+    def run(self, users, rounds):
+        threads = [threading.Thread(target=self.conversation, args=(1000 + i, rounds)) for i in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def memory(self, conversations):
+        """ Traced bytes per conversation left open after a search, with search results already cached
+        """
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(conversations):
+            self.open(100000 + i, self.terms[i % len(self.terms)])
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / float(conversations)
+
+def handler_times(histogram):
+    with histogram.lock:
+        values = [(labels[0], sum(counts), total) for labels, (counts, total) in histogram.values.items()]
+    return sorted(values)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='number of concurrent simulated users')
+    parser.add_argument('--rounds', type=int, default=5, help='conversations per user')
+    parser.add_argument('--terms', type=int, default=20, help='number of different search terms')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before fake ombi answers')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra ombi latency, up to this many seconds')
+    parser.add_argument('--results', type=int, default=50, help='results per search')
+    parser.add_argument('--result-size', type=int, default=2000, help='approximate bytes per search result')
+    parser.add_argument('--workers', type=int, default=4, help='threads of the dispatcher for run_async')
+    parser.add_argument('--async', dest='asyncClient', action='store_true', help='use the async ombi client')
+    parser.add_argument('--prefetch', action='store_true', help='prefetch movie info of the top results')
+    parser.add_argument('--io-workers', dest='ioWorkers', type=int, default=8, help='threads of the io pool')
+    parser.add_argument('--no-scheduler', dest='noScheduler', action='store_true',
+                        help='run every handler on the dispatcher thread')
+    parser.add_argument('--conversations', type=int, default=500, help='open conversations for the memory measurement')
+    args = parser.parse_args()
+
+    fake = FakeOmbi('127.0.0.1', 0, args.latency, args.jitter, args.results, args.result_size).start()
+    directory = tempfile.mkdtemp(prefix='ombibot-bench-')
+    write_config(directory, fake.port, args)
+    # bot.py reads config.json from the working directory when imported
+    os.chdir(directory)
+    import bot
+    import scheduler
+    from telegram import Bot, Update
+    from telegram.ext import Dispatcher, JobQueue, TypeHandler
+
+    api = FakeBotApi()
+    # jobs of the handlers, e.g. run_async results, need a job queue
+    jobQueue = JobQueue()
+    dispatcher = Dispatcher(Bot(BOT_TOKEN, request=LocalRequest(api)), queue.Queue(), workers=args.workers,
+                            job_queue=jobQueue, use_context=True)
+    jobQueue.set_dispatcher(dispatcher)
+    conversation = bot.build_conversation()
+    dispatcher.add_handler(TypeHandler(Update, functools.partial(bot.touch_user, conversation)), group=-2)
+    dispatcher.add_handler(conversation)
+    bot.sweeper.onExpire = lambda userId: bot.expire_user(dispatcher, conversation, None, userId)
+    errors = []
+    dispatcher.add_error_handler(lambda update, context: errors.append(context.error))
+    if bot.ioPool:
+        bot.ioPool.dispatcher = dispatcher
+    jobQueue.start()
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+
+    terms = ['movie {}'.format(i) for i in range(args.terms)]
+    driver = ConversationDriver(api, dispatcher, fake, terms)
+    elapsed = driver.run(args.users, args.rounds)
+
+    n = len(driver.latencies)
+    print("{} users, {} rounds, ombi latency {:.0f} ms, {} client".format(
+        args.users, args.rounds, 1000 * args.latency, 'async' if args.asyncClient else 'sync'))
+    print("updates: {}, timeouts: {}, elapsed: {:.2f} s, {:.1f} updates/s".format(
+        n, driver.timeouts, elapsed, n / elapsed if elapsed else 0))
+    print("update -> reply latency: p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+        *[1000 * percentile(driver.latencies, p) for p in (50, 90, 99, 100)]))
+    for name, count, total in handler_times(bot.HANDLER_LATENCY):
+        print("  {:20} {:6} calls, {:8.2f} ms per call".format(name, count, 1000 * total / count))
+    for name, count, total in handler_times(scheduler.POOL_WAIT):
+        print("  pool {:15} {:6} handlers, {:8.2f} ms waiting for a thread".format(name, count, 1000 * total / count))
+    print("ombi calls: {}".format(fake.calls))
+    if errors:
+        print("handler errors: {}, e.g. {!r}".format(len(errors), errors[0]))
+
+    print("memory: {:.0f} bytes per open conversation ({} conversations)".format(
+        driver.memory(args.conversations), args.conversations))
+
+    # every user as if idle for long enough
+    users = len(bot.sweeper)
+    start = time.perf_counter()
+    expired = bot.sweeper.sweep(time.monotonic() + 10 * 86400)
+    print("expiry: {} of {} users in {:.1f} ms, {} bytes of user data reclaimed, {} conversations left".format(
+        len(expired), users, 1000 * (time.perf_counter() - start), bot.sweeper.reclaimed, len(conversation.conversations)))
+
+    dispatcher.stop()
+    jobQueue.stop()
+    if bot.aombi:
+        asyncio.run_coroutine_threadsafe(bot.aombi.close(), bot.loop).result()
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
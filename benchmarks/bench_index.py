@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+
+"""bench_index.py: time suggestions from the title index, for common, short and mistyped queries.
+
+    python3 benchmarks/bench_index.py --titles 50000
+    python3 benchmarks/bench_index.py --titles 50000 --sync
+
+Titles are generated from a vocabulary where a few words (the, of, night...) are in many titles,
+like a real library. With --sync a thread keeps adding batches of titles while the queries run,
+the way the library sync and the search results add to the index of a running bot.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import MovieResult
+from titleindex import TitleIndex
+
+COMMON = ['the', 'of', 'night', 'star', 'wars', 'love', 'man', 'last', 'dark', 'city', 'house', 'return', 'a', 'in']
+QUERIES = ['th', 'the', 'star wa', 'night of the', 'the last', 'alien', 'godfathr', 'return of the jedi', 'zx']
+
+def make_titles(count):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = COMMON + [''.join(random.choice(letters) for _ in range(random.randint(3, 9))) for _ in range(5000)]
+    # word i is picked with a weight of 1 / (i + 1), the common words first
+    weights = [1.0 / (i + 1) for i in range(len(words))]
+    titles = [' '.join(random.choices(words, weights, k=random.randint(1, 5))).title() for _ in range(count)]
+    titles += ['Alien', 'Aliens', 'The Godfather', 'The Godfather Part II', 'Star Wars', 'Return of the Jedi']
+    return [MovieResult(i, title, False, False, None) for i, title in enumerate(titles)]
+
+def time_queries(index, repeat):
+    results = {}
+    for query in QUERIES:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = index.search(query)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        results[query] = (times[len(times) // 2], times[-1], output)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--titles', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--sync', action='store_true', help='add titles from another thread while searching')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    movies = make_titles(args.titles)
+    index = TitleIndex(maxMovies=len(movies) + args.titles)
+    start = time.perf_counter()
+    index.add(movies)
+    print("index: {} titles added in {:.0f} ms".format(len(index), 1000 * (time.perf_counter() - start)))
+
+    stop = threading.Event()
+    adds = []
+    def sync():
+        extra = make_titles(args.titles)
+        while not stop.is_set():
+            batch = random.sample(extra, 1000)
+            for i, movie in enumerate(batch):
+                batch[i] = MovieResult(len(movies) + movie.id, movie.title, False, False, None)
+            start = time.perf_counter()
+            index.add(batch)
+            adds.append(time.perf_counter() - start)
+    thread = threading.Thread(target=sync) if args.sync else None
+    if thread:
+        thread.start()
+    try:
+        results = time_queries(index, args.repeat)
+    finally:
+        stop.set()
+        if thread:
+            thread.join()
+
+    for query, (median, slowest, output) in results.items():
+        print("{:20} median {:6.3f} ms, slowest {:6.3f} ms, first: {}".format(
+            repr(query), 1000 * median, 1000 * slowest, output[0].title if output else '-'))
+    if adds:
+        print("sync: {} batches of 1000 titles, {:.1f} ms each".format(len(adds), 1000 * sum(adds) / len(adds)))
+
+if __name__ == '__main__':
+    main()
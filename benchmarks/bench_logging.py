@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+
+"""bench_logging.py: cpu spent on logging per ombi request, eager str.format against lazy arguments.
+
+    python3 benchmarks/bench_logging.py --results 200 --requests 2000
+
+Runs the log calls of one movie info lookup, one actor search and one movie request, the way
+ombiserver.py made them before (str.format on payloads, json.dumps and response bodies) and the
+way it makes them now (%-style arguments, Lazy, body()). Each is run with the root logger at
+INFO and at DEBUG, and at DEBUG once more behind the queue handler. Only the cpu time of the
+calling thread is counted, which is what an update handler pays.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+from logutil import Lazy, body, setup_logging
+
+log = logging.getLogger('ombiserver')
+
+def make_response(results):
+    words = ['the', 'night', 'of', 'return', 'last', 'dark', 'city', 'man', 'love', 'war', 'star', 'house']
+    movies = [{'id': 100000 + i, 'title': ' '.join(random.choice(words) for _ in range(3)).title(),
+               'available': False, 'requested': False, 'releaseDate': '2001-01-01T00:00:00',
+               'overview': ' '.join(random.choice(words) for _ in range(60))} for i in range(results)]
+    r = requests.models.Response()
+    r.status_code = 200
+    r.url = 'http://ombi.local/api/v1/Search/movie/actor'
+    r.encoding = 'utf-8'
+    r._content = json.dumps(movies).encode()
+    return r
+
+def eager(r, url, payload, headers):
+    # as in ombiserver.py before
+    log.info("Searching for movies with actor = {}".format(payload['searchTerm']))
+    log.info("Sending POST request to {} with data = {}, {}".format(url,payload,json.dumps(payload)))
+    log.debug("HTTP {}: {}".format(r.status_code,'OK'))
+    log.debug("Url = {}".format(r.url))
+    log.debug("Got id: {}".format(payload['theMovieDbId']))
+    log.debug("Sending POST request to {} with data = {}, {}".format(url,payload,json.dumps(payload)))
+    log.debug("Response = {}".format(r.text))
+    log.debug("Text = {}".format(r.text))
+    log.debug("Sending POST request to {} with headers = {}".format(url,headers))
+    log.debug("Response = {}".format(r.text))
+
+def lazy(r, url, payload, headers):
+    # as in ombiserver.py now
+    log.info("Searching for movies with actor = %s", payload['searchTerm'])
+    log.debug("Sending POST request to %s with data = %s", url,Lazy(json.dumps, payload))
+    log.debug("HTTP %s: %s", r.status_code,'OK')
+    log.debug("Url = %s", r.url)
+    log.debug("Got id: %s", payload['theMovieDbId'])
+    log.debug("Sending POST request to %s with data = %s", url,Lazy(json.dumps, payload))
+    log.debug("Response = %s", body(r))
+    log.debug("Sending POST request to %s with headers = %s", url,headers)
+    log.debug("Response = %s", body(r))
+
+def measure(func, requests, *args):
+    start = time.thread_time()
+    for i in range(requests):
+        func(*args)
+    return (time.thread_time() - start) / requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, default=200, help='search results in the response body')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    r = make_response(args.results)
+    payload = {'searchTerm': 'tom hanks', 'languageCode': 'en', 'theMovieDbId': 603}
+    headers = {'UserName': 'alice'}
+    print("response body {} kB".format(len(r.content) // 1024))
+
+    devnull = open(os.devnull, 'w')
+    sys.stderr, stderr = devnull, sys.stderr
+    rows = []
+    try:
+        for level, queue in (('INFO', False), ('DEBUG', False), ('DEBUG', True)):
+            listener = setup_logging({'level': level, 'queue': queue})
+            times = [measure(func, args.requests, r, 'http://ombi.local/api/v1/Search/movie/actor', payload, headers)
+                     for func in (eager, lazy)]
+            if listener:
+                listener.stop()
+            rows.append((level + (' + queue' if queue else ''), times))
+    finally:
+        sys.stderr = stderr
+    for name, (before, after) in rows:
+        print("{:14} before {:8.1f} us/request, now {:8.1f} us/request".format(name, 1e6 * before, 1e6 * after))
+
+if __name__ == '__main__':
+    main()
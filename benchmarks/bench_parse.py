@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+
+"""bench_parse.py: compare parsing ombi search responses in one go against the streaming parser.
+
+    python3 benchmarks/bench_parse.py --results 5000
+    python3 benchmarks/bench_parse.py --payload recorded_actor_search.json --max-results 100
+
+Without --payload a response with the given number of results is generated, each result padded
+like a real ombi search result (overview, posters, alternative titles...). The payload is read
+from disk the way it would come from the socket: all at once for the current path (r.json())
+and in chunks for the streaming path. Every method runs in its own process so the peak RSS is
+its own.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def make_payload(path, results):
+    words = ['the', 'night', 'of', 'return', 'last', 'dark', 'city', 'man', 'love', 'war', 'star', 'house']
+    movies = []
+    for i in range(results):
+        title = ' '.join(random.choice(words) for _ in range(3)).title() + ' ' + str(i)
+        movies.append({
+            'id': 100000 + i, 'title': title, 'originalTitle': title, 'originalLanguage': 'en',
+            'overview': ' '.join(random.choice(words) for _ in range(120)),
+            'posterPath': '/{:032x}.jpg'.format(random.getrandbits(128)),
+            'backdropPath': '/{:032x}.jpg'.format(random.getrandbits(128)),
+            'releaseDate': '{}-0{}-1{}T00:00:00'.format(random.randint(1950, 2020), random.randint(1, 9), random.randint(0, 9)),
+            'genreIds': [random.randint(1, 50) for _ in range(4)], 'popularity': random.random() * 100,
+            'voteCount': random.randint(0, 20000), 'voteAverage': round(random.random() * 10, 1),
+            'adult': False, 'video': False, 'alsoKnownAs': [title.upper(), title.lower()],
+            'available': random.random() < 0.2, 'requested': random.random() < 0.2, 'approved': False,
+            'imdbId': 'tt{:07d}'.format(i), 'theMovieDbId': str(100000 + i), 'type': 1,
+        })
+    with open(path, 'w') as f:
+        json.dump(movies, f)
+
+def run_current(path, maxResults, chunkSize):
+    from ombiserver import parse_movies
+    with open(path, 'rb') as f:
+        body = f.read()
+    return parse_movies(json.loads(body.decode('utf-8')), maxResults)
+
+def run_streaming(path, maxResults, chunkSize):
+    from streamjson import parse_movies_stream
+    with open(path, 'rb') as f:
+        return parse_movies_stream(iter(lambda: f.read(chunkSize), b''), maxResults)
+
+METHODS = {'current': run_current, 'streaming': run_streaming}
+
+def child(method, path, maxResults, chunkSize, repeat):
+    """ Run one method and print its numbers as json
+    """
+    import ombiserver, streamjson
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = METHODS[method](path, maxResults, chunkSize)
+        times.append(time.perf_counter() - start)
+        del output
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+
+    tracemalloc.start()
+    output = METHODS[method](path, maxResults, chunkSize)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(json.dumps({'results': len(output), 'time': min(times), 'peak': peak, 'rss': rss * 1024}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payload', help='recorded json response of an ombi search')
+    parser.add_argument('--results', type=int, default=5000, help='results in a generated payload')
+    parser.add_argument('--max-results', type=int, default=None, help='result cap, as maxResults in config.json')
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', choices=sorted(METHODS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.payload, args.max_results, args.chunk_size, args.repeat)
+        return
+
+    path = args.payload
+    generated = None
+    if not path:
+        generated = path = os.path.join(tempfile.mkdtemp(), 'search.json')
+        make_payload(path, args.results)
+    print("payload: {}, {:.1f} MB".format(path, os.path.getsize(path) / 1e6))
+
+    try:
+        for method in ('current', 'streaming'):
+            command = [sys.executable, __file__, '--child', method, '--payload', path,
+                       '--chunk-size', str(args.chunk_size), '--repeat', str(args.repeat)]
+            if args.max_results:
+                command += ['--max-results', str(args.max_results)]
+            result = json.loads(subprocess.check_output(command).decode().strip().splitlines()[-1])
+            print("{:10} results: {:6}, time: {:8.1f} ms, traced peak: {:8.1f} MB, peak rss growth: {:8.1f} MB".format(
+                method, result['results'], 1000 * result['time'], result['peak'] / 1e6, result['rss'] / 1e6))
+    finally:
+        if generated:
+            os.remove(generated)
+            os.rmdir(os.path.dirname(generated))
+
+if __name__ == '__main__':
+    main()
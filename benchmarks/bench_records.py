@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+
+"""bench_records.py: memory per search result, as a dict per row keyed by title against MovieResult records.
+
+    python3 benchmarks/bench_records.py --results 10000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import MovieResult, MovieList
+from session import SearchSession
+
+def make_results(results):
+    words = ['the', 'night', 'of', 'return', 'last', 'dark', 'city', 'man', 'love', 'war', 'star', 'house']
+    return [{'id': 100000 + i, 'title': ' '.join(random.choice(words) for _ in range(3)).title() + ' ' + str(i),
+             'available': random.random() < 0.2, 'requested': random.random() < 0.2,
+             'releaseDate': '{}-01-01T00:00:00'.format(random.randint(1950, 2020)), 'overview': 'x' * 400}
+            for i in range(results)]
+
+def as_dicts(parsedata):
+    # what the search methods returned before
+    output = {}
+    for data in parsedata:
+        output[data.get('title')] = {'id':data.get('id'),'title':data.get('title'), 'available':data.get('available'),'requested':data.get('requested'),'releaseDate':data.get('releaseDate')}
+    return output
+
+def as_records(parsedata):
+    output = MovieList()
+    for data in parsedata:
+        output.add(MovieResult.from_json(data))
+    return output
+
+def measure(build, parsedata):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = build(parsedata)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the title and date strings are shared with parsedata, only the structures are counted
+    return output, size, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, default=10000)
+    args = parser.parse_args()
+
+    parsedata = make_results(args.results)
+    for name, build in (('dict rows', as_dicts), ('MovieResult', as_records)):
+        output, size, elapsed = measure(build, parsedata)
+        print("{:12} {:6} results, {:6.1f} bytes per result, build {:6.1f} ms".format(
+            name, len(output), size / float(len(output)), 1000 * elapsed))
+        start = time.perf_counter()
+        if isinstance(output, MovieList):
+            # the bot builds keyboards from a session of the results
+            rows = SearchSession('title', output).rows()
+        else:
+            rows = [('{} ({})'.format(title, data['releaseDate'].split('-')[0]), data['id']) for title, data in output.items()]
+        print("{:12} {:6} keyboard rows in {:6.1f} ms".format('', len(rows), 1000 * (time.perf_counter() - start)))
+
+if __name__ == '__main__':
+    main()
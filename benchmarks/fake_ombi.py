@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+
+"""fake_ombi.py: local stand-in for the ombi api with configurable latency and payload size.
+
+    python3 benchmarks/fake_ombi.py --port 5000 --latency 0.05 --results 50
+
+Point "server" and "port" of config.json at it, any apiKey is accepted. Implements the calls
+the bot makes:
+
+    GET  /api/v1/Search/movie/{title}
+    POST /api/v1/Search/movie/actor
+    POST /api/v1/Search/movie/similar
+    POST /api/v1/Search/movie/info
+    POST /api/v1/Request/movie
+    GET  /api/v1/Request/movie
+    GET  /api/v1/Search/tv/{title}
+    GET  /api/v1/Search/tv/info/{tvdbId}
+    POST /api/v1/Request/tv
+
+Search results depend on the search term, so different terms give different movies. Each
+result is padded like a real one (overview, alternative titles...) to about --result-size bytes.
+"""
+
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ['the', 'night', 'of', 'return', 'last', 'dark', 'city', 'man', 'love', 'war', 'star', 'house']
+
+class FakeOmbi(object):
+    """ Answers ombi api calls after latency seconds (plus up to jitter seconds)
+    """
+    def __init__(self, listen='127.0.0.1', port=5000, latency=0.05, jitter=0.0, results=50, resultSize=2000):
+        self.latency    = latency
+        self.jitter     = jitter
+        self.results    = results
+        self.resultSize = resultSize
+        self.requested  = set()
+        self.calls      = {}
+        self.lock       = threading.Lock()
+        self.httpd      = ThreadingHTTPServer((listen, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port       = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-ombi', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def movie(self, movieID):
+        rng = random.Random(movieID)
+        title = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+        movie = {'id': movieID, 'theMovieDbId': str(movieID), 'title': title,
+                 'releaseDate': '{}-01-01T00:00:00'.format(rng.randint(1950, 2020)),
+                 'available': movieID % 7 == 0, 'requested': movieID in self.requested,
+                 'voteCount': rng.randint(0, 20000), 'voteAverage': round(rng.uniform(1, 9), 1),
+                 'posterPath': '/{:x}.jpg'.format(movieID), 'originalLanguage': 'en', 'adult': False,
+                 'overview': ''}
+        # pad the overview up to the size of a real result
+        padding = self.resultSize - len(json.dumps(movie))
+        if padding > 0:
+            movie['overview'] = ' '.join(rng.choice(WORDS) for _ in range(padding // 5))[:padding]
+        return movie
+
+    def show(self, showID, seasons=True):
+        rng = random.Random(showID)
+        show = {'id': showID, 'title': ' '.join(rng.choice(WORDS) for _ in range(2)).title(),
+                'firstAired': '{}-09-01'.format(rng.randint(1990, 2020)), 'status': rng.choice(['Ended', 'Continuing']),
+                'network': 'Network', 'overview': ' '.join(rng.choice(WORDS) for _ in range(40)),
+                'requested': False, 'fullyAvailable': False, 'seasonRequests': []}
+        if seasons:
+            show['seasonRequests'] = [{'seasonNumber': season, 'episodes': [
+                {'episodeNumber': episode, 'title': 'Episode {}'.format(episode), 'airDate': show['firstAired'],
+                 'available': rng.random() < 0.3, 'requested': False, 'approved': False} for episode in range(1, rng.randint(6, 24))]}
+                for season in range(1, rng.randint(2, 12))]
+        return show
+
+    def search_tv(self, term):
+        base = 70000 + (zlib.crc32(term.lower().encode()) % 10000) * 10
+        return [self.show(base + i, seasons=False) for i in range(min(self.results, 10))]
+
+    def search(self, term):
+        # a block of ids per term, at least 3 digits like real movie db ids
+        base = 1000 + (zlib.crc32(term.lower().encode()) % 100000) * 100
+        return [self.movie(base + i) for i in range(self.results)]
+
+    def answer(self, method, path, data):
+        call = method + ' ' + ('/Search/movie/{title}' if method == 'GET' and path.startswith('/Search/movie/') else
+                               '/Search/tv/info/{id}' if path.startswith('/Search/tv/info/') else
+                               '/Search/tv/{title}' if path.startswith('/Search/tv/') else path)
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if method == 'GET' and path.startswith('/Search/tv/info/'):
+            return 200, self.show(int(path.rsplit('/', 1)[-1]))
+        if method == 'GET' and path.startswith('/Search/tv/'):
+            return 200, self.search_tv(unquote(path[len('/Search/tv/'):]))
+        if method == 'POST' and path == '/Request/tv':
+            return 200, {'result': True, 'message': 'Request of {} seasons added'.format(len(data.get('seasons') or []) or 'all')}
+        if method == 'GET' and path.startswith('/Search/movie/'):
+            return 200, self.search(unquote(path[len('/Search/movie/'):]))
+        if method == 'POST' and path == '/Search/movie/actor':
+            return 200, self.search('actor ' + str(data.get('searchTerm')))
+        if method == 'POST' and path == '/Search/movie/similar':
+            return 200, self.search('similar ' + str(data.get('theMovieDbId')))
+        if method == 'POST' and path == '/Search/movie/info':
+            return 200, self.movie(int(data.get('theMovieDbId', 0)))
+        if method == 'POST' and path == '/Request/movie':
+            movieID = int(data.get('theMovieDbId', 0))
+            with self.lock:
+                if movieID in self.requested:
+                    return 200, {'result': False, 'errorMessage': 'This movie has already been requested'}
+                self.requested.add(movieID)
+            return 200, {'result': True, 'message': 'Request of movie {} added'.format(movieID)}
+        if method == 'GET' and path == '/Request/movie':
+            with self.lock:
+                requested = sorted(self.requested)
+            return 200, [{'theMovieDbId': movieID, 'title': self.movie(movieID)['title'], 'available': False,
+                          'releaseDate': self.movie(movieID)['releaseDate']} for movieID in requested]
+        return 404, {}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, method):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                try:
+                    data = json.loads(body) if body else {}
+                except ValueError:
+                    data = {}
+                path = self.path.split('?')[0]
+                path = path[path.index('/api/v1') + len('/api/v1'):] if '/api/v1' in path else path
+                status, result = fake.answer(method, path, data)
+                payload = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.reply('GET')
+
+            def do_POST(self):
+                self.reply('POST')
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before each answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to this many seconds')
+    parser.add_argument('--results', type=int, default=50, help='results per search')
+    parser.add_argument('--result-size', type=int, default=2000, help='approximate bytes per search result')
+    args = parser.parse_args()
+
+    fake = FakeOmbi(args.listen, args.port, args.latency, args.jitter, args.results, args.result_size).start()
+    print("Fake ombi listening on {}:{}".format(args.listen, fake.port))
+    try:
+        while True:
+            time.sleep(60)
+            print("calls: {}".format(fake.calls))
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+
+"""fake_telegram.py: local stand-in for the telegram bot api to load test the webhook mode offline.
+
+Start the bot with "apiUrl" pointing here and the webhook enabled, e.g. in config.json:
+
+    "apiUrl": "http://127.0.0.1:8081/bot",
+    "webhook": {"listen": "127.0.0.1", "port": 8443, "path": "telegram", "secretToken": "s3cret"}
+
+then run:
+
+    python3 benchmarks/fake_telegram.py --webhook http://127.0.0.1:8443/telegram/s3cret --users 50 --rounds 20
+
+Every simulated user walks through /start -> Movie -> Back. The time from posting an update to
+the webhook until the bot sends its reply for that chat back to this server is reported.
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+import os
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from callbacks import encode, MOVIE, BACK
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'ombibot', 'username': 'ombibot'}
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+class FakeBotApi(object):
+    """ Answers bot api calls and wakes up whoever waits for a reply in a chat
+    """
+    def __init__(self):
+        self.messageId = 0
+        self.calls     = {}
+        self.waiting   = {}
+        self.lock      = threading.Lock()
+
+    def expect_reply(self, chatId, replies=1):
+        """ Return an event that is set once the next replies messages were sent to chatId
+        """
+        event = threading.Event()
+        with self.lock:
+            self.waiting[chatId] = [event, replies]
+        return event
+
+    def answer(self, method, data):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            chatId = int(data.get('chat_id', 0))
+            with self.lock:
+                self.messageId += 1
+                messageId = data.get('message_id') or self.messageId
+                waiting = self.waiting.get(chatId)
+                if waiting:
+                    waiting[1] -= 1
+                    if waiting[1] <= 0:
+                        del self.waiting[chatId]
+                        waiting[0].set()
+            return {'message_id': messageId, 'date': int(time.time()), 'text': data.get('text', ''),
+                    'chat': {'id': chatId, 'type': 'private'}, 'from': BOT_USER}
+        return True
+
+class FakeTelegram(FakeBotApi):
+    """ FakeBotApi served over http, for a bot running in its own process
+    """
+    def __init__(self, listen='127.0.0.1', port=8081):
+        super(FakeTelegram, self).__init__()
+        self.httpd     = ThreadingHTTPServer((listen, port), self._handler())
+        self.port      = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, without this keep-alive replies wait for delayed acks
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                try:
+                    data = json.loads(body) if body else {}
+                except ValueError:
+                    data = {}
+                method = self.path.rsplit('/', 1)[-1].split('?')[0]
+                result = fake.answer(method, data)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+def user_json(chatId):
+    return {'id': chatId, 'is_bot': False, 'first_name': 'user{}'.format(chatId)}
+
+def message_update(updateId, chatId, text):
+    message = {'message_id': updateId, 'date': int(time.time()), 'text': text,
+               'chat': {'id': chatId, 'type': 'private'}, 'from': user_json(chatId)}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': updateId, 'message': message}
+
+def callback_update(updateId, chatId, data):
+    message = {'message_id': updateId, 'date': int(time.time()), 'text': 'menu',
+               'chat': {'id': chatId, 'type': 'private'}, 'from': BOT_USER}
+    return {'update_id': updateId, 'callback_query': {'id': str(updateId), 'from': user_json(chatId),
+            'chat_instance': str(chatId), 'data': data, 'message': message}}
+
+class WebhookDriver(object):
+    """ Posts updates to the bot's webhook and measures the time until the reply arrives
+    """
+    def __init__(self, fake, webhookUrl, timeout=10):
+        self.fake       = fake
+        self.webhookUrl = webhookUrl
+        self.timeout    = timeout
+        self.updateId   = random.randint(1, 1000000)
+        self.latencies  = []
+        self.timeouts   = 0
+        self.lock       = threading.Lock()
+
+    def send(self, update, chatId):
+        event = self.fake.expect_reply(chatId)
+        request = urllib.request.Request(self.webhookUrl, data=json.dumps(update).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        urllib.request.urlopen(request, timeout=self.timeout).read()
+        replied = event.wait(self.timeout)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            if replied:
+                self.latencies.append(elapsed)
+            else:
+                self.timeouts += 1
+
+    def next_id(self):
+        with self.lock:
+            self.updateId += 1
+            return self.updateId
+
+    def conversation(self, chatId, rounds):
+        # /start -> Movie -> Back
+        for i in range(rounds):
+            self.send(message_update(self.next_id(), chatId, '/start'), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(MOVIE)), chatId)
+            self.send(callback_update(self.next_id(), chatId, encode(BACK)), chatId)
+
+    def run(self, users, rounds):
+        threads = [threading.Thread(target=self.conversation, args=(1000 + i, rounds)) for i in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        n = len(self.latencies)
+        print("updates: {}, timeouts: {}, elapsed: {:.2f} s, {:.1f} updates/s".format(
+            n, self.timeouts, elapsed, n / elapsed if elapsed else 0))
+        print("update -> reply latency: p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+            *[1000 * percentile(self.latencies, p) for p in (50, 90, 99, 100)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081, help='port of the fake bot api')
+    parser.add_argument('--webhook', required=True, help='webhook url of the bot, including path and secret')
+    parser.add_argument('--users', type=int, default=10, help='number of concurrent simulated users')
+    parser.add_argument('--rounds', type=int, default=10, help='conversations per user')
+    parser.add_argument('--wait', type=float, default=2, help='seconds to wait for the bot to start')
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.listen, args.port).start()
+    time.sleep(args.wait)
+    driver = WebhookDriver(fake, args.webhook)
+    elapsed = driver.run(args.users, args.rounds)
+    driver.report(elapsed)
+    print("api calls: {}".format(fake.calls))
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -14,12 +14,35 @@ bot.
 """
 
 import json
-from ombiserver import OmbiServer
-import sys, traceback
-
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, ConversationHandler
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
-from telegram.utils.helpers import mention_html
+import functools
+from ombiserver import OmbiServer, HTTP_MethodError
+from responsecache import ResponseCache
+from prefetch import Prefetcher
+from userregistry import UserRegistry
+from persistence import BotPersistence, SQLiteStore
+from updatequeue import UpdateQueue
+from session import SearchSession, memory_report, user_data_size
+from expiry import Sweeper, ExpiringConversationHandler
+from models import season_text, episode_ranges
+from titleindex import TitleIndex
+from availability import AvailabilityIndex
+from ratelimit import RateLimiter, RateLimited
+from circuitbreaker import CircuitBreaker, CircuitOpenError
+from deadline import DeadlineExceeded
+import deadline
+import metrics
+from logutil import setup_logging
+from scheduler import FairPool
+from errorreport import ErrorReporter
+from callbacks import (CallbackRouter, encode, MOVIE, SERIES, BACK, ACTOR, TITLE, ANOTHER, END, PAGE, INFO,
+                       SIMILAR, REQUEST, SHOW, SEASON, SHOW_ALL, SHOW_SEASON)
+import sys, re, time
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+import argparse, signal
+
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, TypeHandler, InlineQueryHandler, DispatcherHandlerStop
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InlineQueryResultArticle, InputTextMessageContent
 
 sys.path.append('/usr/local/bin')
 
@@ -35,7 +58,7 @@ log = logging.getLogger(__name__)
 #initlog('ombibot')
 
 #2
-#use basicconfig
+#use the logging section of config.json, set up right after loading it
 #
 logging.getLogger().setLevel(logging.INFO)
 logging.basicConfig()
@@ -44,21 +67,338 @@ logging.basicConfig()
 # users consist of pairs of <telegram-user-id> : <ombi-user-name>. Use telegram id-bot https://telegram.me/myidbot to find you own telegram user id.
 with open('config.json') as json_data_file:
     data = json.load(json_data_file)
+logListener             = setup_logging(data.get('logging', {}))
 ombi_api                = data.get('apiKey')
 botToken                = data.get('botToken')
 server                  = data.get('server')
 port                    = data.get('port')
 baseUrl                 = data.get('baseUrl')
+connection              = data.get('connection', {})
+cacheConfig             = data.get('cache', {})
+searchConfig            = data.get('search', {})
+apiUrl                  = data.get('apiUrl')
+webhook                 = data.get('webhook', {})
+persistenceConfig       = data.get('persistence', {})
+memoryReportInterval    = data.get('memoryReportInterval', 3600)
+pageSize                = data.get('pageSize', 10)
+indexConfig             = data.get('titleIndex', {})
+bulkConfig              = data.get('bulkRequest', {})
+limitConfig             = data.get('rateLimit', {})
+breakerConfig           = data.get('circuitBreaker', {})
+updateBudget            = data.get('updateBudget', 15)
+metricsConfig           = data.get('metrics', {})
+
+#stop calling ombi for a while when it keeps failing, shared by both clients
+breaker                 = CircuitBreaker(failureThreshold = breakerConfig.get('failureThreshold', 5),
+                                         slowCall         = breakerConfig.get('slowCall', 10),
+                                         resetTimeout     = breakerConfig.get('resetTimeout', 30)) if breakerConfig.get('enabled', True) else None
+
+#local index of every title seen, for inline suggestions
+titleIndex              = TitleIndex(maxMovies     = indexConfig.get('maxMovies', 50000),
+                                     minScore      = indexConfig.get('minScore', 0.6),
+                                     maxCandidates = indexConfig.get('maxCandidates', 500)) if indexConfig.get('enabled', True) else None
+
+#available and requested movie ids, synced from ombi in the background and merged into every result
+syncConfig              = data.get('librarySync', {})
+availability            = AvailabilityIndex() if syncConfig.get('availability', True) else None
+
+#response cache shared by the ombi clients
+cache                   = ResponseCache(maxEntries = cacheConfig.get('maxEntries', 1000),
+                                        maxBytes   = cacheConfig.get('maxBytes', 10*1024*1024),
+                                        ttl        = cacheConfig.get('ttl')) if cacheConfig.get('enabled', True) else None
 
 #servers
-ombi                    = OmbiServer(server,ombi_api,port,baseUrl)
-#usernames
-userNames               = {}
+ombi                    = OmbiServer(server,ombi_api,port,baseUrl,
+                                     poolSize       = connection.get('poolSize', 10),
+                                     maxConnections = connection.get('maxConnections', 10),
+                                     keepAlive      = connection.get('keepAlive', 60),
+                                     connectTimeout = connection.get('connectTimeout', 5),
+                                     readTimeout    = connection.get('readTimeout', 30),
+                                     cache          = cache,
+                                     streaming      = searchConfig.get('streaming', True),
+                                     chunkSize      = searchConfig.get('chunkSize', 65536),
+                                     maxResults     = searchConfig.get('maxResults'),
+                                     index          = titleIndex,
+                                     availability   = availability,
+                                     maxRetries     = connection.get('maxRetries', 3),
+                                     maxBackoff     = connection.get('maxBackoff', 30),
+                                     breaker        = breaker)
+
+#async mode: ombi calls run on an asyncio loop instead of blocking the dispatcher threads
+asyncClient             = data.get('asyncClient', False)
+aombi                   = None
+loop                    = None
+if asyncClient:
+    from asyncombiserver import AsyncOmbiServer
+    aombi               = AsyncOmbiServer(server,ombi_api,port,baseUrl,
+                                     poolSize       = connection.get('poolSize', 10),
+                                     maxConnections = connection.get('maxConnections', 10),
+                                     keepAlive      = connection.get('keepAlive', 60),
+                                     connectTimeout = connection.get('connectTimeout', 5),
+                                     readTimeout    = connection.get('readTimeout', 30),
+                                     cache          = cache,
+                                     streaming      = searchConfig.get('streaming', True),
+                                     chunkSize      = searchConfig.get('chunkSize', 65536),
+                                     maxResults     = searchConfig.get('maxResults'),
+                                     index          = titleIndex,
+                                     availability   = availability,
+                                     maxRetries     = connection.get('maxRetries', 3),
+                                     maxBackoff     = connection.get('maxBackoff', 30),
+                                     breaker        = breaker)
+    loop                = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='ombi-loop', daemon=True).start()
+
+#prefetch movie info for the top results while the user is choosing, needs the cache
+prefetchConfig          = data.get('prefetch', {})
+prefetcher              = None
+if prefetchConfig.get('enabled', False) and cache:
+    prefetcher          = Prefetcher(ombi.get_movie_info,
+                                     top         = prefetchConfig.get('top', 3),
+                                     concurrency = prefetchConfig.get('concurrency', 2))
+#admission control in front of ombi, per telegram user and in total
+limiter                 = RateLimiter(userRate    = limitConfig.get('userRate', 0.5),
+                                      userBurst   = limitConfig.get('userBurst', 5),
+                                      globalRate  = limitConfig.get('globalRate', 10),
+                                      globalBurst = limitConfig.get('globalBurst', 20),
+                                      maxWait     = limitConfig.get('maxWait', 2.0)) if limitConfig.get('enabled', True) else None
+
+#handlers waiting on ombi run on their own pool, fair between users, menus stay on the dispatcher thread
+schedulerConfig         = data.get('scheduler', {})
+ioPool                  = FairPool('io', workers = schedulerConfig.get('ioWorkers', 8)) if schedulerConfig.get('enabled', True) else None
+
+#errors go to the devs from a background thread, grouped so an outage does not send a message per update
+# add all the dev user_ids in this list. You can also add ids of channels or groups.
+errorConfig             = data.get('errorReport', {})
+errorReporter           = ErrorReporter(errorConfig.get('devs', [101632749]),
+                                        interval        = errorConfig.get('interval', 60),
+                                        maxMessages     = errorConfig.get('maxMessages', 10),
+                                        maxFingerprints = errorConfig.get('maxFingerprints', 1000),
+                                        module          = __file__)
+
+#usernames, reloaded when config.json changes
+registryConfig          = data.get('userRegistry', {})
+userNames               = UserRegistry('config.json',
+                                       pollInterval = registryConfig.get('pollInterval', 5),
+                                       maxGuests    = registryConfig.get('maxGuests', 10000))
 
 # Stages
 FIRST, TYPING, TYPING2, SELECT_MOVIE, MOVIE_DETAILS, REQUEST_COMPLETED = range(6)
-# Callback data
-ONE, TWO, THREE, FOUR, BACK, ACTOR, TITLE = range(7)
+TYPING_SERIES, SELECT_SERIES, SERIES_DETAILS = range(6, 9)
+# Keyboards that never change, built once and sent as they are
+BACK_BUTTON             = InlineKeyboardButton("Back", callback_data=encode(BACK))
+BY_ACTOR_ROW            = [BACK_BUTTON, InlineKeyboardButton("By actor", callback_data=encode(ACTOR))]
+BY_TITLE_ROW            = [BACK_BUTTON, InlineKeyboardButton("By title", callback_data=encode(TITLE))]
+ANOTHER_BUTTON          = InlineKeyboardButton("Request another", callback_data=encode(ANOTHER))
+END_BUTTON              = InlineKeyboardButton("End", callback_data=encode(END))
+MAIN_MENU               = InlineKeyboardMarkup([[InlineKeyboardButton("Movie", callback_data=encode(MOVIE)),
+                                                 InlineKeyboardButton("Series", callback_data=encode(SERIES))]])
+BACK_MENU               = InlineKeyboardMarkup([[BACK_BUTTON]])
+TITLE_MENU              = InlineKeyboardMarkup([BY_ACTOR_ROW])
+ACTOR_MENU              = InlineKeyboardMarkup([BY_TITLE_ROW])
+FIRST_SEARCH_MENU       = InlineKeyboardMarkup([[InlineKeyboardButton("... or search by actor instead", callback_data=encode(ACTOR))]])
+MOVIE_REQUESTED_MENU    = InlineKeyboardMarkup([[BACK_BUTTON, ANOTHER_BUTTON, END_BUTTON]])
+
+STATE_NAMES = {FIRST: 'first', TYPING: 'typing', TYPING2: 'typing_actor', SELECT_MOVIE: 'select_movie',
+               MOVIE_DETAILS: 'movie_details', REQUEST_COMPLETED: 'request_completed', TYPING_SERIES: 'typing_series',
+               SELECT_SERIES: 'select_series', SERIES_DETAILS: 'series_details'}
+
+#idle users are forgotten after idleTimeout seconds, or after the time set for the state their conversation is in
+expiryConfig            = data.get('expiry', {})
+sweeper                 = Sweeper(ttl = expiryConfig.get('idleTimeout', 86400))
+STATE_TTL               = {state: expiryConfig['states'][name] for state, name in STATE_NAMES.items()
+                           if name in expiryConfig.get('states', {})}
+
+#commands are answered for new messages only: CommandHandler matches edited ones as well, which have no update.message
+COMMAND = ~Filters.update.edited_message
+
+HANDLER_LATENCY = metrics.Histogram('ombibot_handler_duration_seconds', 'Time spent in each update handler', ['handler'])
+
+def unavailable(update):
+    """Tell the user ombi can not be reached right now"""
+    text = 'Ombi is not answering right now, please try again in a minute.'
+    if update.callback_query:
+        update.callback_query.answer(text, show_alert=True)
+    elif update.inline_query:
+        update.inline_query.answer([], cache_time=0)
+    elif update.effective_message:
+        update.effective_message.reply_text(text)
+
+def call_ombi(update, context, render, method, *args, **kwargs):
+    """Call an ombi method and pass the result to render.
+
+    In async mode the call is scheduled on the event loop and render runs on the
+    dispatcher's async pool when the result arrives, so the handler returns at once.
+    Either way the call gets what is left of the update's latency budget. Only calls that
+    reach ombi take from the user's rate limit, RateLimited is raised when it is used up.
+    """
+    if not admitted(update):
+        raise RateLimited(method)
+    if not aombi:
+        try:
+            result = getattr(ombi, method)(*args, **kwargs)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            log.warning("Ombi call %s failed: %s", method,e)
+            unavailable(update)
+            return
+        render(result)
+        return
+
+    coroutine = getattr(aombi, method)(*args, **kwargs)
+    left = deadline.remaining()
+    if left is not None:
+        # the client enforces the budget itself, so a lookup out of time can still answer from the cache
+        coroutine = deadline.within(coroutine, max(0, left))
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def done(future):
+        try:
+            result = future.result()
+        except (CircuitOpenError, asyncio.TimeoutError) as e:
+            log.warning("Async ombi call %s failed: %s", method,str(e) or 'out of time')
+            context.dispatcher.run_async(unavailable, update)
+            return
+        except Exception as e:
+            log.error("Async ombi call %s failed: %s", method,e)
+            context.dispatcher.dispatch_error(update, e)
+            return
+        context.dispatcher.run_async(render, result)
+
+    future.add_done_callback(done)
+
+def prefetch_info(update, movies):
+    """Fetch info of the first results in the background, so tapping one of them renders at once"""
+    if prefetcher and update.effective_user:
+        prefetcher.prefetch(update.effective_user.id, list(movies.keys()))
+
+def cancel_prefetch(update):
+    if prefetcher and update.effective_user:
+        prefetcher.cancel(update.effective_user.id)
+
+def session_keyboard(session):
+    """Build the keyboard for the current page of a search from its compact session record"""
+    if session.mode == 'actor':
+        header = BY_TITLE_ROW
+    elif session.mode in ('similar', 'series'):
+        header = [BACK_BUTTON]
+    else:
+        header = BY_ACTOR_ROW
+    # tvdb ids and movie ids overlap, shows have their own action
+    action = SHOW if session.mode == 'series' else INFO
+    keyboard = [header] + [[InlineKeyboardButton(text, callback_data=encode(action, movie_id))] for text, movie_id in session.page_rows(pageSize)]
+
+    navigation = []
+    if session.page > 0:
+        navigation.append(InlineKeyboardButton("< Prev", callback_data=encode(PAGE, session.page - 1)))
+    if session.page < session.pages(pageSize) - 1:
+        navigation.append(InlineKeyboardButton("Next >", callback_data=encode(PAGE, session.page + 1)))
+    if navigation:
+        keyboard.append(navigation)
+    return keyboard
+
+def admitted(update):
+    """Check the rate limit for the user of an update, telling the user when it is turned away"""
+    if not limiter or not update.effective_user or limiter.admit(update.effective_user.id):
+        return True
+    log.info("Rate limited user %s", update.effective_user.id)
+    text = 'Easy there, that was a lot at once. Please try again in a few seconds.'
+    if update.callback_query:
+        update.callback_query.answer(text)
+    elif update.inline_query:
+        update.inline_query.answer([], cache_time=0)
+    elif update.effective_message:
+        update.effective_message.reply_text(text)
+    return False
+
+def io_bound(handler):
+    """Run a handler that waits on ombi on the io pool and return its Promise, the conversation
+    moves on when it is done. Handlers answering from memory stay on the dispatcher thread.
+    The latency of the handler is recorded where it runs, not the time taken to queue it."""
+    timedHandler = HANDLER_LATENCY.time(handler.__name__)(handler)
+    @functools.wraps(handler)
+    def wrapper(update, context, *args, **kwargs):
+        if ioPool is None:
+            return timedHandler(update, context, *args, **kwargs)
+        owner = update.effective_user.id if update.effective_user else None
+        return ioPool.submit(owner, timedHandler, update, context, *args, update=update, **kwargs)
+    # timed() leaves it alone
+    wrapper.timedInside = True
+    return wrapper
+
+def requeue(update, context):
+    """An update came in while the user's last handler still runs on the io pool: put it back on
+    the dispatcher's queue after that handler instead of dropping it"""
+    owner = update.effective_user.id if update.effective_user else None
+    ioPool.submit(owner, context.dispatcher.update_queue.put, update, update=update)
+
+def limited(handler):
+    """The ombi calls of the handler share the update's latency budget. When one of them is turned
+    away by the rate limit the conversation stays where it is."""
+    @functools.wraps(handler)
+    def wrapper(update, context, *args, **kwargs):
+        with deadline.budget(updateBudget):
+            try:
+                return handler(update, context, *args, **kwargs)
+            except RateLimited:
+                return None
+    return wrapper
+
+def report_stats(context):
+    """Log the counters of the response cache, the rate limiter, the circuit breaker, 429 answers from ombi and coalesced lookups"""
+    log.info("Cache: %s, rate limit: %s, circuit breaker: %s, ombi throttled %s times, io pool: %s, errors: %s, coalesced lookups: %s",
+             cache.stats() if cache else None, limiter.stats() if limiter else None, breaker.stats() if breaker else None, ombi.throttled,
+             ioPool.stats() if ioPool else None, errorReporter.stats(),
+             ombi.flight.coalesced + (aombi.flight.coalesced if aombi else 0))
+
+def report_memory(context):
+    """Log how much memory the search sessions of all users take"""
+    sessions, total, per_session = memory_report(context.dispatcher.user_data)
+    log.info("Memory: %s search sessions, %s bytes in total, %s bytes per session, %s live users, %s expired, %s bytes reclaimed",
+             sessions,total,per_session,len(sweeper),sweeper.expired,sweeper.reclaimed)
+
+def touch_user(conv_handler, update, context):
+    """Any update keeps its user from expiring, for the time allowed in its conversation's state or idleTimeout"""
+    if update.effective_user:
+        conv_handler.touch(update.effective_user.id)
+
+def expire_user(dispatcher, conv_handler, persistence, userId):
+    """Forget a user that was idle for too long: its conversation, user data and guest entry.
+    Returns the bytes of user data freed."""
+    if not conv_handler.end_user(userId):
+        # a handler of the user is still running, look again later
+        conv_handler.touch(userId)
+        return 0
+    userNames.forget(userId)
+    if prefetcher:
+        prefetcher.cancel(userId)
+    data = dispatcher.user_data.pop(userId, None)
+    if data is None:
+        return 0
+    if persistence:
+        persistence.drop_user_data(userId)
+    return user_data_size(data)
+
+def expire_sessions(context):
+    """Sweep the users whose idle time ran out, the work only depends on how many expired"""
+    reclaimed = sweeper.reclaimed
+    expired = sweeper.sweep()
+    if expired:
+        log.info("Expired %s idle users, %s bytes reclaimed, %s users left", len(expired),sweeper.reclaimed - reclaimed,len(sweeper))
+
+def sync_library(context):
+    """Load all movie requests from ombi into the availability flags and the title index"""
+    try:
+        movies = ombi.get_movie_requests()
+    except (HTTP_MethodError, CircuitOpenError, DeadlineExceeded) as e:
+        log.warning("Library sync failed, keeping the last flags: %s", e)
+        return
+    if not movies:
+        # keep the last known flags when ombi could not be reached
+        return
+    if availability is not None:
+        availability.replace(movies.values())
+    if titleIndex is not None:
+        added = titleIndex.add(movies.values())
+        log.info("Library sync: %s movies, %s new titles, %s in the index", len(movies),added,len(titleIndex))
 
 # Define a few command handlers. These usually take the two arguments update and
 # context. Error handlers also receive the raised TelegramError object in error.
@@ -70,35 +410,13 @@ def start(update, context):
     user = update.message.from_user
 
     log.info("User %s started the conversation.", user.first_name)
-    log.info("Users: {}".format(userNames))
-
-    if not user.id in userNames:
-        #load config again
-        with open('config.json') as json_data_file:
-            data =  json.load(json_data_file)
-            if 'users' in data: 
-                users = data.get("users")
-        if str(user.id) in users:
-            name = users.get(str(user.id))
-            userNames[user.id] = name
-            log.info("Assigned user {} with id {} to username {}".format(user.first_name,user.id,name))
-        else:
-            userNames[user.id] = 'guest'
-            log.info("Assigned user {} with id {} to guest".format(user.first_name,user.id))
-
-    # Build InlineKeyboard where each button has a displayed text
-    # and a string as callback_data
-    # The keyboard is a list of button rows, where each row is in turn
-    # a list (hence `[[...]]`).
-    keyboard = [
-        [InlineKeyboardButton("Movie", callback_data=str(ONE)),
-         InlineKeyboardButton("Series", callback_data=str(TWO))]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    name = userNames.get(user.id)
+    log.info("User %s with id %s has username %s", user.first_name,user.id,name)
+
     # Send message with text and appended InlineKeyboard
     update.message.reply_text(
         text="What are you looking for?",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU
     )
     # Tell ConversationHandler that we're in state `FIRST` now
     return FIRST
@@ -110,11 +428,6 @@ def start_over(update, context):
     query = update.callback_query
     # Get Bot from CallbackContext
     bot = context.bot
-    keyboard = [
-        [InlineKeyboardButton("Movie", callback_data=str(ONE)),
-         InlineKeyboardButton("Series", callback_data=str(TWO))]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     # Instead of sending a new message, edit the message that
     # originated the CallbackQuery. This gives the feeling of an
     # interactive menu.
@@ -122,10 +435,11 @@ def start_over(update, context):
         chat_id=query.message.chat_id,
         message_id=query.message.message_id,
         text="What are you looking for?",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU
     )
-    if "last_keyboard" in context.user_data:
-        del context.user_data["last_keyboard"]
+    if "last_search" in context.user_data:
+        del context.user_data["last_search"]
+    cancel_prefetch(update)
 
     return FIRST
 
@@ -136,16 +450,11 @@ def new_request(update, context):
     query = update.callback_query
     # Get Bot from CallbackContext
     bot = context.bot
-    keyboard = [
-        [InlineKeyboardButton("Movie", callback_data=str(ONE)),
-         InlineKeyboardButton("Series", callback_data=str(TWO))]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
     bot.send_message(
         chat_id=query.message.chat_id,
         text="What are you looking for?",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU
     )
 
     return FIRST
@@ -155,121 +464,103 @@ def help(update, context):
     log.info("Help")
     update.message.reply_text('Help!')
 
+def movie_menu(update, context):
+    """Ask for a movie title, or show the results of the last search again. Answers from memory."""
+    text = 'Enter movie title:'
+
+    if 'last_search' in context.user_data:
+        keyboard = session_keyboard(context.user_data.get('last_search'))
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
+        return SELECT_MOVIE
+
+    update.callback_query.edit_message_text(text=text, reply_markup=FIRST_SEARCH_MENU)
+    return TYPING
+
+@io_bound
+@limited
 def search_movie(update, context):
     """Send a message when the command /search_movies is issued."""
     log.info("Search movie called")
-    log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.debug("User data, last keyboard = {} rows".format(len(last_keyboard)))
+    log.info("Callback data = %s", update.callback_query.data if update.callback_query else "N/A")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.debug("User data, last search = %s results", len(last_search))
 
     try:
         text = update.message.text if update.message else None
         title = text if text else context.args[0] if context.args else None
-        log.debug("update: {}, context args = {}".format(update.message,context.args))
+        log.debug("update: %s, context args = %s", update.message,context.args)
 
     except Exception as e:
-        log.error("Error with search_movie: {}".format(e))
+        log.error("Error with search_movie: %s", e)
         return
 
     if not title:
         log.info("Search movie called without title")
-        text = 'Enter movie title:'
-
-        if 'last_keyboard' in context.user_data:
-            keyboard = context.user_data.get('last_keyboard')
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
-            return SELECT_MOVIE
-        else:
-            keyboard = [
-                [InlineKeyboardButton("... or search by actor instead", callback_data=str(ACTOR))],
-            ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
-        return TYPING
+        return movie_menu(update, context)
 
     else:
-        movies = ombi.search_movies(title)
-        update.message.reply_text('Found {} results for term {}'.format(len(movies),title))
-
-        keyboard = [
-            [InlineKeyboardButton("Back", callback_data=str(BACK)), InlineKeyboardButton("By actor", callback_data=str(ACTOR))],
-        ]
-
-        log.debug("Movies found: {}".format(len(movies)))
+        def render(movies):
+            update.message.reply_text('Found {} results for term {}'.format(len(movies),title))
 
-        for title, data in movies.items():
-            year = data.get('releaseDate').split('-')[0] if data.get('releaseDate') else 'N/A'
-            text = '{} ({})'.format(title, year)
+            log.debug("Movies found: %s", len(movies))
 
-            if data.get('available'):
-                text = text + b'\xE2\x9C\x85'.decode('utf-8')
-            elif data.get('requested'):
-                text = text + b'\xE2\x9E\xA1'.decode('utf-8')
+            session = SearchSession('title', movies)
+            context.user_data["last_search"] = session
+            keyboard = session_keyboard(session)
 
-            log.debug("Parsing {}, type = {}".format(data,type(data)))
-            #log.info("Title: {} id = {}".format(title,data.get('id')))
-
-            keyboard.append([InlineKeyboardButton( text, callback_data=data.get('id'))])
-        context.user_data["last_keyboard"] =  keyboard
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            update.message.reply_text(
+                "Choose one title (or go back):",
+                reply_markup=reply_markup
+            )
+            prefetch_info(update, movies)
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
-            "Choose one title (or go back):",
-        reply_markup=reply_markup
-    )
+        call_ombi(update, context, render, 'search_movies', title)
     return SELECT_MOVIE
 
 def toggle_search_actor(update, context):
     log.info("Toggle search to actor")
-    log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
-
-    keyboard = [
-            [InlineKeyboardButton("Back", callback_data=str(BACK)), InlineKeyboardButton("By title", callback_data=str(TITLE))],
-            ]
+    cancel_prefetch(update)
+    log.info("Callback data = %s", update.callback_query.data if update.callback_query else "N/A")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
 
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.callback_query.edit_message_text(text="Enter actor name (or go back):", reply_markup=reply_markup)
+    update.callback_query.edit_message_text(text="Enter actor name (or go back):", reply_markup=ACTOR_MENU)
 
     return TYPING2
 
 def toggle_search_title(update, context):
     log.info("Toggle search to title")
-    log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
-
-    keyboard = [
-            [InlineKeyboardButton("Back", callback_data=str(BACK)), InlineKeyboardButton("By actor", callback_data=str(ACTOR))],
-            ]
+    cancel_prefetch(update)
+    log.info("Callback data = %s", update.callback_query.data if update.callback_query else "N/A")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.callback_query.edit_message_text(text="Enter movie title (or go back):", reply_markup=reply_markup)
+    update.callback_query.edit_message_text(text="Enter movie title (or go back):", reply_markup=TITLE_MENU)
 
     return TYPING
 
+@io_bound
+@limited
 def search_movie_actor(update, context):
     """Send a message when the command /search_movies is issued."""
     log.info("Search movie by actor called")
-    log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
+    log.info("Callback data = %s", update.callback_query.data if update.callback_query else "N/A")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
 
     try:
         text = update.message.text if update.message else None
         actor = text if text else context.args[0] if context.args else None
-        log.debug("update: {}, context args = {}".format(update.message,context.args))
+        log.debug("update: %s, context args = %s", update.message,context.args)
 
     except Exception as e:
-        log.error("Error with search_movie: {}".format(e))
+        log.error("Error with search_movie: %s", e)
         return
 
     if not actor:
@@ -278,232 +569,275 @@ def search_movie_actor(update, context):
         return TYPING
 
     else:
-        movies = ombi.search_movies_actor(actor)
-        update.message.reply_text('Found {} results for {}'.format(len(movies),actor))
-
-        keyboard = [
-            [InlineKeyboardButton("Back", callback_data=str(BACK)), InlineKeyboardButton("By title", callback_data=str(TITLE))],
-        ]
-
-        log.debug("Movies found: {}".format(len(movies)))
+        def render(movies):
+            update.message.reply_text('Found {} results for {}'.format(len(movies),actor))
 
-        for title, data in movies.items():
-            year = data.get('releaseDate').split('-')[0] if data.get('releaseDate') else 'N/A'
-            text = '{} ({})'.format(title, year)
+            log.debug("Movies found: %s", len(movies))
 
-            if data.get('available'):
-                text = text + b'\xE2\x9C\x85'.decode('utf-8')
-            elif data.get('requested'):
-                text = text + b'\xE2\x9E\xA1'.decode('utf-8')
-
-            log.debug("Parsing {}, type = {}".format(data,type(data)))
-            #log.info("Title: {} id = {}".format(title,data.get('id')))
+            session = SearchSession('actor', movies)
+            context.user_data["last_search"] = session
+            keyboard = session_keyboard(session)
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            update.message.reply_text(
+                "Choose one title (or go back):",
+                reply_markup=reply_markup
+            )
+            prefetch_info(update, movies)
 
-            keyboard.append([InlineKeyboardButton( text, callback_data=data.get('id'))])
-        context.user_data["last_keyboard"] =  keyboard
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
-            "Choose one title (or go back):",
-        reply_markup=reply_markup
-    )
+        call_ombi(update, context, render, 'search_movies_actor', actor)
     return SELECT_MOVIE
 
+@io_bound
+@limited
 def find_similar(update, context):
     """Send a message when the command /search_movies is issued."""
     log.info("Find similar called")
-    log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
+    log.info("Callback data = %s", update.callback_query.data if update.callback_query else "N/A")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
 
-    try:
-        data = update.callback_query.data
-        movie_id = int(data.split('-')[1])
-        log.info("data: {}, movie-id = {}".format(data,movie_id))
-
-    except Exception as e:
-        log.error("Error finding similars: {}".format(e))
-        text = 'Error finding similar movies: {}. Try searching for it instead.'.format(e)
-        update.callback_query.edit_message_text(text=text)
-        return TYPING
+    movie_id = context.args[0]
+    log.info("Movie-id = %s", movie_id)
 
     if not movie_id:
         log.error("No movie id")
-        text = 'Error finding similar movies: {}. Try searching for it instead.'.format(e)
+        text = 'Error finding similar movies. Try searching for it instead.'
         update.callback_query.edit_message_text(text=text)
         return TYPING
     else:
-        movies = ombi.find_similar(movie_id)
-        log.info("Found {} similar movies to {}".format(len(movies), movie_id))
+        def render(movies):
+            log.info("Found %s similar movies to %s", len(movies), movie_id)
 
-        text = 'Found {} similar movies. Choose one (or go back):'.format(len(movies))
+            text = 'Found {} similar movies. Choose one (or go back):'.format(len(movies))
 
-        keyboard = [
-            [InlineKeyboardButton("Back", callback_data=str(BACK))]
-        ]
+            log.info("Movies found: %s", len(movies))
 
-        log.info("Movies found: {}".format(len(movies)))
+            session = SearchSession('similar', movies)
+            context.user_data["last_search"] = session
+            keyboard = session_keyboard(session)
 
-        for title, data in movies.items():
-            year = data.get('releaseDate').split('-')[0] if data.get('releaseDate') else 'N/A'
-            text = '{} ({})'.format(title, year)
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            update.callback_query.edit_message_text(text=text,reply_markup=reply_markup)
+            prefetch_info(update, movies)
 
-            if data.get('available'):
-                text = text + b'\xE2\x9C\x85'.decode('utf-8')
-            elif data.get('requested'):
-                text = text + b'\xE2\x9E\xA1'.decode('utf-8')
+        call_ombi(update, context, render, 'find_similar', movie_id)
+        return SELECT_MOVIE
 
-            log.debug("Parsing {}, type = {}".format(data,type(data)))
-            keyboard.append([InlineKeyboardButton( text, callback_data=data.get('id'))])
+def change_page(update, context):
+    """Show another page of the last search results"""
+    query = update.callback_query
+    session = context.user_data.get('last_search')
+    if not session:
+        log.info("No search results to page through")
+        return TYPING
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.callback_query.edit_message_text(text=text,reply_markup=reply_markup)
-        return SELECT_MOVIE
+    session.page = context.args[0]
+    log.info("Showing page %s of %s", session.page,session.pages(pageSize))
+    query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(session_keyboard(session)))
+    return SELECT_SERIES if session.mode == 'series' else SELECT_MOVIE
 
+@io_bound
+@limited
 def get_movie_info(update, context):
     """Send a message when the command /search_movies is issued."""
     log.info("Get movie info called")
     #log.info("Callback data = {}".format(update.callback_query.data if update.callback_query else "N/A"))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
-
-    try:
-        movie_id = update.callback_query.data
-    except Exception as e:
-        log.error("Error with getting movie info, try with another title: {}".format(e))
-        return TYPING
-
-    movie_info = ombi.get_movie_info(movie_id)
-    log.debug("Got: {}".format(len(movie_info)))
-
-    log.debug("Movie info: {}".format(movie_info))
-    text = "{}\t {} ({} votes)\r\n\r\n Released: {}\r\n\r\n {}".format(
-            movie_info.get('title'),
-            round(movie_info.get('voteAverage'),1),
-            movie_info.get('voteCount'),
-            movie_info.get('releaseDate').split('T')[0] if len(movie_info) > 0 else "N/A",
-            movie_info.get('overView') if len(movie_info) > 0 else "Unable to retrieve movie info")
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
+
+    movie_id = context.args[0]
+
+    def render(movie_info):
+        log.debug("Movie info: %s", movie_info)
+        if movie_info:
+            text = "{}\t {} ({} votes)\r\n\r\n Released: {}\r\n\r\n {}".format(
+                    movie_info.title,
+                    round(movie_info.voteAverage or 0,1),
+                    movie_info.voteCount,
+                    movie_info.releaseDate.split('T')[0] if movie_info.releaseDate else "N/A",
+                    movie_info.overView)
+        else:
+            text = "Unable to retrieve movie info"
 
-    keyboard = [
-        [InlineKeyboardButton("Back", callback_data=str(BACK)),
-         InlineKeyboardButton("Find similar ones", callback_data=str(TWO)+'-'+str(movie_id)),
-         InlineKeyboardButton("Request this one", callback_data=str(movie_id))]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        keyboard = [
+            [BACK_BUTTON,
+             InlineKeyboardButton("Find similar ones", callback_data=encode(SIMILAR, movie_id)),
+             InlineKeyboardButton("Request this one", callback_data=encode(REQUEST, movie_id))]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-    # Send message with text and appended InlineKeyboard
-    update.callback_query.edit_message_text(text=text,reply_markup=reply_markup)
+        # Send message with text and appended InlineKeyboard
+        update.callback_query.edit_message_text(text=text,reply_markup=reply_markup)
 
+    call_ombi(update, context, render, 'get_movie_info', movie_id)
 
     return MOVIE_DETAILS
 
+@io_bound
+@limited
 def get_movie(update, context):
     """Send a message when the command /search_movies is issued."""
     log.info("Get movie called")
     #log.info("Update = {}, context = {}".format(update,context))
-    last_keyboard = context.user_data.get('last_keyboard')
-    if last_keyboard:
-        log.info("User data, last keyboard = {} rows".format(len(last_keyboard)))
+    last_search = context.user_data.get('last_search')
+    if last_search:
+        log.info("User data, last search = %s results", len(last_search))
 
     try:
-        movie_id = update.callback_query.data if update.callback_query else context.args[0] if context.args else None
+        movie_id = context.args[0] if context.args else None
         effective_user = update._effective_user if update._effective_user.id else None
-        
-        if not effective_user.id in userNames:
-            #load config again
-            with open('config.json') as json_data_file:
-                data =  json.load(json_data_file)
-                if 'users' in data: 
-                    users = data.get("users")
-            if str(effective_user.id) in users:
-                name = users.get(str(effective_user.id))
-                userNames[effective_user.id] = name
-                log.info("Assigned effective user {} with id {} to username {}".format(effective_user.first_name,effective_user.id,name))
-            else:
-                userNames[effective_user.id] = 'guest'
-                log.info("Assigned user {} with id {} to guest".format(effective_user.first_name,effective_user.id))
+        name = userNames.get(effective_user.id)
+        log.info("Effective user %s with id %s has username %s", effective_user.first_name,effective_user.id,name)
     except IndexError as e:
-        log.error("Error requesting movie with ombi username because of index error: {}".format(e))
+        log.error("Error requesting movie with ombi username because of index error: %s", e)
         return TYPING
     except Exception as e:
-        log.error("Error requesting movie with ombi user account: {}".format(e))
+        log.error("Error requesting movie with ombi user account: %s", e)
         return TYPING
 
-    log.info("Movie = {}, effective-user = {}".format(movie_id,effective_user.id))
+    log.info("Movie = %s, effective-user = %s", movie_id,effective_user.id)
 
-    keyboard = [
-        [   InlineKeyboardButton("Back", callback_data=str(BACK)),
-            InlineKeyboardButton("Request another", callback_data=str(ONE)),
-            InlineKeyboardButton("End", callback_data=str(TWO))
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    def render(result):
+        # Send message with text and appended InlineKeyboard
+        text = 'Result: {}'.format(result)
+
+        update.callback_query.edit_message_text(text=text,reply_markup=MOVIE_REQUESTED_MENU)
+
+    # no need to ask ombi for movies the last sync already knows about
+    if availability is not None and movie_id:
+        available, requested = availability.status(movie_id)
+        if available or requested:
+            log.info("Movie %s is already %s", movie_id,'available' if available else 'requested')
+            render('This movie is already available' if available else 'This movie has already been requested')
+            return REQUEST_COMPLETED
 
     #request movie
     try:
-        result = ombi.request_movie(movie_id, user=userNames[effective_user.id])
+        call_ombi(update, context, render, 'request_movie', movie_id, user=name)
+    except RateLimited:
+        raise
     except Exception as e:
-        log.error("Unable to request movie: {}".format(e))
+        log.error("Unable to request movie: %s", e)
         return REQUEST_COMPLETED
 
-    # Send message with text and appended InlineKeyboard
-    text = 'Result: {}'.format(result)
-
-    update.callback_query.edit_message_text(text=text,reply_markup=reply_markup)
-
-
     return REQUEST_COMPLETED
 
+def resolve_movie(item):
+    """Find the movie id for a line of a request list: an id, a title or a title with its year, e.g. Alien (1979)"""
+    if item.isdigit():
+        return int(item), item
+    match = re.match(r'^(.*?)\s*\((\d{4})\)$', item)
+    title, year = (match.group(1), match.group(2)) if match else (item, None)
+    try:
+        if limiter:
+            limiter.wait_global()
+        movies = ombi.search_movies(title)
+    except Exception as e:
+        log.error("Unable to look up %s: %s", item,e)
+        return None, item
+    if not movies:
+        return None, item
+    wanted = ' '.join(title.lower().split())
+    candidates = [movie for movie in movies.values() if ' '.join((movie.title or '').lower().split()) == wanted] or list(movies.values())
+    if year:
+        candidates = [movie for movie in candidates if movie.year == year] or candidates
+    movie = candidates[0]
+    return movie.id, '{} ({})'.format(movie.title, movie.year)
+
+def request_list(update, context):
+    """Request every movie of a list, one title or id per line, e.g. a pasted watchlist: /request Alien (1979)"""
+    user = update.effective_user
+    lines = update.message.text.split(None, 1)
+    items = [item.strip() for item in re.split(r'[\n,;]+', lines[1])] if len(lines) > 1 else []
+    items = [item for item in items if item]
+    maxMovies = bulkConfig.get('maxMovies', 50)
+
+    if user.id not in userNames:
+        update.message.reply_text('Requesting a list of movies is only possible for registered users.')
+    elif not items:
+        update.message.reply_text('Send the movies to request after the command, one title or id per line:\r\n\r\n/request Alien (1979)\r\nHeat\r\n603')
+    elif len(items) > maxMovies:
+        update.message.reply_text('That is {} movies, at most {} can be requested at once.'.format(len(items),maxMovies))
+    elif admitted(update):
+        # this can take a while, don't hold up the dispatcher
+        context.dispatcher.run_async(bulk_request, update, context, items, userNames.get(user.id))
+    # the conversation should not also take the command for a title
+    raise DispatcherHandlerStop()
+
+def bulk_request(update, context, items, name):
+    """Look up and request a list of movies, editing one status message as they complete"""
+    status = update.message.reply_text('Looking up {} movies...'.format(len(items)))
+    workers = bulkConfig.get('workers', 4)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lookup') as executor:
+        found = list(executor.map(resolve_movie, items))
+
+    lines = ['{}: not found'.format(item) for movieID, item in found if movieID is None]
+    labels = {}
+    todo = []
+    for movieID, label in found:
+        if movieID is None or movieID in labels:
+            continue
+        labels[movieID] = label
+        available, requested = availability.status(movieID) if availability is not None else (False, False)
+        if available or requested:
+            lines.append('{}: already {}'.format(label, 'available' if available else 'requested'))
+        else:
+            todo.append(movieID)
+
+    # edits are limited by telegram, show progress at most once a second
+    lastEdit = [0]
+    def progress(done, total, movieID, result):
+        now = time.monotonic()
+        if done < total and now - lastEdit[0] >= 1:
+            lastEdit[0] = now
+            try:
+                status.edit_text('Requesting movies: {} of {} done'.format(done,total))
+            except Exception as e:
+                log.debug("Unable to show progress: %s", e)
+
+    results = ombi.request_movies(todo, name, workers  = workers,
+                                              retries  = bulkConfig.get('retries', 2),
+                                              progress = progress,
+                                              throttle = limiter.wait_global if limiter else None) if todo else {}
+
+    accepted = sum(1 for ok, message in results.values() if ok)
+    lines = ['{}: {}'.format(labels[movieID], message) for movieID, (ok, message) in results.items()] + lines
+    text = 'Requested {} of {} movies\r\n\r\n{}'.format(accepted, len(items), '\r\n'.join(lines))
+    # telegram messages are limited to 4096 characters
+    if len(text) > 4000:
+        text = text[:4000] + '\r\n...'
+    status.edit_text(text)
+
 # this is a general error handler function. If you need more information about specific type of update, add it to the
 # payload in the respective if clause
 def error(update, context):
-    # add all the dev user_ids in this list. You can also add ids of channels or groups.
-    devs = [101632749]
-    # we want to notify the user of this problem. This will always work, but not notify users if the update is an 
-    # callback or inline query, or a poll update. In case you want this, keep in mind that sending the message 
+    """Tell the user something went wrong and hand the error to the reporter, which does not block"""
+    # we want to notify the user of this problem. This will always work, but not notify users if the update is an
+    # callback or inline query, or a poll update. In case you want this, keep in mind that sending the message
     # could fail
-    if update.effective_message:
+    if update is not None and update.effective_message:
         text = "Hey. I'm sorry to inform you that an error happened while I tried to handle your update. " \
                "My developer(s) will be notified.\r\n\r\nUse /start to begin a new search."
-        update.effective_message.reply_text(text)
-    # This traceback is created with accessing the traceback object from the sys.exc_info, which is returned as the
-    # third value of the returned tuple. Then we use the traceback.format_tb to get the traceback as a string, which
-    # for a weird reason separates the line breaks in a list, but keeps the linebreaks itself. So just joining an
-    # empty string works fine.
-    trace = "".join(traceback.format_tb(sys.exc_info()[2]))
-    # lets try to get as much information from the telegram update as possible
-    payload = ""
-    # normally, we always have an user. If not, its either a channel or a poll update.
-    if update.effective_user:
-        payload += f' with the user {mention_html(update.effective_user.id, update.effective_user.first_name)}'
-    # there are more situations when you don't get a chat
-    if update.effective_chat:
-        payload += f' within the chat <i>{update.effective_chat.title}</i>'
-        if update.effective_chat.username:
-            payload += f' (@{update.effective_chat.username})'
-    # but only one where you have an empty payload by now: A poll (buuuh)
-    if update.poll:
-        payload += f' with the poll id {update.poll.id}.'
-    # lets put this in a "well" formatted text
-    text = f"Hey.\n The error <code>{context.error}</code> happened{payload}. The full traceback:\n\n<code>{trace}" \
-           f"</code>"
-    # and send it to the dev(s)
-    for dev_id in devs:
-        context.bot.send_message(dev_id, text, parse_mode=ParseMode.HTML)
-    # we raise the error again, so the logger module catches it. If you don't use the logger module, use it.
-    raise
+        try:
+            update.effective_message.reply_text(text)
+        except Exception as e:
+            log.warning("Unable to tell the user about an error: %s", e)
+    errorReporter.report(context.error, update if isinstance(update, Update) else None)
 
 def end(update, context):
     """Returns `ConversationHandler.END`, which tells the
     ConversationHandler that the conversation is over"""
     log.info("End")
+    cancel_prefetch(update)
     query = update.callback_query
     bot = context.bot
     try:
         chat_id = query.message.chat.id if query else update.message.chat.id
     except Exception as e:
-        log.error("Error: {}, object = {}".format(e,update))
+        log.error("Error: %s, object = %s", e,update)
         return ConversationHandler.END
 
     text = "See you next time!\r\n\r\n(Type /start to begin another request)"
@@ -512,70 +846,333 @@ def end(update, context):
 
     return ConversationHandler.END
 
+def series_menu(update, context):
+    """Ask for a series title, or show the results of the last series search again. Answers from memory."""
+    log.info("Series menu")
+    cancel_prefetch(update)
+    session = context.user_data.get('last_search')
+    if session is not None and session.mode == 'series':
+        # back to the results of the last series search
+        update.callback_query.edit_message_text(text='Choose one series (or go back):',
+                                                reply_markup=InlineKeyboardMarkup(session_keyboard(session)))
+        return SELECT_SERIES
+    update.callback_query.edit_message_text(text='Enter series title:', reply_markup=BACK_MENU)
+    return TYPING_SERIES
+
+@io_bound
+@limited
 def search_series(update, context):
-    """Show new choice of buttons"""
+    """Search for the series title the user typed"""
     log.info("Search series")
+    cancel_prefetch(update)
+    title = update.message.text if update.message else None
+
+    if not title:
+        return series_menu(update, context)
+
+    def render(shows):
+        update.message.reply_text('Found {} series for term {}'.format(len(shows),title))
+        session = SearchSession('series', shows)
+        context.user_data["last_search"] = session
+        update.message.reply_text("Choose one series (or go back):",
+                                  reply_markup=InlineKeyboardMarkup(session_keyboard(session)))
+
+    call_ombi(update, context, render, 'search_series', title)
+    return SELECT_SERIES
+
+@io_bound
+@limited
+def get_series_info(update, context):
+    """Show a series with a button per season, the episodes are only loaded when a season is opened"""
     query = update.callback_query
-    bot = context.bot
-    keyboard = [
-        [InlineKeyboardButton("Back", callback_data=str(BACK))],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    bot.edit_message_text(
-        chat_id=query.message.chat_id,
-        message_id=query.message.message_id,
-        text="Series search has not yet been implemented",
-        reply_markup=reply_markup
-    )
-    return FIRST
+    show_id = context.args[0]
+    log.info("Get series info of %s", show_id)
+
+    def render(show):
+        if not show:
+            query.edit_message_text(text="Unable to retrieve series info", reply_markup=BACK_MENU)
+            return
+        lines = ["{} ({})".format(show.title, show.year), ', '.join(str(detail) for detail in (show.network, show.status) if detail)]
+        text = "\r\n".join(line for line in lines if line)
+        if show.overView:
+            text += "\r\n\r\n" + show.overView[:800]
+        keyboard = [[BACK_BUTTON, InlineKeyboardButton("Request all seasons", callback_data=encode(SHOW_ALL, show_id))]]
+        keyboard += [[InlineKeyboardButton(season_text(number, episodes, available, requested),
+                                           callback_data=encode(SEASON, show_id, number))]
+                     for number, episodes, available, requested in show.seasons]
+        query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    call_ombi(update, context, render, 'get_series_info', show_id)
+    return SERIES_DETAILS
+
+@io_bound
+@limited
+def get_season(update, context):
+    """Show which episodes of a season are available or requested"""
+    query = update.callback_query
+    show_id, number = context.args
+    log.info("Get season %s of %s", number,show_id)
 
-def main():
-    """Start the bot."""
-    # Create the Updater and pass it your bot's token.
-    # Make sure to set use_context=True to use the new context based callbacks
-    # Post version 12 this will no longer be necessary
-    updater = Updater(botToken, use_context=True)
+    def render(season):
+        keyboard = [[InlineKeyboardButton("Back", callback_data=encode(SHOW, show_id))]]
+        if season is None:
+            text = "Unable to retrieve season {}".format(number)
+        else:
+            text = "{}: {} available, {} requested".format(season_text(number, len(season)), season.available, season.requested)
+            missing = season.missing()
+            if missing:
+                text += "\r\n\r\nNot requested yet: episode {}".format(episode_ranges(missing))
+                keyboard[0].append(InlineKeyboardButton("Request these", callback_data=encode(SHOW_SEASON, show_id, number)))
+        query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    call_ombi(update, context, render, 'get_season', show_id, number)
+    return SERIES_DETAILS
+
+@io_bound
+@limited
+def request_series(update, context):
+    """Request a whole series (show id) or what is missing of one season (show id, season), in one call to ombi"""
+    query = update.callback_query
+    show_id = context.args[0]
+    name = userNames.get(update.effective_user.id)
+    log.info("Request series %s for %s: %s", show_id,name,context.args)
 
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
+    keyboard = [[InlineKeyboardButton("Back", callback_data=encode(SHOW, show_id)), ANOTHER_BUTTON, END_BUTTON]]
+
+    def render(result):
+        query.edit_message_text(text='Result: {}'.format(result), reply_markup=InlineKeyboardMarkup(keyboard))
+
+    if len(context.args) == 2:
+        call_ombi(update, context, render, 'request_season', show_id, context.args[1], name)
+    else:
+        call_ombi(update, context, render, 'request_series', show_id, name)
+    return REQUEST_COMPLETED
+
+def answer_inline(update, movies):
+    """Answer an inline query with a list of movies, choosing one sends its title to the chat"""
+    results = [InlineQueryResultArticle(id           = str(movie.id),
+                                        title        = movie.label(),
+                                        description  = 'Available' if movie.available else 'Requested' if movie.requested else None,
+                                        input_message_content = InputTextMessageContent(movie.title))
+               for movie in movies]
+    update.inline_query.answer(results, cache_time=indexConfig.get('cacheTime', 60))
+
+@io_bound
+@limited
+def inline_query(update, context):
+    """Suggest titles while the user types "@bot title", from the local index and only otherwise from ombi"""
+    query = update.inline_query.query.strip()
+    limit = indexConfig.get('results', 10)
+    if len(query) < indexConfig.get('minQueryLength', 3):
+        update.inline_query.answer([], cache_time=indexConfig.get('cacheTime', 60))
+        return
 
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+    movies = titleIndex.search(query, limit)
+    if movies:
+        log.debug("Inline query %s: %s local matches", query,len(movies))
+        answer_inline(update, movies)
+        return
+
+    log.info("Inline query %s: no local match, searching ombi", query)
+    call_ombi(update, context, lambda movies: answer_inline(update, list(movies.values())[:limit]), 'search_movies', query)
+
+def timed(handler):
+    """Record the latency of a handler's callbacks under the callback's name, io_bound ones time themselves"""
+    def wrap(callback):
+        if getattr(callback, 'timedInside', False):
+            return callback
+        return HANDLER_LATENCY.time(callback.__name__)(callback)
+
+    if isinstance(handler, CallbackRouter):
+        handler.routes = {action: wrap(callback) for action, callback in handler.routes.items()}
+    else:
+        handler.callback = wrap(handler.callback)
+    return handler
+
+def register_metrics(dp, conv_handler, queue=None):
+    """Gauges read from the bot's state when /metrics is scraped"""
+    def conversations():
+        counts = dict.fromkeys(STATE_NAMES.values(), 0)
+        for state in list(conv_handler.conversations.values()):
+            # (old state, promise) while a handler runs asynchronously
+            if isinstance(state, tuple):
+                state = state[0]
+            if state in STATE_NAMES:
+                counts[STATE_NAMES[state]] += 1
+        return counts
+
+    metrics.Gauge('ombibot_conversations', 'Open conversations per state', conversations, ['state'])
+    metrics.Gauge('ombibot_dispatcher_queue_depth', 'Updates waiting for the dispatcher', dp.update_queue.qsize)
+    if queue is not None:
+        metrics.Gauge('ombibot_update_queue_depth', 'Updates waiting in the shared queue for the workers', lambda: len(queue))
+    if cache:
+        metrics.Gauge('ombibot_cache_lookups_total', 'Response cache lookups by result',
+                      lambda: {'hit': cache.hits, 'miss': cache.misses, 'stale': cache.staleHits}, ['result'], kind='counter')
+        metrics.Gauge('ombibot_cache_entries', 'Entries in the response cache', lambda: len(cache.entries))
+        metrics.Gauge('ombibot_cache_bytes', 'Approximate size of the response cache', lambda: cache.bytes)
+        metrics.Gauge('ombibot_cache_evictions_total', 'Entries evicted from the full response cache', lambda: cache.evictions, kind='counter')
+    if limiter:
+        metrics.Gauge('ombibot_rate_limit_total', 'Updates by rate limit decision',
+                      lambda: {'admitted': limiter.admitted, 'delayed': limiter.delayed,
+                               'rejected_user': limiter.rejectedUser, 'rejected_global': limiter.rejectedGlobal},
+                      ['result'], kind='counter')
+    if ioPool:
+        metrics.Gauge('ombibot_pool_queue_depth', 'Handlers waiting for a thread of a pool',
+                      lambda: {ioPool.name: ioPool.depth}, ['pool'])
+        metrics.Gauge('ombibot_pool_busy_threads', 'Threads of a pool running a handler',
+                      lambda: {ioPool.name: ioPool.busy}, ['pool'])
+    if breaker:
+        metrics.Gauge('ombibot_circuit_breaker_state', 'State of the circuit breaker, 0 closed, 1 half-open, 2 open',
+                      lambda: {'closed': 0, 'half-open': 1, 'open': 2}[breaker.state])
+        metrics.Gauge('ombibot_circuit_breaker_opened_total', 'Times the circuit breaker opened', lambda: breaker.opened, kind='counter')
+        metrics.Gauge('ombibot_circuit_breaker_rejected_total', 'Ombi calls refused by the open circuit breaker',
+                      lambda: breaker.rejected, kind='counter')
+    metrics.Gauge('ombibot_live_users', 'Users with a conversation or user data that did not expire yet', lambda: len(sweeper))
+    metrics.Gauge('ombibot_expired_users_total', 'Users forgotten after being idle', lambda: sweeper.expired, kind='counter')
+    metrics.Gauge('ombibot_expiry_reclaimed_bytes_total', 'Approximate bytes of user data freed by expiry',
+                  lambda: sweeper.reclaimed, kind='counter')
+    metrics.Gauge('ombibot_errors_total', 'Errors of update handlers by what became of them',
+                  lambda: {'reported': errorReporter.reported, 'sent': errorReporter.sent, 'dropped': errorReporter.dropped},
+                  ['result'], kind='counter')
+    metrics.Gauge('ombibot_error_fingerprints', 'Distinct errors seen', lambda: len(errorReporter.groups))
+    metrics.Gauge('ombi_coalesced_lookups_total', 'Lookups that waited for an identical running call instead of calling ombi',
+                  lambda: ombi.flight.coalesced + (aombi.flight.coalesced if aombi else 0), kind='counter')
+    metrics.Gauge('ombi_throttled_total', 'Answers of 429 Too Many Requests from ombi',
+                  lambda: ombi.throttled + (aombi.throttled if aombi else 0), kind='counter')
+
+def start_webhook(updater):
+    """Receive updates on a built-in http server instead of polling for them."""
+    # the secret token becomes the last part of the path, telegram is the only one knowing the full url
+    url_path = webhook.get('path', 'telegram').strip('/')
+    if webhook.get('secretToken'):
+        url_path = url_path + '/' + webhook.get('secretToken')
+    cert = webhook.get('cert')
+    key = webhook.get('key')
+    url = webhook.get('url')
+    webhook_url = url.rstrip('/') + '/' + url_path if url else None
+
+    updater.start_webhook(listen        = webhook.get('listen', '127.0.0.1'),
+                          port          = webhook.get('port', 8443),
+                          url_path      = url_path,
+                          cert          = cert,
+                          key           = key,
+                          webhook_url   = webhook_url)
+
+    # with a certificate the library registers the webhook itself, otherwise tls is done by a proxy in front
+    if webhook_url and not (cert and key):
+        updater.bot.set_webhook(url=webhook_url)
+    log.info("Listening for webhook updates on %s:%s", webhook.get('listen', '127.0.0.1'),webhook.get('port', 8443))
+
+def enqueue(queue, update):
+    """Put an update on the shared queue, partitioned by user so a user always lands on the same worker."""
+    partition = update.effective_user.id if update.effective_user else update.effective_chat.id if update.effective_chat else 0
+    queue.put(partition, update.to_json())
+
+def serve_queue(updater, queue, worker, workers):
+    """Feed updates of this worker's partition from the shared queue into the dispatcher until stopped."""
+    dp = updater.dispatcher
+    threading.Thread(target=dp.start, name='dispatcher', daemon=True).start()
+    updater.job_queue.start()
+    log.info("Worker %s of %s serving updates from %s", worker,workers,queue.path)
+
+    stopped = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stopped.set())
+
+    while not stopped.is_set():
+        items = queue.take(worker, workers)
+        for item in items:
+            dp.update_queue.put(Update.de_json(json.loads(item), updater.bot))
+        if not items:
+            stopped.wait(persistenceConfig.get('pollInterval', 0.05))
+
+    dp.stop()
+    updater.job_queue.stop()
+
+def build_conversation(persistent=False):
+    """Build the ConversationHandler of the bot, used by main and by the load test in benchmarks"""
+    conv_handler = ExpiringConversationHandler(
+        entry_points=[CommandHandler('start', start, filters=COMMAND)],
         states={
-            FIRST:              [CallbackQueryHandler(search_movie,                 pattern='^' + str(ONE) + '$'),
-                                 CallbackQueryHandler(search_series,                pattern='^' + str(TWO) + '$'),
-                                 CallbackQueryHandler(start_over,                   pattern='^' + str(BACK) + '$')],
+            FIRST:              [CallbackRouter({MOVIE: movie_menu, SERIES: series_menu, BACK: start_over})],
 
             TYPING:             [MessageHandler(Filters.text,search_movie),
-                                 CallbackQueryHandler(toggle_search_actor,          pattern='^' + str(ACTOR) + '$'),
-                                 CallbackQueryHandler(start_over,                   pattern='^' + str(BACK) + '$')],
+                                 CallbackRouter({ACTOR: toggle_search_actor, BACK: start_over})],
 
             TYPING2:            [MessageHandler(Filters.text,search_movie_actor),
-                                 CallbackQueryHandler(toggle_search_title,          pattern='^' + str(TITLE) + '$'),
-                                 CallbackQueryHandler(start_over,                   pattern='^' + str(BACK) + '$')],
+                                 CallbackRouter({TITLE: toggle_search_title, BACK: start_over})],
 
 
-            SELECT_MOVIE:       [CommandHandler("end", end),
-                                 CallbackQueryHandler(start_over,                   pattern='^' + str(BACK) + '$'),
-                                 CallbackQueryHandler(toggle_search_actor,          pattern='^' + str(ACTOR) + '$'),
-                                 CallbackQueryHandler(toggle_search_title,          pattern='^' + str(TITLE) + '$'),
-                                 CallbackQueryHandler(get_movie_info,               pattern='^.+\d+.+$'),
+            SELECT_MOVIE:       [CommandHandler("end", end, filters=COMMAND),
+                                 CallbackRouter({BACK: start_over, ACTOR: toggle_search_actor, TITLE: toggle_search_title,
+                                                 PAGE: change_page, INFO: get_movie_info}),
                                  MessageHandler(Filters.text,search_movie)],
 
-            MOVIE_DETAILS:      [CallbackQueryHandler(search_movie,                 pattern='^' + str(BACK)+ '$'),
-                                 CallbackQueryHandler(find_similar,                 pattern='^' + str(TWO) + '\-.+$'),
-                                 CallbackQueryHandler(get_movie,                    pattern='^\d+$')],
+            MOVIE_DETAILS:      [CallbackRouter({BACK: movie_menu, SIMILAR: find_similar, REQUEST: get_movie})],
+
+
+            REQUEST_COMPLETED:  [CallbackRouter({ANOTHER: new_request, END: end, BACK: movie_menu, SHOW: get_series_info})],
 
+            TYPING_SERIES:      [MessageHandler(Filters.text,search_series),
+                                 CallbackRouter({BACK: start_over})],
 
-            REQUEST_COMPLETED:  [CallbackQueryHandler(new_request,                  pattern='^' + str(ONE) + '$'),
-                                 CallbackQueryHandler(end,                          pattern='^' + str(TWO) + '$'),
-                                 CallbackQueryHandler(search_movie,                 pattern='^' + str(BACK) + '$')]
+            SELECT_SERIES:      [CommandHandler("end", end, filters=COMMAND),
+                                 CallbackRouter({BACK: start_over, PAGE: change_page, SHOW: get_series_info}),
+                                 MessageHandler(Filters.text,search_series)],
+
+            SERIES_DETAILS:     [CallbackRouter({BACK: series_menu, SHOW: get_series_info, SEASON: get_season,
+                                                 SHOW_ALL: request_series, SHOW_SEASON: request_series})]
         },
-        fallbacks=[CommandHandler('start', start)],
+        fallbacks=[CommandHandler('start', start, filters=COMMAND)],
         per_message = False,
         allow_reentry = True,
-        conversation_timeout = 86400
+        name = 'ombi',
+        persistent = persistent,
+        sweeper = sweeper,
+        stateTtl = STATE_TTL
     )
+    if ioPool is not None:
+        conv_handler.states[ConversationHandler.WAITING] = [TypeHandler(Update, requeue)]
+
+    # latency of every conversation step
+    for handlers in [conv_handler.entry_points, conv_handler.fallbacks] + list(conv_handler.states.values()):
+        for handler in handlers:
+            timed(handler)
+    return conv_handler
+
+def main():
+    """Start the bot."""
+    parser = argparse.ArgumentParser(description='Telegram front-end for ombi requests')
+    parser.add_argument('--frontend', action='store_true',
+                        help='only receive updates and put them on the shared queue for the workers')
+    parser.add_argument('--worker', type=int, default=None,
+                        help='serve updates from the shared queue as worker number WORKER (0 based)')
+    parser.add_argument('--workers', type=int, default=1, help='total number of workers')
+    args = parser.parse_args()
+
+    path = persistenceConfig.get('path', 'ombibot.sqlite')
+
+    # conversations and user data survive restarts, and are required when running as one of several workers
+    persistence = None
+    if (persistenceConfig.get('enabled', False) or args.worker is not None) and not args.frontend:
+        owns = (lambda userId: abs(userId) % args.workers == args.worker) if args.worker is not None else None
+        persistence = BotPersistence(SQLiteStore(path),
+                                     flushInterval = persistenceConfig.get('flushInterval', 1.0),
+                                     owns          = owns)
+
+    # Create the Updater and pass it your bot's token.
+    # Make sure to set use_context=True to use the new context based callbacks
+    # Post version 12 this will no longer be necessary
+    updater = Updater(botToken, base_url=apiUrl, persistence=persistence, use_context=True)
+
+    # Get the dispatcher to register handlers
+    dp = updater.dispatcher
+    if ioPool:
+        # errors of pooled handlers go to the dispatcher's error handlers
+        ioPool.dispatcher = dp
+    errorReporter.bot = updater.bot
+
+    conv_handler = build_conversation(persistent = persistence is not None)
 
     # on different commands - answer in Telegram
     #dp.add_handler(CommandHandler("start", start))
@@ -583,7 +1180,33 @@ def main():
     #dp.add_handler(CommandHandler("end", end))
     #dp.add_handler(CommandHandler("quit", end))
 
-    dp.add_handler(conv_handler)
+    queue = None
+    if args.frontend:
+        # every update goes to the shared queue, the workers handle them
+        queue = UpdateQueue(path)
+        dp.add_handler(TypeHandler(Update, lambda update, context: enqueue(queue, update)))
+    else:
+        # ahead of the conversation, so /request works in any state
+        dp.add_handler(timed(CommandHandler('request', request_list, filters=COMMAND)), group=-1)
+        dp.add_handler(TypeHandler(Update, functools.partial(touch_user, conv_handler)), group=-2)
+        dp.add_handler(conv_handler)
+        # state loaded from persistence expires like the rest
+        loaded = conv_handler.track()
+        for userId in list(dp.user_data.keys()):
+            if userId not in sweeper:
+                sweeper.touch(userId)
+        sweeper.onExpire = functools.partial(expire_user, dp, conv_handler, persistence)
+        updater.job_queue.run_repeating(expire_sessions, interval=expiryConfig.get('interval', 60))
+        log.info("Tracking %s loaded conversations and %s users for expiry", loaded,len(sweeper))
+        if titleIndex is not None:
+            dp.add_handler(timed(InlineQueryHandler(inline_query)))
+
+    metricsServer = None
+    if metricsConfig.get('enabled', False):
+        register_metrics(dp, conv_handler, queue)
+        # workers on one host need a port each
+        metricsServer = metrics.MetricsServer(metricsConfig.get('listen', '127.0.0.1'),
+                                              metricsConfig.get('port', 9090) + (args.worker + 1 if args.worker is not None else 0)).start()
 
     # on noncommand i.e message - echo the message on Telegram
     #dp.add_handler(MessageHandler(Filters.text, echo))
@@ -591,13 +1214,43 @@ def main():
     # log all errors
     dp.add_error_handler(error)
 
-    # Start the Bot
-    updater.start_polling()
+    if memoryReportInterval and not args.frontend:
+        updater.job_queue.run_repeating(report_memory, interval=memoryReportInterval)
+        updater.job_queue.run_repeating(report_stats, interval=memoryReportInterval)
+
+    if (titleIndex is not None or availability is not None) and syncConfig.get('interval', 600) and not args.frontend:
+        updater.job_queue.run_repeating(sync_library, interval=syncConfig.get('interval', 600), first=0)
 
-    # Run the bot until you press Ctrl-C or the process receives SIGINT,
-    # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
-    updater.idle()
+    if args.worker is not None:
+        serve_queue(updater, UpdateQueue(path), args.worker, args.workers)
+    else:
+        # Start the Bot
+        if webhook.get('enabled', False):
+            start_webhook(updater)
+        else:
+            updater.start_polling()
+
+        # Run the bot until you press Ctrl-C or the process receives SIGINT,
+        # SIGTERM or SIGABRT. This should be used most of the time, since
+        # start_polling() is non-blocking and will stop the bot gracefully.
+        updater.idle()
+
+    if persistence:
+        dp.update_persistence()
+        persistence.close()
+
+    if prefetcher:
+        prefetcher.shutdown()
+    if ioPool:
+        ioPool.shutdown()
+    errorReporter.close()
+    if metricsServer:
+        metricsServer.stop()
+    if aombi:
+        asyncio.run_coroutine_threadsafe(aombi.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    if logListener:
+        logListener.stop()
 
 
 if __name__ == '__main__':
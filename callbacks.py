@@ -0,0 +1,93 @@
+"""callbacks.py: compact callback_data of the inline keyboards and a router dispatching it by action in one lookup."""
+
+import logging
+from telegram import Update
+from telegram.ext import Handler
+log = logging.getLogger(__name__)
+
+# telegram refuses buttons with more callback_data than this
+MAX_LENGTH  = 64
+SEPARATOR   = '.'
+DIGITS      = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# Actions, one character each. The value is the number of integer arguments.
+MOVIE       = 'm'
+SERIES      = 's'
+BACK        = 'b'
+ACTOR       = 'a'
+TITLE       = 't'
+ANOTHER     = 'n'
+END         = 'e'
+PAGE        = 'p'
+INFO        = 'i'
+SIMILAR     = 'l'
+REQUEST     = 'r'
+SHOW        = 'v'
+SEASON      = 'z'
+SHOW_ALL    = 'A'
+SHOW_SEASON = 'S'
+
+ARITY = {MOVIE: 0, SERIES: 0, BACK: 0, ACTOR: 0, TITLE: 0, ANOTHER: 0, END: 0,
+         PAGE: 1, INFO: 1, SIMILAR: 1, REQUEST: 1, SHOW: 1, SHOW_ALL: 1,
+         SEASON: 2, SHOW_SEASON: 2}
+
+def base36(number):
+    if number < 0:
+        return '-' + base36(-number)
+    digits = ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = DIGITS[digit] + digits
+        if not number:
+            return digits
+
+def encode(action, *args):
+    """ callback_data for an action and its integer arguments, e.g. encode(SEASON, 81189, 2) == 'z1qn9.2'
+    """
+    if ARITY.get(action) != len(args):
+        raise ValueError("Action {} takes {} arguments, got {}".format(action, ARITY.get(action), len(args)))
+    data = action + SEPARATOR.join(base36(int(arg)) for arg in args)
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError("Callback data {} is longer than {} bytes".format(data, MAX_LENGTH))
+    return data
+
+def decode(data):
+    """ (action, args) of callback_data made by encode, ValueError for anything else,
+        e.g. the numeric data of keyboards sent before this encoding
+    """
+    if not data or data[0] not in ARITY:
+        raise ValueError("Unknown callback data {}".format(data))
+    action = data[0]
+    args = tuple(int(arg, 36) for arg in data[1:].split(SEPARATOR)) if len(data) > 1 else ()
+    if len(args) != ARITY[action]:
+        raise ValueError("Action {} takes {} arguments: {}".format(action, ARITY[action], data))
+    return action, args
+
+class CallbackRouter(Handler):
+    """ Handles the callback queries of one conversation state with a dict of action -> callback,
+        one decode and one lookup instead of trying a regex per handler. The decoded arguments
+        are passed to the callback as context.args.
+    """
+    def __init__(self, routes):
+        # the callback depends on the action, see routes
+        super(CallbackRouter, self).__init__(None)
+        self.routes = dict(routes)
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or not update.callback_query or not update.callback_query.data:
+            return None
+        try:
+            action, args = decode(update.callback_query.data)
+        except ValueError:
+            log.debug("Ignoring callback data %s", update.callback_query.data)
+            return None
+        if action not in self.routes:
+            return None
+        return action, args
+
+    def collect_additional_context(self, context, update, dispatcher, check_result):
+        context.args = list(check_result[1])
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        self.collect_additional_context(context, update, dispatcher, check_result)
+        return self.routes[check_result[0]](update, context)
@@ -0,0 +1,80 @@
+"""circuitbreaker.py: stop calling ombi for a while when it keeps failing or is too slow."""
+
+import time
+import threading
+import logging
+log = logging.getLogger(__name__)
+
+CLOSED      = 'closed'
+OPEN        = 'open'
+HALF_OPEN   = 'half-open'
+
+class CircuitOpenError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class CircuitBreaker(object):
+    """ Closed: calls go through. After failureThreshold failures in a row, where a call slower
+        than slowCall seconds counts as a failure too, the breaker opens and calls fail at once.
+        After resetTimeout seconds it lets a single probe call through (half-open); the probe
+        closes it again on success or opens it for another resetTimeout on failure.
+    """
+    def __init__(self, failureThreshold=5, slowCall=10, resetTimeout=30):
+        self.failureThreshold = failureThreshold
+        self.slowCall         = slowCall
+        self.resetTimeout     = resetTimeout
+        self.state            = CLOSED
+        self.failures         = 0
+        self.openedAt         = 0
+        self.probeAt          = None
+        self.opened           = 0
+        self.rejected         = 0
+        self.lock             = threading.Lock()
+
+    def allow(self):
+        """ Raise CircuitOpenError when no call should be made now
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.openedAt >= self.resetTimeout:
+                log.info("Circuit half-open, probing ombi")
+                self.state = HALF_OPEN
+                self.probeAt = None
+            if self.state == HALF_OPEN:
+                # one probe at a time, another one if it never reported back
+                if self.probeAt is None or now - self.probeAt >= self.resetTimeout:
+                    self.probeAt = now
+                    return
+            if self.state == CLOSED:
+                return
+            self.rejected += 1
+            retry = max(0, self.resetTimeout - (now - self.openedAt))
+        raise CircuitOpenError('Ombi is not responding, not trying again for {:.0f} s'.format(retry))
+
+    def success(self, elapsed=0):
+        """ Record a finished call, a slow one counts as a failure
+        """
+        if self.slowCall and elapsed > self.slowCall:
+            log.warning("Ombi call took %.1f s", elapsed)
+            self.failure()
+            return
+        with self.lock:
+            if self.state != CLOSED:
+                log.info("Circuit closed, ombi is back")
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failureThreshold):
+                log.warning("Circuit open after %s failed calls to ombi", self.failures)
+                self.state = OPEN
+                self.openedAt = time.monotonic()
+                self.opened += 1
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state, 'failures': self.failures, 'opened': self.opened, 'rejected': self.rejected}
@@ -0,0 +1,63 @@
+"""deadline.py: latency budget of the update being handled, passed down to the ombi calls it makes."""
+
+import time
+import contextvars
+from contextlib import contextmanager
+
+# a context variable rather than a thread local, so coroutines scheduled on the event loop for an
+# update carry its budget along, each task with its own
+current = contextvars.ContextVar('deadline', default=None)
+
+class DeadlineExceeded(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+@contextmanager
+def budget(seconds):
+    """ Calls made in this block on this thread or task have seconds in total, a budget set further
+        out that ends sooner is kept
+    """
+    outer = current.get()
+    deadline = time.monotonic() + seconds if seconds else None
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = current.set(deadline)
+    try:
+        yield
+    finally:
+        current.reset(token)
+
+async def within(coroutine, seconds):
+    """ Await coroutine with seconds in total for the calls it makes, e.g. on the event loop
+        for an update handled on another thread
+    """
+    token = current.set(time.monotonic() + seconds)
+    try:
+        return await coroutine
+    finally:
+        current.reset(token)
+
+def remaining():
+    """ Seconds left of the current budget, None without one
+    """
+    deadline = current.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def timeout(limit):
+    """ Timeout for the next operation: limit, or less when the budget ends sooner
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    if left <= 0:
+        raise DeadlineExceeded('Out of time for this update')
+    return min(limit, left) if limit else left
+
+def check():
+    """ Raise DeadlineExceeded when the budget is used up, e.g. between the chunks of a body
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Out of time for this update')
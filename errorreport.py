@@ -0,0 +1,206 @@
+"""errorreport.py: errors grouped by fingerprint and sent to the developers from a background thread, new ones at once and the rest as a periodic digest."""
+
+import os
+import html
+import time
+import queue
+import threading
+import traceback
+import logging
+from collections import OrderedDict
+from telegram.utils.helpers import mention_html
+log = logging.getLogger(__name__)
+
+# telegram refuses longer messages
+MAX_MESSAGE = 4096
+
+def fingerprint(error, module=None):
+    """ (exception type, handler, top frame) of an error. The handler is the first function of
+        module in the traceback that is not a decorator's wrapper, the top frame is where it was raised.
+    """
+    handler = None
+    top = None
+    for frame, lineno in traceback.walk_tb(error.__traceback__):
+        code = frame.f_code
+        if handler is None and module is not None and code.co_filename == module and code.co_name != 'wrapper':
+            handler = code.co_name
+        top = (code.co_filename, lineno, code.co_name)
+    where = '{}:{} in {}'.format(os.path.basename(top[0]), top[1], top[2]) if top else '?'
+    return (type(error).__name__, handler or '?', where)
+
+class ErrorGroup(object):
+    """ Occurrences of one fingerprint
+    """
+    __slots__ = ('fingerprint', 'message', 'count', 'pending', 'first', 'last')
+
+    def __init__(self, fingerprint, message):
+        self.fingerprint = fingerprint
+        self.message     = message
+        self.count       = 0
+        # occurrences not reported yet, sent with the next digest
+        self.pending     = 0
+        self.first       = time.time()
+        self.last        = self.first
+
+    def describe(self):
+        return '{} in {} at {}'.format(*self.fingerprint)
+
+class ErrorReporter(object):
+    """ Collects errors of the update handlers and reports them to the developers.
+
+        report() only counts the error under its fingerprint and returns. The first occurrence of
+        a fingerprint is formatted with its traceback, logged and queued for a background thread,
+        later occurrences are logged on one line with their update and summed up in a digest
+        every interval seconds. At most
+        maxMessages messages go out per interval, so a storm of the same error costs a handful
+        of messages instead of one per update.
+    """
+    def __init__(self, recipients, bot=None, interval=60, maxMessages=10, maxFingerprints=1000, module=None):
+        self.recipients      = list(recipients)
+        self.bot             = bot
+        self.interval        = interval
+        self.maxMessages     = maxMessages
+        self.maxFingerprints = maxFingerprints
+        self.module          = module
+        # fingerprint -> ErrorGroup, least recently seen first
+        self.groups          = OrderedDict()
+        self.outbox          = queue.Queue(maxsize=100)
+        self.reported        = 0
+        self.sent            = 0
+        self.dropped         = 0
+        self.lock            = threading.Lock()
+        self.stopped         = threading.Event()
+        self.thread          = threading.Thread(target=self._run, name='error-report', daemon=True)
+        self.thread.start()
+
+    def report(self, error, update=None):
+        """ Count an error and queue a report when its fingerprint is new
+        """
+        key = fingerprint(error, self.module)
+        message = None
+        while True:
+            with self.lock:
+                group = self.groups.get(key)
+                new = group is None and message is not None
+                if new:
+                    group = self.groups[key] = ErrorGroup(key, message)
+                    if len(self.groups) > self.maxFingerprints:
+                        self.groups.popitem(last=False)
+                if group is not None:
+                    self.reported += 1
+                    group.count += 1
+                    group.last = time.time()
+                    if not new:
+                        group.pending += 1
+                        self.groups.move_to_end(key)
+                    count = group.count
+                    break
+            # a new fingerprint, its traceback and update are formatted without holding the lock
+            message = format_error(error, update)
+
+        updateId = getattr(update, 'update_id', None)
+        userId = update.effective_user.id if update is not None and update.effective_user else None
+        if not new:
+            log.warning("Error %s again (%s times) in update %s of user %s: %s", group.describe(),count,updateId,userId,error)
+            return False
+
+        log.error("New error %s in update %s of user %s", group.describe(),updateId,userId,
+                  exc_info=(type(error), error, error.__traceback__))
+        try:
+            self.outbox.put_nowait(group.message)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+        return True
+
+    def digest(self):
+        """ Text summing up the occurrences since the last digest, or None when there were none
+        """
+        with self.lock:
+            lines = []
+            for group in self.groups.values():
+                if group.pending:
+                    lines.append((group.pending, group.describe()))
+                    group.pending = 0
+        if not lines:
+            return None
+        lines.sort(reverse=True)
+        text = 'Errors in the last {} s:'.format(self.interval)
+        for i, (count, description) in enumerate(lines):
+            line = '\n{}x <code>{}</code>'.format(count, html.escape(description))
+            if len(text) + len(line) > MAX_MESSAGE - 40:
+                text += '\n... and {} more'.format(len(lines) - i)
+                break
+            text += line
+        return text
+
+    def _send(self, text):
+        if self.bot is None:
+            log.info("No bot to send error report: %s", text)
+            return
+        for chatId in self.recipients:
+            try:
+                self.bot.send_message(chatId, text, parse_mode='HTML', disable_web_page_preview=True)
+                self.sent += 1
+            except Exception as e:
+                # reporting must not fail in turn, e.g. while telegram itself is not reachable
+                log.warning("Unable to send error report to %s: %s", chatId,e)
+
+    def _run(self):
+        nextDigest = time.monotonic() + self.interval
+        budget = self.maxMessages
+        while not self.stopped.is_set():
+            try:
+                text = self.outbox.get(timeout=max(0, nextDigest - time.monotonic()))
+            except queue.Empty:
+                text = None
+            if text is not None:
+                if budget > 0:
+                    budget -= 1
+                    self._send(text)
+                else:
+                    with self.lock:
+                        self.dropped += 1
+            if time.monotonic() >= nextDigest:
+                nextDigest = time.monotonic() + self.interval
+                budget = self.maxMessages
+                text = self.digest()
+                if text:
+                    budget -= 1
+                    self._send(text)
+
+    def stats(self):
+        with self.lock:
+            return {'reported': self.reported, 'distinct': len(self.groups), 'sent': self.sent, 'dropped': self.dropped}
+
+    def close(self):
+        """ Stop the background thread and send what is still pending
+        """
+        self.stopped.set()
+        try:
+            # wakes the thread up, a full outbox does that anyway
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join()
+        while not self.outbox.empty():
+            text = self.outbox.get_nowait()
+            if text is not None:
+                self._send(text)
+        text = self.digest()
+        if text:
+            self._send(text)
+
+def format_error(error, update=None):
+    """ HTML message with the error, where it happened and its traceback
+    """
+    payload = ""
+    # normally, we always have an user. If not, its either a channel or a poll update.
+    if update is not None and update.effective_user:
+        payload += ' with the user {}'.format(mention_html(update.effective_user.id, update.effective_user.first_name))
+    if update is not None and update.effective_chat and update.effective_chat.title:
+        payload += ' within the chat <i>{}</i>'.format(html.escape(update.effective_chat.title))
+    trace = ''.join(traceback.format_tb(error.__traceback__))
+    # keep the end of long tracebacks, that is where the error was raised, the whole message has to fit in MAX_MESSAGE
+    return "Hey.\n The error <code>{}</code> happened{}. The full traceback:\n\n<code>{}</code>".format(
+        html.escape(repr(error)[:300], quote=False), payload, html.escape(trace[-3000:], quote=False))
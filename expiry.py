@@ -0,0 +1,136 @@
+"""expiry.py: idle users expire from one heap swept by a job, instead of a timeout job per conversation."""
+
+import time
+import heapq
+import threading
+import logging
+from telegram.ext import ConversationHandler
+from telegram.utils.promise import Promise
+log = logging.getLogger(__name__)
+
+class Sweeper(object):
+    """ Deadlines of keys in a heap. touch() pushes a new deadline and only remembers the newest one
+        per key, older heap entries are skipped when they come up. sweep() pops the heap up to now,
+        so it costs O(expired) plus the skipped entries instead of a look at every key.
+
+        onExpire(key) is called for every expired key and may return the bytes it freed.
+    """
+    def __init__(self, ttl=86400, onExpire=None):
+        self.ttl        = ttl
+        self.onExpire   = onExpire
+        # key -> deadline of its newest touch
+        self.deadlines  = {}
+        self.heap       = []
+        self.expired    = 0
+        self.reclaimed  = 0
+        self.lock       = threading.Lock()
+
+    def touch(self, key, ttl=None):
+        """ Let key expire ttl seconds from now, replacing its earlier deadline
+        """
+        deadline = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, key))
+            # every touch leaves an outdated entry behind, drop them once they are the majority
+            if len(self.heap) > 2 * len(self.deadlines) + 1024:
+                self.heap = [(deadline, key) for key, deadline in self.deadlines.items()]
+                heapq.heapify(self.heap)
+
+    def discard(self, key):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def sweep(self, now=None):
+        """ Remove and return the keys whose deadline passed, calling onExpire for each
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == deadline:
+                    del self.deadlines[key]
+                    expired.append(key)
+            self.expired += len(expired)
+        if self.onExpire:
+            for key in expired:
+                self.reclaimed += self.onExpire(key) or 0
+        return expired
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+class ExpiringConversationHandler(ConversationHandler):
+    """ ConversationHandler that touches the user of a conversation in a Sweeper on every change
+        of state, with the idle time allowed in the new state, instead of scheduling a timeout job
+        per conversation. end_user() ends the conversations of a user once it expired.
+    """
+    def __init__(self, *args, sweeper=None, stateTtl=None, **kwargs):
+        super(ExpiringConversationHandler, self).__init__(*args, **kwargs)
+        self.sweeper    = sweeper
+        self.stateTtl   = stateTtl or {}
+        # user id -> keys of the user's conversations, (chat id, user id) with one per chat
+        self.userKeys   = {}
+
+    def update_state(self, new_state, key):
+        super(ExpiringConversationHandler, self).update_state(new_state, key)
+        if self.sweeper is None:
+            return
+        userId = key[-1]
+        if new_state == self.END:
+            with self._conversations_lock:
+                keys = self.userKeys.get(userId)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.userKeys[userId]
+            return
+        if isinstance(new_state, Promise):
+            # a handler is still running, the user stays as long as the state it started from allows
+            new_state = self.conversations.get(key, (None,))[0]
+        if new_state is None:
+            return
+        with self._conversations_lock:
+            self.userKeys.setdefault(userId, set()).add(key)
+        self.sweeper.touch(userId, self.stateTtl.get(new_state))
+
+    def touch(self, userId):
+        """ Touch a user with the idle time allowed in the state of its conversations, the longest one
+            when it has several, the sweeper's default without a conversation
+        """
+        with self._conversations_lock:
+            states = [self.conversations.get(key) for key in self.userKeys.get(userId, ())]
+        ttls = [self.stateTtl.get(state[0] if isinstance(state, tuple) else state, self.sweeper.ttl)
+                for state in states if state is not None]
+        self.sweeper.touch(userId, max(ttls) if ttls else None)
+
+    def track(self):
+        """ Touch the users of conversations loaded from persistence, they are not in the sweeper yet
+        """
+        with self._conversations_lock:
+            conversations = list(self.conversations.items())
+        for key, state in conversations:
+            if isinstance(state, tuple):
+                state = state[0]
+            with self._conversations_lock:
+                self.userKeys.setdefault(key[-1], set()).add(key)
+            self.sweeper.touch(key[-1], self.stateTtl.get(state))
+        return len(conversations)
+
+    def end_user(self, userId):
+        """ End the conversations of a user, unless a handler of one of them is still running.
+            Returns False in that case, the user should be touched again.
+        """
+        with self._conversations_lock:
+            keys = self.userKeys.get(userId, ())
+            if any(isinstance(self.conversations.get(key), tuple) and not self.conversations[key][1].done.is_set()
+                   for key in keys):
+                return False
+            keys = self.userKeys.pop(userId, ())
+        for key in keys:
+            self.update_state(self.END, key)
+        return True
@@ -0,0 +1,87 @@
+"""logutil.py: cheap logging on the hot path: deferred arguments, sampling of per-row logs and an optional queue handler."""
+
+import queue
+import logging
+import logging.handlers
+log = logging.getLogger(__name__)
+
+FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+class Lazy(object):
+    """ Log argument that is only computed when the record is formatted, e.g.
+        log.debug("Data = %s", Lazy(json.dumps, payload)). Costs nothing when the level is off.
+    """
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+def _text(response, limit):
+    text = response.text
+    return text if len(text) <= limit else '{}... ({} characters)'.format(text[:limit],len(text))
+
+def body(response, limit=1000):
+    """ Deferred and truncated text of a response, response bodies can be hundreds of kB
+    """
+    return Lazy(_text, response, limit)
+
+class Sampler(object):
+    """ Lets one in every n calls through, for debug logs inside loops over many rows:
+
+            if sample.enabled(log):
+                log.debug("Row %s", row)
+
+        The level is checked first, so at INFO the loop only pays for one cached level check.
+        Without every, the sampleEvery of the logging config is used.
+    """
+    __slots__ = ('every', 'count')
+    defaultEvery = 100
+
+    def __init__(self, every=None):
+        self.every = every
+        self.count = 0
+
+    def enabled(self, logger, level=logging.DEBUG):
+        if not logger.isEnabledFor(level):
+            return False
+        # unlocked, a lost increment only shifts which row is logged
+        self.count += 1
+        return (self.count - 1) % max(1, self.every or Sampler.defaultEvery) == 0
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that leaves formatting to the listener thread. The stock one formats the
+        message before queueing it, on the thread that logged.
+    """
+    def prepare(self, record):
+        return record
+
+def setup_logging(config):
+    """ Configure the root logger from the logging section of config.json. With queue enabled,
+        handlers run on a listener thread and the update threads only put records in a queue.
+        Returns the QueueListener to stop at exit, or None.
+    """
+    level = getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO)
+    Sampler.defaultEvery = config.get('sampleEvery', 100)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(config.get('format', FORMAT)))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.setLevel(level)
+
+    if not config.get('queue', False):
+        root.addHandler(handler)
+        return None
+
+    records = queue.SimpleQueue()
+    root.addHandler(DeferredQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
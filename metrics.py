@@ -0,0 +1,189 @@
+"""metrics.py: counters and latency histograms, served in the prometheus text format on /metrics."""
+
+import time
+import asyncio
+import bisect
+import functools
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+log = logging.getLogger(__name__)
+
+# seconds, from a cache hit to a slow ombi call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def label_text(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.lock    = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ All metrics in the prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                log.error("Unable to collect %s: %s", metric.name,e)
+                continue
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend('{}{} {}'.format(name, labels, value) for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock   = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [(self.name, label_text(self.labels, labels), value) for labels, value in values]
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name    = name
+        self.help    = help
+        self.labels  = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self.values  = {}
+        self.lock    = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """ Decorator observing the duration of each call, of plain and of async functions
+        """
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def awrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, *labels)
+                return awrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        output = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                output.append((self.name + '_bucket', label_text(self.labels, labels, 'le="{}"'.format(bound)), cumulative))
+            output.append((self.name + '_sum', label_text(self.labels, labels), total))
+            output.append((self.name + '_count', label_text(self.labels, labels), cumulative))
+        return output
+
+class Gauge(object):
+    """ Value read when scraped: func returns a number, or a dict of label values -> number
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, func, labels=(), registry=REGISTRY, kind=None):
+        self.name   = name
+        self.help   = help
+        self.func   = func
+        self.labels = tuple(labels)
+        if kind:
+            # e.g. counter for a total kept elsewhere
+            self.type = kind
+        registry.register(self)
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [(self.name, label_text(self.labels, labels if isinstance(labels, tuple) else (labels,)), number)
+                    for labels, number in value.items()]
+        return [(self.name, '', value)]
+
+class MetricsServer(object):
+    """ Serves the registry on http://listen:port/metrics in a background thread
+    """
+    def __init__(self, listen='127.0.0.1', port=9090, registry=REGISTRY):
+        self.registry = registry
+        self.httpd    = ThreadingHTTPServer((listen, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port     = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True).start()
+        log.info("Serving metrics on port %s", self.port)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
@@ -0,0 +1,197 @@
+"""models.py: compact records for the movies returned by ombi."""
+
+from array import array
+
+MARK_AVAILABLE = b'\xE2\x9C\x85'.decode('utf-8')
+MARK_REQUESTED = b'\xE2\x9E\xA1'.decode('utf-8')
+
+# bits in Season.flags, one byte per episode
+EPISODE_AVAILABLE = 1
+EPISODE_REQUESTED = 2
+
+def year_of(releaseDate):
+    return releaseDate.split('-')[0] if releaseDate else 'N/A'
+
+def button_text(title, year, available=False, requested=False, maxLength=60):
+    """ Text of a result button: title (year), the title cut to maxLength, and the available/requested marker
+    """
+    title = title or ''
+    if len(title) > maxLength:
+        title = title[:maxLength - 1] + '…'
+    text = '{} ({})'.format(title, year)
+    if available:
+        text = text + MARK_AVAILABLE
+    elif requested:
+        text = text + MARK_REQUESTED
+    return text
+
+def season_text(number, episodes, available=0, requested=0):
+    """ Text of a season button, marked when every episode is available or at least requested
+    """
+    text = '{} ({} episodes)'.format('Season {}'.format(number) if number else 'Specials', episodes)
+    if episodes and available >= episodes:
+        text = text + MARK_AVAILABLE
+    elif episodes and available + requested >= episodes:
+        text = text + MARK_REQUESTED
+    return text
+
+def episode_ranges(numbers):
+    """ Episode numbers as ranges, e.g. [1, 2, 3, 5] -> '1-3, 5'
+    """
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ', '.join(str(first) if first == last else '{}-{}'.format(first, last) for first, last in ranges)
+
+class MovieResult(object):
+    """ One movie of a search result, only the fields the bot uses
+    """
+    __slots__ = ('id', 'title', 'available', 'requested', 'releaseDate')
+    # all slots including those of subclasses, in constructor order
+    fields    = __slots__
+
+    def __init__(self, id, title, available=False, requested=False, releaseDate=None):
+        self.id          = id
+        self.title       = title
+        self.available   = available
+        self.requested   = requested
+        self.releaseDate = releaseDate
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('id'), data.get('title'), data.get('available'), data.get('requested'), data.get('releaseDate'))
+
+    @property
+    def year(self):
+        return year_of(self.releaseDate)
+
+    def label(self, maxLength=60):
+        return button_text(self.title, self.year, self.available, self.requested, maxLength)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+    def replace(self, **changes):
+        """ A copy with some fields changed, records shared through the cache are never changed in place
+        """
+        return type(self)(*(changes.get(name, getattr(self, name)) for name in self.fields))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.fields, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.__getstate__() == other.__getstate__()
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.fields))
+
+class MovieInfo(MovieResult):
+    """ Details of a movie, as shown before requesting it
+    """
+    __slots__ = ('overView', 'voteCount', 'voteAverage')
+    fields    = MovieResult.fields + __slots__
+
+    def __init__(self, id, title, available=False, requested=False, releaseDate=None, overView=None, voteCount=None, voteAverage=None):
+        super(MovieInfo, self).__init__(id, title, available, requested, releaseDate)
+        self.overView    = overView
+        self.voteCount   = voteCount
+        self.voteAverage = voteAverage
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('id'), data.get('title'), data.get('available'), data.get('requested'), data.get('releaseDate'),
+                   data.get('overview'), data.get('voteCount'), data.get('voteAverage'))
+
+class MovieList(dict):
+    """ Search results in ombi's order (dicts keep insertion order), keyed by movie id so remakes
+        with the same title are kept
+    """
+    def add(self, movie):
+        self[movie.id] = movie
+
+class ShowResult(MovieResult):
+    """ One tv show of a search result. The id is the tvdb id, releaseDate holds the first air date
+    """
+    __slots__ = ('status',)
+    fields    = MovieResult.fields + __slots__
+
+    def __init__(self, id, title, available=False, requested=False, releaseDate=None, status=None):
+        super(ShowResult, self).__init__(id, title, available, requested, releaseDate)
+        self.status = status
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('id'), data.get('title'), data.get('fullyAvailable') or data.get('available'),
+                   data.get('requested'), data.get('firstAired'), data.get('status'))
+
+class ShowInfo(ShowResult):
+    """ Details of a show with a summary of its seasons: (season number, episodes, available, requested).
+        The episodes themselves are kept per Season, apart from the show
+    """
+    __slots__ = ('overView', 'network', 'seasons')
+    fields    = ShowResult.fields + __slots__
+
+    def __init__(self, id, title, available=False, requested=False, releaseDate=None, status=None,
+                 overView=None, network=None, seasons=()):
+        super(ShowInfo, self).__init__(id, title, available, requested, releaseDate, status)
+        self.overView = overView
+        self.network  = network
+        self.seasons  = tuple(seasons)
+
+    @classmethod
+    def from_json(cls, data, seasons=()):
+        network = data.get('network')
+        if isinstance(network, dict):
+            network = network.get('name')
+        return cls(data.get('id'), data.get('title'), data.get('fullyAvailable') or data.get('available'),
+                   data.get('requested'), data.get('firstAired'), data.get('status'), data.get('overview'), network,
+                   [(season.number, len(season), season.available, season.requested) for season in seasons])
+
+class Season(object):
+    """ Episodes of one season of a show: episode numbers in an array and one byte of
+        availability flags per episode, without the episode titles and air dates
+    """
+    __slots__ = ('show', 'number', 'episodes', 'flags')
+
+    def __init__(self, show, number, episodes=(), flags=b''):
+        self.show     = show
+        self.number   = number
+        self.episodes = array('H', episodes)
+        self.flags    = bytes(flags)
+
+    @classmethod
+    def from_json(cls, show, data):
+        episodes = sorted(data.get('episodes') or [], key=lambda episode: episode.get('episodeNumber') or 0)
+        return cls(show, data.get('seasonNumber'),
+                   [episode.get('episodeNumber') or 0 for episode in episodes],
+                   [(EPISODE_AVAILABLE if episode.get('available') else 0) |
+                    (EPISODE_REQUESTED if episode.get('requested') or episode.get('approved') else 0) for episode in episodes])
+
+    def __len__(self):
+        return len(self.episodes)
+
+    @property
+    def available(self):
+        return sum(1 for flag in self.flags if flag & EPISODE_AVAILABLE)
+
+    @property
+    def requested(self):
+        return sum(1 for flag in self.flags if flag & EPISODE_REQUESTED and not flag & EPISODE_AVAILABLE)
+
+    def missing(self):
+        """ Numbers of the episodes that are neither available nor requested
+        """
+        return [episode for episode, flag in zip(self.episodes, self.flags) if not flag]
+
+    def to_dict(self):
+        return {'show': self.show, 'number': self.number, 'episodes': list(self.episodes), 'flags': list(self.flags)}
+
+    def __repr__(self):
+        return 'Season(show={!r}, number={!r}, episodes={})'.format(self.show, self.number, len(self.episodes))
@@ -18,8 +18,24 @@ __copyright__   = "Copyright 2019"
 
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import time
+import functools
+import threading
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from responsecache import make_key, MOVIE_ENDPOINTS
+from singleflight import SingleFlight
+from streamjson import parse_movies_stream
+from models import MovieResult, MovieInfo, MovieList, ShowResult, ShowInfo, Season
+from logutil import Lazy, Sampler, body
+from ratelimit import retry_after
+from circuitbreaker import CircuitOpenError
+from deadline import DeadlineExceeded
+import deadline
+import metrics
 log = logging.getLogger(__name__)
 
 httpErrors = {
@@ -85,229 +101,589 @@ httpErrors = {
     522 : 'Connection timed out, server denied request for OAuth token',
     599 : 'Network Connect Timeout Error'}
 
+# status codes worth trying again after a pause
+TRANSIENT = (408, 429, 500, 502, 503, 504)
+
+OMBI_LATENCY = metrics.Histogram('ombi_call_duration_seconds', 'Duration of ombi client calls, cached answers included', ['method'])
+OMBI_STATUS  = metrics.Counter('ombi_http_responses_total', 'Responses from ombi by http status', ['code', 'reason'])
+
 class HTTP_MethodError(Exception):
     def __init__(self, value):
         self.value = value
     def __str__(self):
         return repr(self.value)
 
+# one in every sampleEvery parsed rows is logged at debug level
+rowSample = Sampler()
+
+def parse_movies(parsedata, maxResults=None):
+    """ Reduce a list of ombi search results to a MovieList of the fields used by the bot
+    """
+    output = MovieList()
+    for data in parsedata:
+        if rowSample.enabled(log):
+            log.debug("Search result %s", data)
+        output.add(MovieResult.from_json(data))
+        if maxResults and len(output) >= maxResults:
+            break
+    return output
+
+def parse_movie_info(data):
+    """ Reduce an ombi movie info response to a MovieInfo, None when there is none
+    """
+    if not data:
+        return None
+    return MovieInfo.from_json(data)
+
+def parse_movie_requests(parsedata):
+    """ Reduce the list of movie requests to a MovieList, keyed by the movie db id like search results.
+        Denied requests are kept for their titles but not marked requested, they may be asked for again
+    """
+    output = MovieList()
+    for data in parsedata:
+        if rowSample.enabled(log):
+            log.debug("Movie request %s", data)
+        requested = not data.get('denied')
+        output.add(MovieResult(data.get('theMovieDbId'), data.get('title'), data.get('available'), requested, data.get('releaseDate')))
+    return output
+
+def parse_shows(parsedata, maxResults=None):
+    """ Reduce a list of ombi tv search results to a MovieList of ShowResults, keyed by tvdb id
+    """
+    output = MovieList()
+    for data in parsedata:
+        output.add(ShowResult.from_json(data))
+        if maxResults and len(output) >= maxResults:
+            break
+    return output
+
+def parse_show_info(data):
+    """ Split an ombi tv info response into the show with a summary of its seasons, and the seasons
+    """
+    if not data:
+        return None, []
+    seasons = [Season.from_json(data.get('id'), season) for season in data.get('seasonRequests') or []]
+    seasons.sort(key=lambda season: season.number or 0)
+    return ShowInfo.from_json(data, seasons), seasons
+
+def season_key(showID, seasonNumber, languageCode='en'):
+    return make_key('season', '{} {}'.format(int(showID), int(seasonNumber)), languageCode)
+
+def tv_request(showID, seasons=None):
+    """ Payload of one tv request: seasons maps season numbers to episode numbers, None requests the whole show
+    """
+    return {
+        'tvDbId': int(showID),
+        'requestAll': seasons is None,
+        'latestSeason': False,
+        'firstSeason': False,
+        'seasons': [{'seasonNumber': int(number), 'episodes': [{'episodeNumber': int(episode)} for episode in episodes]}
+                    for number, episodes in sorted((seasons or {}).items())]
+    }
+
+def parse_request(response):
+    """ Get the message to show for an ombi request response
+    """
+    message = response.get('message') if response.get('result') else response.get('errorMessage')
+    log.info("Result: %s Message: %s", response.get('result') if response else None,message)
+    return message
+
+def within_budget(chunks):
+    """ Pass on the chunks of a streamed body, raising DeadlineExceeded once the budget is used up
+    """
+    for chunk in chunks:
+        deadline.check()
+        yield chunk
+
+def lookup(endpoint):
+    """ Serve a lookup from the cache, and let concurrent identical lookups share one call to ombi.
+        Each caller waits for it as long as its own budget allows and falls back to an expired entry
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, term, languageCode='en'):
+            key = make_key(endpoint, term, languageCode)
+            output = self._cached(key)
+            if output is not None:
+                log.info("Returning cached %s for %s", endpoint,term)
+                return self._fresh(key, output)
+
+            def fetch():
+                output = func(self, term, languageCode)
+                self._store(key, output)
+                return output
+
+            try:
+                return self._fresh(key, self.flight.do(key, fetch))
+            except (HTTP_MethodError, CircuitOpenError, DeadlineExceeded) as e:
+                output = self._cached(key, stale=True)
+                if output is None:
+                    raise
+                log.info("Returning expired %s for %s: %s", endpoint,term,e)
+                return self._fresh(key, output)
+        return wrapper
+    return decorator
+
 class OmbiServer(object):
-    def __init__(self, server, apikey, port=5000, baseUrl='/ombi', userName='guest'):
+    def __init__(self, server, apikey, port=5000, baseUrl='/ombi', userName='guest',
+                 poolSize=10, maxConnections=10, keepAlive=60, connectTimeout=5, readTimeout=30, cache=None,
+                 streaming=True, chunkSize=65536, maxResults=None, index=None, availability=None,
+                 maxRetries=3, maxBackoff=30, breaker=None):
         self.api_key    = apikey
         self.userName   = userName
         self.endpoint   = server + ':' + str(port) + baseUrl + '/api/v1'
-
-        log.info ("Endpoint is {}".format(self.endpoint))
-
-    def search_movies(self, title):
-        """ Get queue from server
-        """
-        log.info("Searching for movies with title = {}".format(title))
-        # Create and send HTTP Get to the server
-        h={
+        self.timeout    = (connectTimeout, readTimeout)
+        self.keepAlive  = keepAlive
+        # optional ResponseCache for searches and movie info
+        self.cache      = cache
+        # identical lookups running at the same time share one request
+        self.flight     = SingleFlight()
+        # search results are parsed while they are read, and reading stops after maxResults
+        self.streaming  = streaming
+        self.chunkSize  = chunkSize
+        self.maxResults = maxResults
+        # optional TitleIndex, fed with every search result
+        self.index      = index
+        # optional AvailabilityIndex, its flags are merged into every result
+        self.availability = availability
+        # answers of 429 Too Many Requests are retried after Retry-After, meanwhile no call goes out
+        self.maxRetries = maxRetries
+        self.maxBackoff = maxBackoff
+        self.pausedUntil = 0
+        self.throttled  = 0
+        # optional CircuitBreaker, shared with the async client
+        self.breaker    = breaker
+
+        # headers shared by every call, built once
+        self.headers = {
             'http.useragent' : 'ombi-server',
-            'ApiKey'      :     self.api_key,
+            'ApiKey'         : self.api_key,
             'Content-Type'   : 'application/json',
-            'User-Agent'     : 'Ombi/server',
-            'Accept-Encoding': 'gzip'
+            'Accept-Encoding': 'gzip',
+            'User-Agent'     : 'Ombi/server'
         }
 
+        # one keep-alive connection pool for all calls to ombi
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=maxConnections)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(self.headers)
+        self.lastUsed    = time.monotonic()
+        self.sessionLock = threading.Lock()
+
+        log.info("Endpoint is %s", self.endpoint)
+        log.info("Connection pool: %s pools, %s connections per host, keep-alive %s s", poolSize,maxConnections,keepAlive)
+
+    def _send(self, method, url, payload=None, headers=None, stream=False, retries=0, backoff=1.0):
+        """ Send a request through the pooled session, waiting and retrying when ombi answers 429.
+            With retries, connection errors and the other transient answers are retried as well,
+            in the same loop, so a call is never tried more than max(maxRetries, retries) + 1 times.
+        """
+        data = json.dumps(payload) if payload is not None else None
+        for attempt in range(max(self.maxRetries, retries) + 1):
+            with self.sessionLock:
+                now = time.monotonic()
+                if self.keepAlive and now - self.lastUsed > self.keepAlive:
+                    # idle connections are likely closed by a proxy in between, drop them
+                    log.debug("Connections idle for %.0f s, closing pool", now - self.lastUsed)
+                    self.session.close()
+                self.lastUsed = now
+                pause = self.pausedUntil - now
+            if pause > 0:
+                if deadline.timeout(pause) < pause:
+                    raise DeadlineExceeded('Ombi asked to wait {:.1f} s, longer than the time left'.format(pause))
+                time.sleep(pause)
+
+            if self.breaker:
+                self.breaker.allow()
+            # the configured timeouts, or less when the update being handled has less time left.
+            # The read timeout bounds each read, not the whole body: streamed bodies check the
+            # budget between chunks, see within_budget
+            timeout = (deadline.timeout(self.timeout[0]), deadline.timeout(self.timeout[1]))
+            start = time.monotonic()
+            try:
+                r = self.session.request(method, url, headers=headers, data=data, timeout=timeout, stream=stream)
+            except Exception as e:
+                if self.breaker:
+                    self.breaker.failure()
+                OMBI_STATUS.inc('error', 'Connection error')
+                if attempt >= retries:
+                    raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+                log.info("Call to %s failed, retrying: %s", url,e)
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            OMBI_STATUS.inc(str(r.status_code), httpErrors.get(r.status_code, 'Unknown'))
+            if self.breaker:
+                if r.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success(time.monotonic() - start)
+            if r.status_code != 429:
+                if r.status_code not in TRANSIENT or attempt >= retries:
+                    return r
+                log.info("Call to %s got HTTP %s, retrying", url,r.status_code)
+                r.close()
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            if attempt >= self.maxRetries:
+                return r
+
+            delay = min(self.maxBackoff, retry_after(r.headers.get('Retry-After'), 2 ** attempt))
+            log.warning("Ombi answered 429 Too Many Requests, waiting %.1f s", delay)
+            r.close()
+            with self.sessionLock:
+                self.throttled += 1
+                self.pausedUntil = max(self.pausedUntil, time.monotonic() + delay)
+
+    def _parse_movies(self, r):
+        """ Parse a list of search results, from the body as it arrives when streaming
+        """
+        if not self.streaming:
+            return parse_movies(r.json(), self.maxResults)
         try:
-            url = self.endpoint + '/Search/movie/' +str(title)
-            log.debug("Sending GET request to {}".format(url))
-            r = requests.get(url, headers=h,timeout=30)
-        except Exception as e:
-            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+            return parse_movies_stream(within_budget(r.iter_content(chunk_size=self.chunkSize)), self.maxResults)
+        finally:
+            # when parsing stopped early the rest of the body is dropped with the connection
+            r.close()
+
+    def _cached(self, key, stale=False):
+        return self.cache.get(key, stale) if self.cache else None
+
+    def _fresh(self, key, output):
+        # merge the flags of the last library sync, so cached results show the current status.
+        # The cached records are shared, flagged ones are copies
+        if self.availability is not None and output and key[0] in MOVIE_ENDPOINTS:
+            if key[0] == 'info':
+                return self.availability.apply([output])[0]
+            flagged = MovieList()
+            for movie in self.availability.apply(output.values()):
+                flagged.add(movie)
+            return flagged
+        return output
 
-        log.info("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
-        output = {}
+    def _store(self, key, output):
+        # empty results are not cached, they are what failed calls return as well
+        if self.cache and output:
+            self.cache.set(key, output)
+        if self.index is not None and output and key[0] in MOVIE_ENDPOINTS and key[0] != 'info':
+            self.index.add(output.values())
+
+    @OMBI_LATENCY.time('search_movies')
+    @lookup('search')
+    def search_movies(self, title,languageCode='en'):
+        """ Get queue from server
+        """
+        log.info("Searching for movies with title = %s", title)
+        # Send HTTP Get to the server
+        url = self.endpoint + '/Search/movie/' +str(title)
+        log.debug("Sending GET request to %s", url)
+        r = self._send('GET', url, stream=True)
+
+        log.info("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        output = MovieList()
 
         if r.status_code == 200: #200 = 'OK'
             #try:
-            #log.info("Response: {}".format(r.text()))
-            parsedata = r.json()
-            log.info("type = {}, len = {}".format(type(parsedata),len(parsedata)))
-            for data in parsedata:
-                log.info("Parsing n = {} data of type {}".format(len(data),type(data)))
-                output[data.get('title')] = {'id':data.get('id'),'title':data.get('title'), 'available':data.get('available'),'requested':data.get('requested'),'releaseDate':data.get('releaseDate')}
+            output = self._parse_movies(r)
 
             #except Exception as e:
             #log.error("Server returned error: {}".format(e))
+        else:
+            # the streamed body is not read, give the connection back to the pool
+            r.close()
 
-
-        log.info("Returning {} records".format(len(output)))
+        log.info("Returning %s records", len(output))
         return output
 
+    @OMBI_LATENCY.time('search_movies_actor')
+    @lookup('actor')
     def search_movies_actor(self, actor,languageCode='en'):
         """ Get queue from server
         """
-        log.info("Searching for movies with actor = {}".format(actor))
-        # Create and send HTTP Get to the server
-        headers = {
-            'http.useragent' : 'ombi-server',
-            'ApiKey'      :     self.api_key,
-            'Content-Type'   : 'application/json',
-            'Accept-Encoding': 'gzip',
-            'User-Agent'     : 'Ombi/server'
-        }
-
+        log.info("Searching for movies with actor = %s", actor)
         payload = {
             "searchTerm": actor,
             "languageCode": "en"
         }
 
-        try:
-            url = self.endpoint + '/Search/movie/actor'
-            log.info("Sending POST request to {} with data = {}, {}".format(url,payload,json.dumps(payload)))
+        url = self.endpoint + '/Search/movie/actor'
+        log.debug("Sending POST request to %s with data = %s", url,Lazy(json.dumps, payload))
 
-            r = requests.post(url = url, headers = headers, data = json.dumps(payload))
-        except Exception as e:
-            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+        r = self._send('POST', url, payload, stream=True)
 
-        log.debug("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
-        log.debug("Response = {}".format(r.text))
-        log.debug("Url = {}".format(r.url))
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        log.debug("Url = %s", r.url)
 
-        output = {}
+        output = MovieList()
         if r.status_code == 200: #200 = 'OK'
 
-            parsedata = r.json()
-
             try:
-                log.debug("type = {}, len = {}".format(type(parsedata),len(parsedata)))
-                for data in parsedata:
-                    #log.info("Parsing {} data: {}".format(self.type,data))
-                    output[data.get('title')] = {'id':data.get('id'),'title':data.get('title'), 'available':data.get('available'),'requested':data.get('requested'),'releaseDate':data.get('releaseDate')}
+                output = self._parse_movies(r)
 
             except Exception as e:
-                log.error("Unable to process search: {}".format(e))
-        log.info("Returning {} records".format(len(output)))
+                log.error("Unable to process search: %s", e)
+        else:
+            r.close()
+        log.info("Returning %s records", len(output))
         return output
 
-    def request_movie(self, movieID,user,languageCode='en'):
-        """ Get queue from server
+    def _post_request(self, movieID, user, retries=0, backoff=1.0):
+        """ Send a movie request, with retries of connection errors and transient http errors.
+            Returns the json response, None when ombi did not accept the call
         """
-        log.info("Request movie with id =  {}".format(movieID))
-        # Create and send HTTP Get to the server
-        headers = {
-            'http.useragent'    : 'ombi-server',
-            'ApiKey'            : self.api_key,
-            'UserName'          : user,
-            'Content-Type'      : 'application/json',
-            'Accept-Encoding'   : 'gzip',
-            'User-Agent'        : 'Ombi/server'
-        }
+        log.info("Request movie with id =  %s", movieID)
+        # the session carries the common headers, only the ombi user differs per call
+        headers = {'UserName' : user}
 
         payload = {
             'theMovieDbId': int(movieID),
             'languageCode': 'en'
         }
 
-        try:
-            url = self.endpoint + '/Request/movie'
-            log.debug("Sending POST request to {} with headers = {}".format(url,headers))
+        url = self.endpoint + '/Request/movie'
+        log.debug("Sending POST request to %s with headers = %s", url,headers)
 
-            r = requests.post(url = url, headers = headers, data = json.dumps(payload))
-        except Exception as e:
-            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+        r = self._send('POST', url, payload, headers=headers, retries=retries, backoff=backoff)
 
-        log.debug("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
-        log.debug("Response = {}".format(r.text))
-        log.debug("Url = {}".format(r.url))
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        log.debug("Response = %s", body(r))
+        log.debug("Url = %s", r.url)
 
         if r.status_code == 200: #200 = 'OK'
 
             response = r.json()
-            message = response.get('message') if response.get('result') else response.get('errorMessage')
-            log.info("Result: {} Message: {}".format(response.get('result') if response else None,message))
-            return message
+            if response.get('result'):
+                # keep the requested markers of cached searches correct
+                if self.cache:
+                    self.cache.update_movie(movieID, requested=True)
+                if self.availability is not None:
+                    self.availability.mark(movieID, requested=True)
+            return response
         else:
-            log.error("Unable to handle request: {}, {}".format(r.status_code,r.text))
-            return False
+            log.error("Unable to handle request: %s, %s", r.status_code,body(r))
+            return None
+
+    @OMBI_LATENCY.time('request_movie')
+    def request_movie(self, movieID,user,languageCode='en'):
+        """ Request a movie for an ombi user, returns ombi's message or False
+        """
+        response = self._post_request(movieID, user)
+        return parse_request(response) if response is not None else False
+
+    @OMBI_LATENCY.time('request_movies')
+    def request_movies(self, ids, user, workers=4, retries=2, backoff=1.0, progress=None, throttle=None):
+        """ Request many movies at once on a few threads, retrying transient failures.
+            Returns {id: (accepted, message)} in the order of ids. progress(done, total, id, result)
+            is called as each movie finishes, throttle() before each request is sent.
+        """
+        ids = list(OrderedDict.fromkeys(int(movieID) for movieID in ids))
+        results = OrderedDict((movieID, None) for movieID in ids)
+        lock = threading.Lock()
+        done = [0]
+
+        def request(movieID):
+            try:
+                if throttle:
+                    throttle()
+                response = self._post_request(movieID, user, retries, backoff)
+                if response is None:
+                    result = (False, 'Ombi did not accept the request')
+                else:
+                    result = (bool(response.get('result')), parse_request(response))
+            except Exception as e:
+                log.error("Unable to request movie %s: %s", movieID,e)
+                result = (False, str(e))
+            with lock:
+                results[movieID] = result
+                done[0] += 1
+                count = done[0]
+            if progress:
+                progress(count, len(ids), movieID, result)
+
+        log.info("Requesting %s movies for %s with %s threads", len(ids),user,workers)
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='request') as executor:
+            list(executor.map(request, ids))
+        return results
+
+    @OMBI_LATENCY.time('get_movie_requests')
+    def get_movie_requests(self):
+        """ Get all movie requests, with their availability
+        """
+        url = self.endpoint + '/Request/movie'
+        log.debug("Sending GET request to %s", url)
+        r = self._send('GET', url)
 
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        output = MovieList()
+
+        if r.status_code == 200: #200 = 'OK'
+            try:
+                output = parse_movie_requests(r.json())
+            except Exception as e:
+                log.error("Unable to process movie requests: %s", e)
+        log.info("Returning %s requests", len(output))
+        return output
+
+    @OMBI_LATENCY.time('find_similar')
+    @lookup('similar')
     def find_similar(self, movieID,languageCode='en'):
         """ Get similar movies from server
         """
 
-        # Create and send HTTP Get to the server
-        headers = {
-            'http.useragent' : 'ombi-server',
-            'ApiKey'      :     self.api_key,
-            'Content-Type'   : 'application/json',
-            'Accept-Encoding': 'gzip',
-            'User-Agent'     : 'Ombi/server'
-        }
-
         payload = {
             'theMovieDbId': int(movieID),
             'languageCode': 'en'
         }
 
-        try:
-            url = self.endpoint + '/Search/movie/similar'
-            log.debug("Sending POST request to {} with data = {}, {}".format(url,payload,json.dumps(payload)))
+        url = self.endpoint + '/Search/movie/similar'
+        log.debug("Sending POST request to %s with data = %s", url,Lazy(json.dumps, payload))
 
-            r = requests.post(url = url, headers = headers, data = json.dumps(payload))
-        except Exception as e:
-            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+        r = self._send('POST', url, payload, stream=True)
 
-        log.debug("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
-        log.debug("Response = {}".format(r.text))
-        log.debug("Url = {}".format(r.url))
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        log.debug("Url = %s", r.url)
 
-        output = {}
+        output = MovieList()
 
         if r.status_code == 200: #200 = 'OK'
-            parsedata = r.json()
-            log.debug("type = {}, len = {}".format(type(parsedata),len(parsedata)))
             try:
-                for data in parsedata:
-                    #log.info("Parsing {} data: {}".format(self.type,data))
-                    output[data.get('title')] = {'id':data.get('id'),'title':data.get('title'), 'available':data.get('available'),'requested':data.get('requested'),'releaseDate':data.get('releaseDate')}
+                output = self._parse_movies(r)
             except Exception as e:
-                log.error("Invalid server type: {}, {}".format(self.type,e))
-        log.info("Returning {} records".format(len(output)))
+                log.error("Unable to process similar movies: %s", e)
+        else:
+            r.close()
+        log.info("Returning %s records", len(output))
         return output
 
+    @OMBI_LATENCY.time('get_movie_info')
+    @lookup('info')
     def get_movie_info(self, movieID,languageCode='en'):
         """ Get extra movie information from server
         """
-        log.debug("Got id: {}".format(movieID))
-        # Create and send HTTP Get to the server
-        headers = {
-            'http.useragent' : 'ombi-server',
-            'ApiKey'      :     self.api_key,
-            'Content-Type'   : 'application/json',
-            'Accept-Encoding': 'gzip',
-            'User-Agent'     : 'Ombi/server'
-        }
-
+        log.debug("Got id: %s", movieID)
         payload = {
             'theMovieDbId': int(movieID),
             'languageCode': 'en'
         }
 
-        try:
-            url = self.endpoint + '/Search/movie/info'
-            log.debug("Sending POST request to {} with data = {}, {}".format(url,payload,json.dumps(payload)))
+        url = self.endpoint + '/Search/movie/info'
+        log.debug("Sending POST request to %s with data = %s", url,Lazy(json.dumps, payload))
 
-            r = requests.post(url = url, headers = headers, data = json.dumps(payload))
-        except Exception as e:
-            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+        r = self._send('POST', url, payload)
 
-        log.debug("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
-        log.debug("Response = {}".format(r.text))
-        log.debug("Url = {}".format(r.url))
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        log.debug("Response = %s", body(r))
+        log.debug("Url = %s", r.url)
 
-        output = {}
+        output = None
 
         if r.status_code == 200: #200 = 'OK'
             parsedata = r.json()
-            log.debug("Text = {}".format(r.text))
-            if parsedata:
-                data = parsedata
-                output = {'id':data.get('id'), 'overView': data.get('overview'), 'voteCount':data.get('voteCount'),'voteAverage':data.get('voteAverage'),'title':data.get('title'), 'available':data.get('available'),'requested':data.get('requested'),'releaseDate':data.get('releaseDate')}    
+            output = parse_movie_info(parsedata)
+
+        log.info("Returning %s", output)
 
-        log.info("Returning {} fields: {}".format(len(output),output))
+        return output
+
+    @OMBI_LATENCY.time('search_series')
+    @lookup('tv')
+    def search_series(self, title,languageCode='en'):
+        """ Search tv shows by title, without their seasons
+        """
+        log.info("Searching for series with title = %s", title)
+        url = self.endpoint + '/Search/tv/' + str(title)
+        r = self._send('GET', url)
 
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        output = MovieList()
+
+        if r.status_code == 200: #200 = 'OK'
+            try:
+                output = parse_shows(r.json(), self.maxResults)
+            except Exception as e:
+                log.error("Unable to process series search: %s", e)
+        log.info("Returning %s shows", len(output))
         return output
+
+    def _load_show(self, showID, languageCode='en'):
+        """ Get a show with all its seasons from ombi. The seasons are cached on their own, so the
+            show info stays small and seasons nobody opens again are the first to be evicted
+        """
+        url = self.endpoint + '/Search/tv/info/' + str(int(showID))
+        log.debug("Sending GET request to %s", url)
+        r = self._send('GET', url)
+
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        if r.status_code != 200: #200 = 'OK'
+            return None, []
+
+        info, seasons = parse_show_info(r.json())
+        for season in seasons:
+            self._store(season_key(showID, season.number, languageCode), season)
+        log.info("Show %s has %s seasons", showID,len(seasons))
+        return info, seasons
+
+    @OMBI_LATENCY.time('get_series_info')
+    @lookup('tvinfo')
+    def get_series_info(self, showID,languageCode='en'):
+        """ Get a show and a summary of its seasons, the episodes are loaded by get_season
+        """
+        info, seasons = self._load_show(showID, languageCode)
+        return info
+
+    @OMBI_LATENCY.time('get_season')
+    def get_season(self, showID, seasonNumber, languageCode='en'):
+        """ Get the episodes of one season, loading the show again when the season is not cached
+        """
+        key = season_key(showID, seasonNumber, languageCode)
+        season = self._cached(key)
+        if season is not None:
+            return season
+
+        def fetch():
+            info, seasons = self._load_show(showID, languageCode)
+            self._store(make_key('tvinfo', showID, languageCode), info)
+            return next((season for season in seasons if season.number == int(seasonNumber)), None)
+
+        try:
+            return self.flight.do(key, fetch)
+        except (HTTP_MethodError, CircuitOpenError, DeadlineExceeded):
+            season = self._cached(key, stale=True)
+            if season is None:
+                raise
+            return season
+
+    @OMBI_LATENCY.time('request_series')
+    def request_series(self, showID, user, seasons=None):
+        """ Request a show for an ombi user in one call. seasons maps season numbers to the episodes
+            to request, None requests the whole show. Returns ombi's message or False
+        """
+        log.info("Request series with id = %s, seasons = %s", showID,sorted(seasons) if seasons else 'all')
+        url = self.endpoint + '/Request/tv'
+        r = self._send('POST', url, tv_request(showID, seasons), headers={'UserName' : user})
+
+        log.debug("HTTP %s: %s", r.status_code,httpErrors[r.status_code])
+        log.debug("Response = %s", body(r))
+
+        if r.status_code != 200: #200 = 'OK'
+            log.error("Unable to handle request: %s, %s", r.status_code,body(r))
+            return False
+
+        response = r.json()
+        if response.get('result') and self.cache:
+            # requested markers of the show changed, load it again when it is opened
+            show = str(int(showID))
+            self.cache.discard(lambda key: key[0] in ('tvinfo', 'season') and key[1].split()[0] == show)
+        return parse_request(response)
+
+    def request_season(self, showID, seasonNumber, user):
+        """ Request the episodes of a season that are neither available nor requested, in one call
+        """
+        season = self.get_season(showID, seasonNumber)
+        if season is None:
+            return False
+        episodes = season.missing()
+        if not episodes:
+            return 'Every episode of season {} is already available or requested'.format(seasonNumber)
+        return self.request_series(showID, user, {season.number: episodes})
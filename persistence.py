@@ -0,0 +1,174 @@
+"""persistence.py: conversation and user state that survives restarts and is shared by bot workers."""
+
+import json
+import pickle
+import sqlite3
+import threading
+import logging
+from collections import defaultdict
+from telegram.ext import BasePersistence
+from telegram.utils.promise import Promise
+log = logging.getLogger(__name__)
+
+class StateStore(object):
+    """ Key/value backend for bot state. Values are bytes, keys are strings grouped in namespaces.
+        A redis backed store only has to implement these three calls, e.g. with one hash per namespace.
+    """
+    def load(self, namespace):
+        """ Return all items of a namespace as a dict of key -> value
+        """
+        raise NotImplementedError
+
+    def save(self, items):
+        """ Write a batch of {(namespace, key): value} in one go, a value of None deletes the key
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SQLiteStore(StateStore):
+    """ StateStore in a single sqlite file, usable by several processes at once
+    """
+    def __init__(self, path='ombibot.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db   = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state (namespace TEXT, key TEXT, value BLOB, PRIMARY KEY (namespace, key))')
+
+    def load(self, namespace):
+        with self.lock:
+            rows = self.db.execute('SELECT key, value FROM state WHERE namespace = ?', (namespace,)).fetchall()
+        return dict(rows)
+
+    def save(self, items):
+        upserts = [(namespace, key, value) for (namespace, key), value in items.items() if value is not None]
+        deletes = [(namespace, key) for (namespace, key), value in items.items() if value is None]
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.executemany('INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)', upserts)
+                self.db.executemany('DELETE FROM state WHERE namespace = ? AND key = ?', deletes)
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class BotPersistence(BasePersistence):
+    """ Persistence for the Dispatcher and ConversationHandler on top of a StateStore.
+
+        Updates only mark a key as dirty, a background thread writes all dirty keys every
+        flushInterval seconds in one batch, so many updates of one user cost one write.
+        With owns(userId) a worker only loads the users it serves.
+    """
+    def __init__(self, store, flushInterval=1.0, owns=None, store_user_data=True, store_chat_data=False, store_bot_data=False):
+        super(BotPersistence, self).__init__(store_user_data=store_user_data, store_chat_data=store_chat_data,
+                                             store_bot_data=store_bot_data)
+        self.store         = store
+        self.flushInterval = flushInterval
+        self.owns          = owns or (lambda userId: True)
+        # (namespace, key) -> current object, pickled when flushed
+        self.dirty         = {}
+        self.writes        = 0
+        self.lock          = threading.Lock()
+        self.stopped       = threading.Event()
+        self.thread        = threading.Thread(target=self._run, name='persistence', daemon=True)
+        self.thread.start()
+
+    def _load(self, namespace):
+        output = {}
+        for key, value in self.store.load(namespace).items():
+            try:
+                output[key] = pickle.loads(value)
+            except Exception as e:
+                log.error("Unable to load %s %s: %s", namespace,key,e)
+        return output
+
+    def get_user_data(self):
+        data = defaultdict(dict)
+        data.update({int(userId): value for userId, value in self._load('user_data').items() if self.owns(int(userId))})
+        log.info("Loaded user data of %s users", len(data))
+        return data
+
+    def get_chat_data(self):
+        data = defaultdict(dict)
+        data.update({int(chatId): value for chatId, value in self._load('chat_data').items()})
+        return data
+
+    def get_bot_data(self):
+        return self._load('bot_data').get('bot_data', {})
+
+    def get_conversations(self, name):
+        # conversation keys are tuples like (chat_id, user_id), stored as json lists
+        conversations = {}
+        for key, state in self._load('conversations:' + name).items():
+            key = tuple(json.loads(key))
+            if self.owns(key[-1]):
+                conversations[key] = state
+        log.info("Loaded %s open conversations of %s", len(conversations),name)
+        return conversations
+
+    def update_conversation(self, name, key, new_state):
+        if isinstance(new_state, tuple) and len(new_state) == 2 and isinstance(new_state[1], Promise):
+            # a handler is still running, keep the state it started from
+            new_state = new_state[0]
+        self._mark('conversations:' + name, json.dumps(list(key)), new_state)
+
+    def update_user_data(self, user_id, data):
+        self._mark('user_data', str(user_id), data)
+
+    def drop_user_data(self, user_id):
+        """ Delete the stored data of a user that expired
+        """
+        self._mark('user_data', str(user_id), None)
+
+    def update_chat_data(self, chat_id, data):
+        self._mark('chat_data', str(chat_id), data)
+
+    def update_bot_data(self, data):
+        self._mark('bot_data', 'bot_data', data)
+
+    def _mark(self, namespace, key, value):
+        with self.lock:
+            self.dirty[(namespace, key)] = value
+
+    def flush(self):
+        """ Write all dirty keys in one batch
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return
+        items = {}
+        for item, value in dirty.items():
+            try:
+                items[item] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL) if value is not None else None
+            except Exception as e:
+                # e.g. changed by a handler while pickling, try again with the next flush
+                log.debug("Unable to pickle %s: %s", item,e)
+                with self.lock:
+                    self.dirty.setdefault(item, value)
+        try:
+            self.store.save(items)
+            self.writes += 1
+        except Exception as e:
+            log.error("Unable to save %s items: %s", len(items),e)
+            with self.lock:
+                for item, value in dirty.items():
+                    self.dirty.setdefault(item, value)
+            return
+        log.debug("Saved %s items", len(items))
+
+    def _run(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+        self.store.close()
@@ -0,0 +1,61 @@
+"""prefetch.py: fetch movie details in the background while the user is choosing."""
+
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+log = logging.getLogger(__name__)
+
+class Prefetcher(object):
+    """ Runs fetch(movieID) for the first few ids of a result list on a small
+        thread pool. fetch is expected to fill a cache (OmbiServer.get_movie_info
+        with a ResponseCache), the results themselves are thrown away.
+    """
+    def __init__(self, fetch, top=3, concurrency=2):
+        self.fetch    = fetch
+        self.top      = top
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='prefetch')
+        # owner (telegram user id) -> futures still queued or running
+        self.pending  = {}
+        self.fetched  = 0
+        self.cancelled = 0
+        self.lock     = threading.Lock()
+
+        log.info("Prefetching info for top %s results with %s threads", top,concurrency)
+
+    def prefetch(self, owner, ids):
+        """ Start fetching the first ids for owner, replacing an earlier prefetch of the same owner
+        """
+        self.cancel(owner)
+        futures = [self.executor.submit(self._run, movieID) for movieID in list(ids)[:self.top]]
+        with self.lock:
+            self.pending[owner] = futures
+        for future in futures:
+            future.add_done_callback(lambda future: self._done(owner, futures))
+
+    def cancel(self, owner):
+        """ Drop the queued fetches of owner, e.g. when the conversation moved on
+        """
+        with self.lock:
+            futures = self.pending.pop(owner, [])
+        cancelled = sum(1 for future in futures if future.cancel())
+        if cancelled:
+            with self.lock:
+                self.cancelled += cancelled
+            log.debug("Cancelled %s prefetches for %s", cancelled,owner)
+
+    def _run(self, movieID):
+        try:
+            self.fetch(movieID)
+            with self.lock:
+                self.fetched += 1
+        except Exception as e:
+            log.debug("Prefetch of %s failed: %s", movieID,e)
+
+    def _done(self, owner, futures):
+        if all(future.done() for future in futures):
+            with self.lock:
+                if self.pending.get(owner) is futures:
+                    del self.pending[owner]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,125 @@
+"""ratelimit.py: token buckets limiting how fast users and the bot as a whole may call ombi."""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+log = logging.getLogger(__name__)
+
+def retry_after(value, default):
+    """ Seconds to wait from a Retry-After header, given in seconds or as an http date
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return default
+
+class RateLimited(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class TokenBucket(object):
+    """ rate tokens per second, at most burst saved up
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate    = float(rate)
+        self.burst   = float(burst)
+        self.tokens  = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """ Take a token if there is one and return 0, else return the seconds until there is one
+        """
+        # now may be a little older than updated for a bucket created after now was read
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else float('inf')
+
+    def give(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+class RateLimiter(object):
+    """ Admission control in front of ombi: a bucket per telegram user and one for everybody.
+        A user over budget is turned away at once. When only the global budget is used up the
+        call waits up to maxWait seconds for a token and is turned away after that.
+    """
+    def __init__(self, userRate=0.5, userBurst=5, globalRate=10, globalBurst=20, maxWait=2.0, maxUsers=10000):
+        self.userRate       = userRate
+        self.userBurst      = userBurst
+        self.maxWait        = maxWait
+        self.maxUsers       = maxUsers
+        # telegram user id -> TokenBucket, least recently seen first
+        self.users          = OrderedDict()
+        self.bucket         = TokenBucket(globalRate, globalBurst)
+        self.admitted       = 0
+        self.delayed        = 0
+        self.rejectedUser   = 0
+        self.rejectedGlobal = 0
+        self.lock           = threading.Lock()
+
+        log.info("Rate limit: %s/s per user (burst %s), %s/s in total (burst %s)", userRate,userBurst,globalRate,globalBurst)
+
+    def admit(self, userId):
+        """ Return True when userId may go ahead, possibly after a short wait
+        """
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.users.get(userId)
+            if bucket is None:
+                bucket = self.users[userId] = TokenBucket(self.userRate, self.userBurst)
+                if len(self.users) > self.maxUsers:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(userId)
+
+            if bucket.take(now):
+                self.rejectedUser += 1
+                return False
+
+            wait = self.bucket.take(now)
+            if wait > self.maxWait:
+                # the user's token is not spent on a call that does not happen
+                bucket.give()
+                self.rejectedGlobal += 1
+                return False
+            if wait:
+                # claim the token now, it is there once the wait is over
+                self.bucket.tokens -= 1
+                self.delayed += 1
+            self.admitted += 1
+
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def wait_global(self):
+        """ Take a token of the global budget for work admitted as a whole, e.g. the calls of a bulk
+            request, waiting for it as long as needed
+        """
+        with self.lock:
+            wait = self.bucket.take(time.monotonic())
+            if wait:
+                self.bucket.tokens -= 1
+                self.delayed += 1
+            self.admitted += 1
+        if wait:
+            time.sleep(wait)
+
+    def stats(self):
+        with self.lock:
+            return {'admitted': self.admitted, 'delayed': self.delayed, 'rejectedUser': self.rejectedUser,
+                    'rejectedGlobal': self.rejectedGlobal, 'users': len(self.users)}
@@ -0,0 +1,140 @@
+"""responsecache.py: bounded TTL + LRU cache for ombi responses."""
+
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+log = logging.getLogger(__name__)
+
+# seconds an entry stays fresh, per endpoint
+DEFAULT_TTL = {
+    'search'  : 600,
+    'actor'   : 3600,
+    'similar' : 86400,
+    'info'    : 3600,
+    'tv'      : 600,
+    'tvinfo'  : 3600,
+    'season'  : 3600
+}
+
+# endpoints whose entries hold movies, the others hold tv shows
+MOVIE_ENDPOINTS = ('search', 'actor', 'similar', 'info')
+
+def make_key(endpoint, term, languageCode='en'):
+    """ Build a cache key from an endpoint and its normalized argument
+    """
+    return (endpoint, ' '.join(str(term).lower().split()), languageCode)
+
+def sizeof(value):
+    """ Rough size in bytes of a cached response
+    """
+    return len(json.dumps(value, default=lambda record: record.to_dict() if hasattr(record, 'to_dict') else str(record)))
+
+class ResponseCache(object):
+    """ LRU cache of parsed ombi responses with a time to live per endpoint. Cached values are
+        shared by every caller that gets them and must not be changed: update_movie replaces an
+        entry with an updated copy, and results are flagged on copies (see AvailabilityIndex.apply)
+    """
+    def __init__(self, maxEntries=1000, maxBytes=10*1024*1024, ttl=None):
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.ttl        = dict(DEFAULT_TTL, **(ttl or {}))
+        # key -> (expires, size, value), least recently used first
+        self.entries    = OrderedDict()
+        self.bytes      = 0
+        self.hits       = 0
+        self.misses     = 0
+        self.staleHits  = 0
+        self.evictions  = 0
+        self.lock       = threading.Lock()
+
+        log.info("Response cache: %s entries, %s bytes max", maxEntries,maxBytes)
+
+    def get(self, key, stale=False):
+        """ Return the cached value for key, or None if missing or expired. With stale an expired
+            value is returned as well, as a fallback when ombi can not be reached. The value is
+            shared, read only
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if not stale:
+                    self.misses += 1
+                return None
+            expires, size, value = entry
+            if stale:
+                self.staleHits += 1
+                return value
+            if expires < time.monotonic():
+                # kept until evicted, for stale reads
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Store value under key, evicting least recently used entries as needed
+        """
+        size = sizeof(value)
+        if size > self.maxBytes:
+            log.debug("Not caching %s: %s bytes is above the cache size", key,size)
+            return
+        expires = time.monotonic() + self.ttl.get(key[0], 0)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (expires, size, value)
+            self.bytes += size
+            while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        expires, size, value = self.entries.pop(key)
+        self.bytes -= size
+
+    def update_movie(self, movieID, **flags):
+        """ Update fields of a movie in every cached response it appears in. The entries are
+            replaced by updated copies, callers holding the old values do not see them change
+        """
+        movieID = int(movieID)
+        updated = 0
+        with self.lock:
+            for key, (expires, size, value) in self.entries.items():
+                if key[0] not in MOVIE_ENDPOINTS:
+                    continue
+                # info entries hold one MovieInfo, searches a MovieList keyed by id
+                movie = value if key[0] == 'info' else value.get(movieID)
+                if movie is None or movie.id != movieID:
+                    continue
+                if key[0] == 'info':
+                    value = movie.replace(**flags)
+                else:
+                    value = type(value)(value)
+                    value[movieID] = movie.replace(**flags)
+                # same keys, the order of the entries is not changed while iterating
+                self.entries[key] = (expires, size, value)
+                updated += 1
+        log.debug("Updated %s cached rows for movie %s", updated,movieID)
+        return updated
+
+    def discard(self, match):
+        """ Remove every entry whose key matches, e.g. all cached about one show after requesting it
+        """
+        with self.lock:
+            keys = [key for key in self.entries if match(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'misses': self.misses, 'staleHits': self.staleHits, 'evictions': self.evictions}
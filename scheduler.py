@@ -0,0 +1,97 @@
+"""scheduler.py: thread pool for handlers that wait on ombi, fair between users, so the dispatcher stays free for menus."""
+
+import time
+import threading
+import logging
+from collections import OrderedDict, deque
+from telegram.utils.promise import Promise
+import metrics
+log = logging.getLogger(__name__)
+
+POOL_WAIT = metrics.Histogram('ombibot_pool_wait_seconds', 'Time handlers waited in a pool queue before running', ['pool'])
+
+class FairPool(object):
+    """ Runs tasks on a fixed number of threads. Every owner (telegram user) has its own queue,
+        owners take turns, and an owner only ever has one task running, so a user firing many
+        updates can not starve the others and the updates of one user run in order.
+
+        submit returns a telegram Promise. A ConversationHandler callback can return it like a
+        run_async handler, the conversation moves on to its result once it is done.
+    """
+    def __init__(self, name='io', workers=8, dispatcher=None):
+        self.name       = name
+        self.dispatcher = dispatcher
+        # owner -> deque of (promise, update, queued at), in turn order
+        self.queues     = OrderedDict()
+        self.running    = set()
+        self.depth      = 0
+        self.busy       = 0
+        self.completed  = 0
+        self.stopped    = False
+        self.cond       = threading.Condition()
+        self.threads    = [threading.Thread(target=self._run, name='{}-{}'.format(name, i), daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+        log.info("Pool %s: %s threads", name,workers)
+
+    def submit(self, owner, func, *args, update=None, **kwargs):
+        """ Queue func(*args, **kwargs) behind the earlier tasks of owner and return its Promise
+        """
+        promise = Promise(func, args, kwargs)
+        with self.cond:
+            self.queues.setdefault(owner, deque()).append((promise, update, time.monotonic()))
+            self.depth += 1
+            self.cond.notify()
+        return promise
+
+    def pending(self, owner):
+        """ Number of tasks of owner queued or running
+        """
+        with self.cond:
+            return len(self.queues.get(owner, ())) + (1 if owner in self.running else 0)
+
+    def _next(self):
+        # first owner in turn that has nothing running, moved to the back of the line
+        for owner, tasks in self.queues.items():
+            if owner not in self.running:
+                task = tasks.popleft()
+                if tasks:
+                    self.queues.move_to_end(owner)
+                else:
+                    del self.queues[owner]
+                self.running.add(owner)
+                self.depth -= 1
+                self.busy += 1
+                return owner, task
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                item = self._next()
+                while item is None and not self.stopped:
+                    self.cond.wait()
+                    item = self._next()
+                if item is None:
+                    return
+            owner, (promise, update, queued) = item
+            POOL_WAIT.observe(time.monotonic() - queued, self.name)
+            promise.run()
+            with self.cond:
+                self.running.discard(owner)
+                self.busy -= 1
+                self.completed += 1
+                # the next task of this owner may run now
+                self.cond.notify_all()
+            if promise.exception is not None and self.dispatcher is not None:
+                self.dispatcher.dispatch_error(update, promise.exception)
+
+    def stats(self):
+        with self.cond:
+            return {'queued': self.depth, 'busy': self.busy, 'users': len(self.queues), 'completed': self.completed}
+
+    def shutdown(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
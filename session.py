@@ -0,0 +1,84 @@
+"""session.py: compact per-user record of the last search, the keyboard is rebuilt from it when needed."""
+
+import sys
+from array import array
+import logging
+from models import button_text
+log = logging.getLogger(__name__)
+
+# bits in SearchSession.flags
+AVAILABLE   = 1
+REQUESTED   = 2
+
+class SearchSession(object):
+    """ Result list of a search: ids in an array, interned titles and years, and one byte of
+        availability flags per movie. Replaces keeping the InlineKeyboardButtons themselves.
+    """
+    __slots__ = ('mode', 'ids', 'titles', 'years', 'flags', 'page')
+
+    def __init__(self, mode, movies):
+        self.mode   = mode
+        self.ids    = array('l')
+        titles      = []
+        years       = []
+        flags       = bytearray()
+        for movie in movies.values():
+            self.ids.append(int(movie.id))
+            titles.append(sys.intern(movie.title or ''))
+            years.append(sys.intern(movie.year))
+            flags.append((AVAILABLE if movie.available else 0) | (REQUESTED if movie.requested else 0))
+        self.titles = tuple(titles)
+        self.years  = tuple(years)
+        self.flags  = bytes(flags)
+        # page currently shown, the cursor for paginated keyboards
+        self.page   = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def label(self, i, maxLength=60):
+        """ Button text of the i-th movie, with the available/requested marker
+        """
+        return button_text(self.titles[i], self.years[i], self.flags[i] & AVAILABLE, self.flags[i] & REQUESTED, maxLength)
+
+    def rows(self, start=0, stop=None):
+        """ (label, id) of the movies from start to stop, in result order
+        """
+        return [(self.label(i), self.ids[i]) for i in range(len(self.ids))[start:stop]]
+
+    def pages(self, pageSize):
+        return max(1, (len(self.ids) + pageSize - 1) // pageSize)
+
+    def page_rows(self, pageSize):
+        """ (label, id) of the movies on the current page, only these are formatted
+        """
+        self.page = min(max(self.page, 0), self.pages(pageSize) - 1)
+        return self.rows(self.page * pageSize, (self.page + 1) * pageSize)
+
+    def sizeof(self):
+        """ Bytes held by this session; interned strings shared with other sessions are counted too
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.ids) + sys.getsizeof(self.titles) + sys.getsizeof(self.years)
+                + sys.getsizeof(self.flags) + sum(sys.getsizeof(s) for s in self.titles)
+                + sum(sys.getsizeof(s) for s in set(self.years)))
+
+    def __getstate__(self):
+        return (self.mode, self.ids, self.titles, self.years, self.flags, self.page)
+
+    def __setstate__(self, state):
+        self.mode, self.ids, titles, years, self.flags, self.page = state
+        self.titles = tuple(sys.intern(s) for s in titles)
+        self.years  = tuple(sys.intern(s) for s in years)
+
+def memory_report(user_data, key='last_search'):
+    """ Return (number of sessions, total bytes, bytes per session) over all users
+    """
+    sessions = [data.get(key) for data in list(user_data.values()) if data.get(key) is not None]
+    total = sum(session.sizeof() for session in sessions)
+    return len(sessions), total, total // len(sessions) if sessions else 0
+
+def user_data_size(data):
+    """ Approximate bytes held by the user data of one user
+    """
+    return sys.getsizeof(data) + sum(value.sizeof() if hasattr(value, 'sizeof') else sys.getsizeof(value)
+                                     for value in list(data.values()))
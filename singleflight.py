@@ -0,0 +1,74 @@
+"""singleflight.py: coalesce identical concurrent calls into one."""
+
+import asyncio
+import threading
+import logging
+from deadline import DeadlineExceeded
+import deadline
+log = logging.getLogger(__name__)
+
+class _Call(object):
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+class SingleFlight(object):
+    """ Threaded callers asking for the same key while a call is running
+        wait for it and share its result instead of starting their own.
+        A waiting caller gives up when its own latency budget runs out
+    """
+    def __init__(self):
+        self.calls     = {}
+        self.coalesced = 0
+        self.lock      = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            log.debug("Waiting for running call %s", key)
+            if not call.done.wait(deadline.timeout(None)):
+                raise DeadlineExceeded('Out of time waiting for {}'.format(key))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+class AsyncSingleFlight(object):
+    """ Same as SingleFlight for coroutines running on one event loop. Each caller waits as long
+        as its budget allows and gets asyncio.TimeoutError after that, the shared call goes on
+    """
+    def __init__(self):
+        self.calls     = {}
+        self.coalesced = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda task: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            log.debug("Waiting for running call %s", key)
+        # shield the shared task, one caller being cancelled must not cancel it for the others
+        left = deadline.remaining()
+        if left is None:
+            return await asyncio.shield(task)
+        return await asyncio.wait_for(asyncio.shield(task), max(0, left))
@@ -0,0 +1,105 @@
+"""streamjson.py: incremental parsing of the json arrays returned by ombi searches."""
+
+import json
+import codecs
+import logging
+from models import MovieResult, MovieList
+from logutil import Sampler
+log = logging.getLogger(__name__)
+
+# one in every sampleEvery parsed elements is logged at debug level
+rowSample = Sampler()
+
+class ArrayParser(object):
+    """ Parses a json array of objects fed in chunks of bytes. Each element is decoded as soon
+        as it is complete and turned into a record by factory, so only the current chunk and one
+        element are held at a time instead of the whole body and the full list.
+    """
+    def __init__(self, factory=MovieResult.from_json, encoding='utf-8'):
+        self.factory = factory
+        self.sample  = rowSample
+        self.decoder = json.JSONDecoder()
+        self.text    = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.buffer  = ''
+        self.started = False
+        self.done    = False
+
+    def _skip(self, pos):
+        # skip whitespace from pos, return the position of the next character
+        while pos < len(self.buffer) and self.buffer[pos] in ' \t\r\n':
+            pos += 1
+        return pos
+
+    def feed(self, chunk, final=False):
+        """ Add a chunk of the body and return the elements completed by it
+        """
+        self.buffer += self.text.decode(chunk, final)
+        output = []
+        pos = self._skip(0)
+        if not self.started:
+            if pos == len(self.buffer):
+                self.buffer = ''
+                return output
+            if self.buffer[pos] != '[':
+                raise ValueError("Expected a json array, got {!r}".format(self.buffer[pos:pos + 40]))
+            self.started = True
+            pos = self._skip(pos + 1)
+
+        while not self.done and pos < len(self.buffer):
+            if self.buffer[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            if self.buffer[pos] == ',':
+                pos = self._skip(pos + 1)
+                continue
+            try:
+                element, end = self.decoder.raw_decode(self.buffer, pos)
+            except ValueError:
+                if final:
+                    raise
+                # element not complete yet, wait for the next chunk
+                break
+            if end == len(self.buffer) and not final:
+                # a number at the end of the buffer may still continue
+                break
+            if self.sample.enabled(log):
+                log.debug("Parsed element %s", element)
+            output.append(self.factory(element))
+            pos = self._skip(end)
+
+        self.buffer = self.buffer[pos:]
+        if final and not self.done:
+            raise ValueError("Truncated json array")
+        return output
+
+def parse_movies_stream(chunks, maxResults=None):
+    """ Parse a search response from an iterable of byte chunks, stop reading once maxResults
+        movies have been found
+    """
+    parser = ArrayParser()
+    output = MovieList()
+    for chunk in chunks:
+        for movie in parser.feed(chunk):
+            output.add(movie)
+            if maxResults and len(output) >= maxResults:
+                log.debug("Stopped parsing after %s results", len(output))
+                return output
+    for movie in parser.feed(b'', final=True):
+        output.add(movie)
+    return output
+
+async def parse_movies_astream(chunks, maxResults=None):
+    """ Same as parse_movies_stream for an async iterable of byte chunks
+    """
+    parser = ArrayParser()
+    output = MovieList()
+    async for chunk in chunks:
+        for movie in parser.feed(chunk):
+            output.add(movie)
+            if maxResults and len(output) >= maxResults:
+                log.debug("Stopped parsing after %s results", len(output))
+                return output
+    for movie in parser.feed(b'', final=True):
+        output.add(movie)
+    return output
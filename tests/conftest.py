@@ -0,0 +1,6 @@
+"""conftest.py: the modules of the bot are at the top of the repository, next to this directory."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,28 @@
+"""test_availability.py: synced and marked flags of AvailabilityIndex, applied to copies of the records."""
+
+from availability import AvailabilityIndex
+from models import MovieResult
+
+def test_marks_last_until_the_next_sync():
+    availability = AvailabilityIndex()
+    availability.replace([MovieResult(1, 'A', available=True), MovieResult(2, 'B', requested=True)])
+    availability.mark(3, requested=True)
+    assert availability.status(1) == (True, False)
+    assert availability.status('3') == (False, True)
+    assert len(availability) == 3
+    availability.replace([])
+    assert availability.status(3) == (False, False)
+
+def test_apply_copies_the_records_it_flags():
+    availability = AvailabilityIndex()
+    availability.mark(1, available=True)
+    records = [MovieResult(1, 'A'), MovieResult(2, 'B')]
+    flagged = availability.apply(records)
+    assert flagged[0].available and flagged[0] is not records[0]
+    assert not records[0].available
+    assert flagged[1] is records[1]
+
+def test_apply_only_adds_flags():
+    availability = AvailabilityIndex()
+    record = MovieResult(1, 'A', requested=True)
+    assert availability.apply([record])[0] is record
@@ -0,0 +1,52 @@
+"""test_callbacks.py: callback_data encoding and the CallbackRouter."""
+
+import pytest
+from unittest.mock import MagicMock
+from telegram import Update
+from callbacks import encode, decode, base36, CallbackRouter, ARITY, MAX_LENGTH, MOVIE, SEASON, INFO, BACK
+
+def test_example_from_the_docstring():
+    assert encode(SEASON, 81189, 2) == 'z1qn9.2'
+
+@pytest.mark.parametrize('number', [0, 1, 35, 36, 81189, 2 ** 40, -7])
+def test_base36_round_trip(number):
+    assert int(base36(number), 36) == number
+
+@pytest.mark.parametrize('action', sorted(ARITY))
+def test_every_action_round_trips(action):
+    args = tuple(range(10 ** 6, 10 ** 6 + ARITY[action]))
+    assert decode(encode(action, *args)) == (action, args)
+
+def test_wrong_number_of_arguments():
+    with pytest.raises(ValueError):
+        encode(INFO)
+    with pytest.raises(ValueError):
+        decode(BACK + '1')
+
+@pytest.mark.parametrize('data', ['', None, '1', '42', 'x', 'iz!'])
+def test_foreign_data_is_refused(data):
+    with pytest.raises(ValueError):
+        decode(data)
+
+def test_data_fits_a_button():
+    assert len(encode(SEASON, 2 ** 63, 2 ** 63)) <= MAX_LENGTH
+
+def callback(data):
+    update = MagicMock(spec=Update)
+    update.callback_query = MagicMock(data=data)
+    return update
+
+def test_router_passes_the_arguments():
+    info = MagicMock(return_value=3)
+    router = CallbackRouter({INFO: info, BACK: MagicMock()})
+    update = callback(encode(INFO, 603))
+    check = router.check_update(update)
+    context = MagicMock()
+    assert router.handle_update(update, None, check, context) == 3
+    assert context.args == [603]
+    info.assert_called_once_with(update, context)
+
+def test_router_ignores_other_actions_and_data():
+    router = CallbackRouter({BACK: MagicMock()})
+    assert router.check_update(callback(encode(MOVIE))) is None
+    assert router.check_update(callback('12')) is None
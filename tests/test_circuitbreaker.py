@@ -0,0 +1,79 @@
+"""test_circuitbreaker.py: closed, open and half-open states of CircuitBreaker."""
+
+import pytest
+import circuitbreaker
+from circuitbreaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuitbreaker.time, 'monotonic', clock)
+    return clock
+
+def test_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker(failureThreshold=3, resetTimeout=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.failure()
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats() == {'state': OPEN, 'failures': 3, 'opened': 1, 'rejected': 1}
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failureThreshold=2)
+    breaker.failure()
+    breaker.success(0.1)
+    breaker.failure()
+    assert breaker.state == CLOSED
+
+def test_slow_call_counts_as_failure(clock):
+    breaker = CircuitBreaker(failureThreshold=1, slowCall=5)
+    breaker.success(6)
+    assert breaker.state == OPEN
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+    breaker.failure()
+    clock.now += 30
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # a second caller while the probe is running is turned away
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.success(0.1)
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+def test_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+    breaker.failure()
+    clock.now += 30
+    breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    clock.now += 1
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+def test_lost_probe_is_replaced_after_reset_timeout(clock):
+    breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+    breaker.failure()
+    clock.now += 30
+    breaker.allow()
+    clock.now += 30
+    # the first probe never reported back
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
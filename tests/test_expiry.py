@@ -0,0 +1,86 @@
+"""test_expiry.py: Sweeper deadlines and the per-state idle times of ExpiringConversationHandler."""
+
+import pytest
+import expiry
+from telegram.ext import MessageHandler, Filters
+from expiry import Sweeper, ExpiringConversationHandler
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(expiry.time, 'monotonic', clock)
+    return clock
+
+def test_sweep_returns_expired_keys_only(clock):
+    sweeper = Sweeper(ttl=10)
+    sweeper.touch('a')
+    sweeper.touch('b', ttl=30)
+    assert sweeper.sweep(clock.now + 9) == []
+    assert sweeper.sweep(clock.now + 10) == ['a']
+    assert 'a' not in sweeper and 'b' in sweeper
+    assert sweeper.sweep(clock.now + 30) == ['b']
+    assert len(sweeper) == 0 and sweeper.expired == 2
+
+def test_touch_replaces_the_earlier_deadline(clock):
+    sweeper = Sweeper(ttl=10)
+    sweeper.touch('a')
+    clock.now += 8
+    sweeper.touch('a')
+    # the outdated heap entry is skipped
+    assert sweeper.sweep(clock.now + 5) == []
+    assert sweeper.sweep(clock.now + 10) == ['a']
+
+def test_discard_and_on_expire(clock):
+    freed = []
+    sweeper = Sweeper(ttl=10, onExpire=lambda key: freed.append(key) or 100)
+    sweeper.touch('a')
+    sweeper.touch('b')
+    sweeper.discard('b')
+    assert sweeper.sweep(clock.now + 10) == ['a']
+    assert freed == ['a'] and sweeper.reclaimed == 100
+
+def test_heap_is_compacted(clock):
+    sweeper = Sweeper(ttl=10)
+    for _ in range(3000):
+        sweeper.touch('a')
+    assert len(sweeper.heap) <= 2 * len(sweeper) + 1024 + 1
+    assert sweeper.sweep(clock.now + 10) == ['a']
+
+FIRST, TYPING = range(2)
+
+def conversation(sweeper):
+    return ExpiringConversationHandler(entry_points=[MessageHandler(Filters.all, lambda update, context: FIRST)],
+                                       states={FIRST: [], TYPING: []}, fallbacks=[],
+                                       sweeper=sweeper, stateTtl={TYPING: 60})
+
+def test_state_change_touches_with_the_state_ttl(clock):
+    sweeper = Sweeper(ttl=1000)
+    handler = conversation(sweeper)
+    handler.update_state(TYPING, (5, 5))
+    assert sweeper.deadlines[5] == clock.now + 60
+    handler.update_state(FIRST, (5, 5))
+    assert sweeper.deadlines[5] == clock.now + 1000
+
+def test_touch_keeps_the_ttl_of_the_current_state(clock):
+    sweeper = Sweeper(ttl=1000)
+    handler = conversation(sweeper)
+    handler.update_state(TYPING, (5, 5))
+    clock.now += 30
+    handler.touch(5)
+    assert sweeper.deadlines[5] == clock.now + 60
+    # a user without a conversation gets the default
+    handler.touch(6)
+    assert sweeper.deadlines[6] == clock.now + 1000
+
+def test_end_user_ends_its_conversations(clock):
+    sweeper = Sweeper(ttl=1000)
+    handler = conversation(sweeper)
+    handler.update_state(TYPING, (5, 5))
+    assert handler.end_user(5)
+    assert (5, 5) not in handler.conversations and 5 not in handler.userKeys
@@ -0,0 +1,81 @@
+"""test_ratelimit.py: TokenBucket refill, RateLimiter admission and Retry-After parsing."""
+
+import time
+import pytest
+import ratelimit
+from ratelimit import TokenBucket, RateLimiter, retry_after
+
+def test_bucket_starts_full_and_refills():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    # empty: half a second until the next token at 2 per second
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0
+
+def test_bucket_saves_up_to_burst():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = bucket.updated + 3600
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == 0
+    assert bucket.take(now) > 0
+
+def test_bucket_without_rate_never_refills():
+    bucket = TokenBucket(rate=0, burst=1)
+    now = bucket.updated
+    assert bucket.take(now) == 0
+    assert bucket.take(now + 3600) == float('inf')
+
+def test_give_returns_a_token():
+    bucket = TokenBucket(rate=0, burst=1)
+    bucket.take(bucket.updated)
+    bucket.give()
+    assert bucket.take(bucket.updated) == 0
+
+def test_user_over_budget_is_rejected():
+    limiter = RateLimiter(userRate=0.001, userBurst=2, globalRate=100, globalBurst=100)
+    assert [limiter.admit(1) for _ in range(3)] == [True, True, False]
+    # other users have their own budget
+    assert limiter.admit(2)
+    assert limiter.stats()['rejectedUser'] == 1
+
+def test_global_budget_rejects_beyond_max_wait_and_keeps_user_token():
+    limiter = RateLimiter(userRate=0.001, userBurst=1, globalRate=0.001, globalBurst=1, maxWait=0.1)
+    assert limiter.admit(1)
+    assert not limiter.admit(2)
+    assert limiter.stats()['rejectedGlobal'] == 1
+    # the token of user 2 was given back
+    assert limiter.users[2].tokens == 1
+
+def test_global_budget_waits_within_max_wait(monkeypatch):
+    waits = []
+    monkeypatch.setattr(ratelimit.time, 'sleep', waits.append)
+    limiter = RateLimiter(userRate=100, userBurst=100, globalRate=10, globalBurst=1, maxWait=1)
+    assert limiter.admit(1)
+    assert limiter.admit(1)
+    assert waits and 0 < waits[0] <= 0.1
+    assert limiter.stats()['delayed'] == 1
+
+def test_wait_global_always_takes_a_token(monkeypatch):
+    waits = []
+    monkeypatch.setattr(ratelimit.time, 'sleep', waits.append)
+    limiter = RateLimiter(globalRate=10, globalBurst=1)
+    limiter.wait_global()
+    limiter.wait_global()
+    limiter.wait_global()
+    assert len(waits) == 2
+    assert limiter.stats()['admitted'] == 3
+
+def test_least_recent_users_are_dropped():
+    limiter = RateLimiter(maxUsers=2)
+    for userId in (1, 2, 1, 3):
+        limiter.admit(userId)
+    assert list(limiter.users) == [1, 3]
+
+@pytest.mark.parametrize('value, expected', [(None, 5), ('', 5), ('3', 3), ('-1', 0), ('soon', 5)])
+def test_retry_after(value, expected):
+    assert retry_after(value, 5) == expected
+
+def test_retry_after_http_date():
+    value = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))
+    assert 55 < retry_after(value, 5) <= 60
@@ -0,0 +1,63 @@
+"""test_responsecache.py: expiry, eviction and copy-on-update of ResponseCache."""
+
+import pytest
+import responsecache
+from responsecache import ResponseCache, make_key
+from models import MovieList, MovieResult, MovieInfo
+
+def movies(*ids):
+    output = MovieList()
+    for movieID in ids:
+        output.add(MovieResult(movieID, 'Movie {}'.format(movieID)))
+    return output
+
+def test_make_key_normalizes_the_term():
+    assert make_key('search', '  The   MATRIX ') == ('search', 'the matrix', 'en')
+
+def test_expired_entries_are_kept_for_stale_reads(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(responsecache.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(ttl={'search': 10})
+    key = make_key('search', 'alien')
+    cache.set(key, movies(1))
+    assert cache.get(key) is not None
+    now[0] += 11
+    assert cache.get(key) is None
+    assert list(cache.get(key, stale=True)) == [1]
+    assert cache.stats()['staleHits'] == 1
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(maxEntries=2)
+    for term in ('a', 'b'):
+        cache.set(make_key('search', term), movies(1))
+    cache.get(make_key('search', 'a'))
+    cache.set(make_key('search', 'c'), movies(1))
+    assert cache.get(make_key('search', 'b')) is None
+    assert cache.get(make_key('search', 'a')) is not None
+    assert cache.evictions == 1
+
+def test_byte_limit():
+    cache = ResponseCache(maxBytes=200)
+    cache.set(make_key('search', 'big'), movies(*range(100)))
+    assert cache.get(make_key('search', 'big')) is None
+    cache.set(make_key('search', 'small'), movies(1))
+    assert cache.bytes <= 200
+
+def test_update_movie_replaces_entries():
+    cache = ResponseCache()
+    search, info = make_key('search', 'a'), make_key('info', 1)
+    cache.set(search, movies(1, 2))
+    cache.set(info, MovieInfo(1, 'Movie 1'))
+    held = cache.get(search)
+    assert cache.update_movie(1, requested=True) == 2
+    # callers holding the old value do not see it change
+    assert not held[1].requested
+    assert cache.get(search)[1].requested and cache.get(info).requested
+    assert list(cache.get(search)) == [1, 2] and cache.get(search)[2] is held[2]
+
+def test_discard():
+    cache = ResponseCache()
+    cache.set(make_key('tv', 'show'), movies(1))
+    cache.set(make_key('search', 'a'), movies(1))
+    assert cache.discard(lambda key: key[0] == 'tv') == 1
+    assert cache.get(make_key('search', 'a')) is not None
@@ -0,0 +1,89 @@
+"""test_singleflight.py: shared calls in SingleFlight and AsyncSingleFlight, bounded by each caller's deadline."""
+
+import asyncio
+import threading
+import time
+import pytest
+import deadline
+from deadline import DeadlineExceeded
+from singleflight import SingleFlight, AsyncSingleFlight
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == ['result', 'result'] and calls == [1]
+    assert flight.calls == {}
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    with pytest.raises(KeyError):
+        flight.do('key', lambda: {}['missing'])
+    assert flight.calls == {}
+
+def test_follower_gives_up_at_its_own_deadline():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    def slow():
+        started.set()
+        release.wait()
+        return 'result'
+    leader = threading.Thread(target=flight.do, args=('key', slow))
+    leader.start()
+    started.wait()
+    with deadline.budget(0.05):
+        with pytest.raises(DeadlineExceeded):
+            flight.do('key', slow)
+    release.set()
+    leader.join()
+
+def test_async_followers_share_the_task_and_time_out_alone():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'result'
+        leader = asyncio.ensure_future(flight.do('key', slow))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.within(flight.do('key', slow), 0.01)
+        # the shared call was not cancelled with the follower
+        assert await leader == 'result'
+        assert calls == [1] and flight.coalesced == 1
+    asyncio.run(main())
+
+def test_budget_keeps_the_sooner_outer_deadline():
+    assert deadline.remaining() is None
+    with deadline.budget(1):
+        with deadline.budget(100):
+            assert deadline.remaining() <= 1
+        with deadline.budget(0):
+            assert deadline.remaining() <= 1
+    assert deadline.remaining() is None
+
+def test_timeout_raises_once_the_budget_is_used():
+    with deadline.budget(0.001):
+        time.sleep(0.002)
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout(5)
+        with pytest.raises(DeadlineExceeded):
+            deadline.check()
+    assert deadline.timeout(5) == 5
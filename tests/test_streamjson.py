@@ -0,0 +1,53 @@
+"""test_streamjson.py: the incremental json array parser against json.loads, for any split of the body."""
+
+import json
+import pytest
+from streamjson import ArrayParser, parse_movies_stream
+from ombiserver import parse_movies
+
+MOVIES = [{'id': 1, 'title': 'Alien', 'releaseDate': '1979-05-25T00:00:00', 'available': True},
+          {'id': 2, 'title': 'Amélie, "le fabuleux destin"', 'overview': '[not] {a} list, ]', 'requested': True},
+          {'id': 3, 'title': 'Crouching Tiger 臥虎藏龍', 'genreIds': [1, [2, {'x': ']'}]]}]
+
+BODY = json.dumps(MOVIES, indent=1, ensure_ascii=False).encode('utf-8')
+
+def chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+def as_tuples(movies):
+    return [movie.__getstate__() for movie in movies.values()]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, len(BODY)])
+def test_any_chunk_size_gives_the_same_records(size):
+    assert as_tuples(parse_movies_stream(chunks(BODY, size))) == as_tuples(parse_movies(MOVIES))
+
+def test_every_split_point():
+    expected = as_tuples(parse_movies(MOVIES))
+    for i in range(len(BODY)):
+        assert as_tuples(parse_movies_stream([BODY[:i], BODY[i:]])) == expected
+
+def test_max_results_stops_reading():
+    read = []
+    def body():
+        for chunk in chunks(BODY, 16):
+            read.append(chunk)
+            yield chunk
+    output = parse_movies_stream(body(), maxResults=1)
+    assert list(output) == [1]
+    assert sum(map(len, read)) < len(BODY)
+
+@pytest.mark.parametrize('body', [b'', b'  ', b'[]', b' [ ] '])
+def test_empty_bodies(body):
+    assert len(parse_movies_stream([body])) == 0
+
+def test_elements_come_out_as_they_complete():
+    parser = ArrayParser(factory=lambda data: data['id'])
+    assert parser.feed(b'[{"id": 1}, {"id"') == [1]
+    assert parser.feed(b': 2}') == []
+    assert parser.feed(b']') == [2]
+    assert parser.done
+
+@pytest.mark.parametrize('body', [b'{"id": 1}', b'[{"id": 1}, {"id": ', b'[{"id": 1}, {"id": 2}'])
+def test_malformed_bodies_raise(body):
+    with pytest.raises(ValueError):
+        parse_movies_stream([body])
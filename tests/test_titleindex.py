@@ -0,0 +1,40 @@
+"""test_titleindex.py: matching, ranking and the bounded search of common queries in TitleIndex."""
+
+from titleindex import TitleIndex, normalize, trigrams
+from models import MovieResult
+
+def index(*titles, **kwargs):
+    output = TitleIndex(**kwargs)
+    output.add(MovieResult(i, title) for i, title in enumerate(titles))
+    return output
+
+def titles(movies):
+    return [movie.title for movie in movies]
+
+def test_normalize_drops_accents_and_punctuation():
+    assert normalize('Amélie: Le Fabuleux-Destin!') == ['amelie', 'le', 'fabuleux', 'destin']
+
+def test_last_word_matches_as_a_prefix():
+    assert '  m' in trigrams(['ma'], complete=False)
+    assert 'ma ' not in trigrams(['ma'], complete=False)
+
+def test_typos_and_prefixes_match():
+    titleIndex = index('The Matrix', 'The Matrix Reloaded', 'Alien')
+    assert titles(titleIndex.search('matrx')) == ['The Matrix', 'The Matrix Reloaded']
+    assert titles(titleIndex.search('the ma')) == ['The Matrix', 'The Matrix Reloaded']
+    assert titleIndex.search('zzz') == []
+
+def test_title_changes_are_reindexed():
+    titleIndex = index('Alien')
+    assert titleIndex.add([MovieResult(0, 'Aliens')]) == 0
+    assert titles(titleIndex.search('aliens')) == ['Aliens']
+    assert titleIndex.titles == [('aliens', 0)]
+
+def test_max_movies():
+    titleIndex = index('A', 'B', 'C', maxMovies=2)
+    assert len(titleIndex) == 2
+
+def test_common_queries_prefer_titles_starting_with_them():
+    titleIndex = index(*(['The Thing {}'.format(i) for i in range(200)] + ['The', 'Star Wars']), maxCandidates=50)
+    assert titles(titleIndex.search('the', limit=3)) == ['The', 'The Thing 0', 'The Thing 1']
+    assert titles(titleIndex.search('star wa')) == ['Star Wars']
@@ -0,0 +1,155 @@
+"""titleindex.py: local index of movie titles for as-you-type suggestions."""
+
+import re
+import math
+import heapq
+import bisect
+import itertools
+import threading
+import unicodedata
+import logging
+from collections import defaultdict, Counter
+log = logging.getLogger(__name__)
+
+EMPTY = frozenset()
+
+def normalize(text):
+    """ Lower case words without accents and punctuation
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.sub(r'[^\w]+', ' ', text).split()
+
+def trigrams(words, complete=True):
+    """ Trigrams of each word padded with two spaces in front, so the first one or two letters of a
+        word are grams as well. The last word of a query that is still being typed is not padded at
+        the end, so it matches as a prefix.
+    """
+    grams = set()
+    for i, word in enumerate(words):
+        padded = '  ' + word + (' ' if complete or i < len(words) - 1 else '')
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+class TitleIndex(object):
+    """ Trigram index over the titles of every movie the bot has seen. A query matches a title
+        when at least minScore of the query's trigrams are in it, so small typos still match.
+        Queries whose trigrams are in too many titles to count them all, like "the", get the
+        titles starting with the query and a sample of the rarest trigram's titles instead.
+    """
+    def __init__(self, maxMovies=50000, minScore=0.6, maxCandidates=500):
+        self.maxMovies     = maxMovies
+        self.minScore      = minScore
+        self.maxCandidates = maxCandidates
+        # movie id -> MovieResult
+        self.movies        = {}
+        # movie id -> normalized title, to rank titles starting with the query first
+        self.keys          = {}
+        # (normalized title, movie id) in order, to find the titles starting with a query
+        self.titles        = []
+        # trigram -> ids of the movies with it in their title
+        self.grams         = defaultdict(set)
+        self.lock          = threading.Lock()
+        # one add at a time, it only takes lock for a batch of movies at a time so searches go on
+        self.addLock       = threading.Lock()
+
+    def add(self, movies, batchSize=100):
+        """ Add or refresh movies, returns the number of new ones
+        """
+        movies = [movie for movie in movies if movie.id is not None and movie.title]
+        added = 0
+        titles = []
+        with self.addLock:
+            for i in range(0, len(movies), batchSize):
+                with self.lock:
+                    for movie in movies[i:i + batchSize]:
+                        old = self.movies.get(movie.id)
+                        if old is None:
+                            if len(self.movies) >= self.maxMovies:
+                                continue
+                            added += 1
+                        elif old.title != movie.title:
+                            self._unindex(old)
+                        else:
+                            self.movies[movie.id] = movie
+                            continue
+                        words = normalize(movie.title)
+                        self.movies[movie.id] = movie
+                        self.keys[movie.id]   = ' '.join(words)
+                        titles.append((self.keys[movie.id], movie.id))
+                        for gram in trigrams(words):
+                            self.grams[gram].add(movie.id)
+            if len(titles) > 64:
+                # e.g. the library sync: merge once, without holding up searches while sorting
+                merged = sorted(self.titles + titles)
+                with self.lock:
+                    self.titles = merged
+            elif titles:
+                with self.lock:
+                    for title in titles:
+                        bisect.insort(self.titles, title)
+        if added:
+            log.debug("Added %s titles to the index, %s in total", added,len(self.movies))
+        return added
+
+    def _unindex(self, movie):
+        key = self.keys.get(movie.id)
+        i = bisect.bisect_left(self.titles, (key, movie.id))
+        if i < len(self.titles) and self.titles[i] == (key, movie.id):
+            del self.titles[i]
+        for gram in trigrams(normalize(movie.title)):
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(movie.id)
+                if not ids:
+                    del self.grams[gram]
+
+    def _starting(self, prefix, limit):
+        # ids of the first titles starting with prefix, shorter ones first as they sort first
+        i = bisect.bisect_left(self.titles, (prefix,))
+        return [movieID for key, movieID in self.titles[i:i + limit] if key.startswith(prefix)]
+
+    def search(self, query, limit=10):
+        """ Best matching movies for a partly typed title, best first
+        """
+        words = normalize(query)
+        grams = trigrams(words, complete=False)
+        if not grams:
+            return []
+        needed = max(1, int(math.ceil(self.minScore * len(grams))))
+        prefix = ' '.join(words)
+        with self.lock:
+            postings = sorted((self.grams.get(gram, EMPTY) for gram in grams), key=len)
+            # a title with at least needed of the grams has one of the len - needed + 1 rarest,
+            # so only those posting lists are counted, the others are only probed for candidates
+            counted = postings[:len(postings) - needed + 1]
+            starting = []
+            if sum(len(ids) for ids in counted) <= self.maxCandidates:
+                # copies, the index may change while they are counted below
+                candidates = [list(ids) for ids in counted]
+            else:
+                starting = self._starting(prefix, limit)
+                counted = postings[:1]
+                candidates = [list(itertools.islice(postings[0], 0 if len(starting) >= limit else 10 * limit))]
+        counts = Counter()
+        for ids in candidates:
+            counts.update(ids)
+        for movieID in starting:
+            # titles starting with the query have all of its grams
+            counts[movieID] = len(counted)
+        # the rest is only intersected with the candidates, which holds the GIL throughout and is
+        # safe while another thread adds to the index
+        found = set(counts)
+        for ids in postings[len(counted):]:
+            counts.update(found & ids)
+        matches = []
+        for movieID, count in counts.items():
+            if count >= needed:
+                key = self.keys.get(movieID, '')
+                # most shared trigrams first, then titles starting with the query, then shorter titles
+                matches.append((-count, not key.startswith(prefix), len(key), movieID))
+        best = heapq.nsmallest(limit, matches)
+        return [self.movies[match[-1]] for match in best]
+
+    def __len__(self):
+        return len(self.movies)
@@ -0,0 +1,46 @@
+"""updatequeue.py: queue of telegram updates shared by a receiving frontend and several bot workers."""
+
+import sqlite3
+import threading
+import logging
+log = logging.getLogger(__name__)
+
+class UpdateQueue(object):
+    """ Updates are stored with a partition (the telegram user id). Worker i of n only takes
+        partitions where partition % n == i, so all updates of a user go to the same worker in
+        order and its conversation state stays in that worker's memory.
+    """
+    def __init__(self, path='ombibot.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db   = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS updates (id INTEGER PRIMARY KEY AUTOINCREMENT, partition INTEGER, data TEXT)')
+
+    def put(self, partition, data):
+        with self.lock:
+            self.db.execute('INSERT INTO updates (partition, data) VALUES (?, ?)', (abs(int(partition)), data))
+
+    def take(self, worker, workers, limit=100):
+        """ Remove and return up to limit updates for this worker, oldest first
+        """
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.db.execute('SELECT id, data FROM updates WHERE partition % ? = ? ORDER BY id LIMIT ?',
+                                       (workers, worker, limit)).fetchall()
+                if rows:
+                    self.db.execute('DELETE FROM updates WHERE id <= ? AND partition % ? = ?', (rows[-1][0], workers, worker))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return [data for id, data in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM updates').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,91 @@
+"""userregistry.py: telegram user id to ombi user name mapping, reloaded when config.json changes."""
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+log = logging.getLogger(__name__)
+
+GUEST = 'guest'
+
+class UserRegistry(object):
+    """ Maps telegram user ids to ombi user names from the users section of the config file.
+        The file is only read again when its mtime changed, checked at most every pollInterval
+        seconds. Unknown users map to 'guest' and are not stored in the mapping, only in a
+        bounded list of recently seen guests.
+    """
+    def __init__(self, path='config.json', pollInterval=5, maxGuests=10000):
+        self.path         = path
+        self.pollInterval = pollInterval
+        self.maxGuests    = maxGuests
+        self.users        = {}
+        self.guests       = OrderedDict()
+        self.mtime        = None
+        self.lastCheck    = time.monotonic()
+        self.lock         = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """ Read the users section of the config file and swap it in at once
+        """
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path) as json_data_file:
+            data = json.load(json_data_file)
+        users = {}
+        for userId, name in data.get('users', {}).items():
+            try:
+                users[int(userId)] = name
+            except ValueError:
+                # e.g. the <telegram-userid> placeholder of the example config
+                log.warning("Skipping user %s of %s, not a telegram user id", userId,self.path)
+        # replacing the reference is atomic, readers see either the old or the new mapping
+        self.users = users
+        self.mtime = mtime
+        log.info("Loaded %s users from %s", len(users),self.path)
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self.lastCheck < self.pollInterval:
+            return
+        with self.lock:
+            if now - self.lastCheck < self.pollInterval:
+                return
+            self.lastCheck = now
+            try:
+                if os.stat(self.path).st_mtime != self.mtime:
+                    self.reload()
+            except Exception as e:
+                log.error("Unable to reload users from %s: %s", self.path,e)
+
+    def get(self, userId):
+        """ Return the ombi user name for a telegram user id
+        """
+        self._check()
+        name = self.users.get(userId)
+        if name is not None:
+            return name
+
+        with self.lock:
+            if userId in self.guests:
+                self.guests.move_to_end(userId)
+            else:
+                log.info("Assigned user with id %s to guest", userId)
+                self.guests[userId] = True
+                if len(self.guests) > self.maxGuests:
+                    self.guests.popitem(last=False)
+        return GUEST
+
+    def forget(self, userId):
+        """ Drop a user from the list of seen guests
+        """
+        with self.lock:
+            self.guests.pop(userId, None)
+
+    def __contains__(self, userId):
+        self._check()
+        return userId in self.users
+
+    def __len__(self):
+        return len(self.users)